@@ -0,0 +1,54 @@
+# access_log_maintenance.py
+"""
+Mantenimiento de access_log: particiones mensuales y retención.
+
+Uso (p. ej. como cron diario):
+    python access_log_maintenance.py                 # crea particiones y archiva lo vencido
+    python access_log_maintenance.py --dry-run       # solo muestra qué meses archivaría
+    python access_log_maintenance.py --retention-months 12 --archive-dir /data/archivo
+
+En Postgres (tras la migración b3f8d2a1c7e5) crea las particiones de los
+próximos ACCESS_LOG_PARTITIONS_AHEAD meses y, por cada mes anterior a
+ACCESS_LOG_RETENTION_MONTHS, escribe access_log_YYYY_MM.csv.gz en
+ACCESS_LOG_ARCHIVE_DIR y elimina la partición. En SQLite no hay
+particiones: se archiva y se borra por rango de fechas.
+"""
+import argparse
+import os
+
+# Recorre tablas enteras: sin el statement_timeout de las peticiones
+os.environ['DB_STATEMENT_TIMEOUT_MS'] = '0'
+
+from app import create_app  # noqa: E402
+from app.services import access_log_partitions  # noqa: E402
+
+app = create_app()
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--months-ahead', type=int, default=app.config['ACCESS_LOG_PARTITIONS_AHEAD'])
+parser.add_argument('--retention-months', type=int, default=app.config['ACCESS_LOG_RETENTION_MONTHS'])
+parser.add_argument('--archive-dir', default=app.config['ACCESS_LOG_ARCHIVE_DIR'])
+parser.add_argument('--dry-run', action='store_true')
+args = parser.parse_args()
+
+with app.app_context():
+    if access_log_partitions.is_partitioned():
+        if args.dry_run:
+            print("Particiones existentes:", sorted(m.isoformat() for m in access_log_partitions.existing_partitions()))
+        else:
+            created = access_log_partitions.ensure_partitions(args.months_ahead)
+            print(f"Particiones creadas: {created or 'ninguna'}")
+    else:
+        print("access_log no está particionada (SQLite o migración pendiente): retención por rango")
+
+    if args.retention_months <= 0:
+        print("Retención desactivada (--retention-months 0)")
+    else:
+        archived = access_log_partitions.archive_expired(
+            args.retention_months, args.archive_dir, dry_run=args.dry_run
+        )
+        for item in archived:
+            action = "archivaría" if args.dry_run else f"archivado en {item['archive']}"
+            print(f"  {item['month'][:7]}: {item['rows']} filas {action}")
+        if not archived:
+            print("Nada que archivar")
@@ -4,8 +4,10 @@ from flask_jwt_extended import JWTManager
 from flask_migrate import Migrate
 from flask_cors import CORS  
 from config import Config
+from app.services.db_routing import RoutingSession
 
-db = SQLAlchemy()
+# RoutingSession: lecturas de reportes a la réplica si está configurada
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 jwt = JWTManager()
 migrate = Migrate()
 
@@ -13,11 +15,46 @@ def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
 
+    # Detrás del proxy: remote_addr y esquema desde X-Forwarded-For/-Proto
+    if app.config.get('PROXY_FIX_HOPS'):
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        hops = app.config['PROXY_FIX_HOPS']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
+    # Métricas de espera del pool (debe ir antes de crear el engine)
+    from app.services.pool_metrics import init_pool_metrics
+    init_pool_metrics(app)
+
     # Inicializar extensiones
     db.init_app(app)
     jwt.init_app(app)
     migrate.init_app(app, db)
 
+    # Sentencias y tiempo en BD por petición/endpoint, detector de N+1
+    from app.services.sql_metrics import sql_metrics
+    sql_metrics.init_app(app)
+
+    from app.services.credential_cache import init_credential_cache
+    init_credential_cache(app)
+
+    from app.services.schedule_timeline import init_schedule_timeline
+    init_schedule_timeline(app)
+
+    from app.services.access_log_writer import access_log_writer
+    access_log_writer.init_app(app)
+
+    from app.services.failed_attempts import failed_attempts
+    failed_attempts.init_app(app)
+
+    from app.services.throttle import throttler
+    throttler.init_app(app)
+
+    from app.services.device_dispatcher import device_dispatcher
+    device_dispatcher.init_app(app)
+
+    from app.services.device_registry import device_registry
+    device_registry.init_app(app)
+
     # Habilitar CORS
     CORS(app, supports_credentials=True)
 
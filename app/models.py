@@ -1,13 +1,33 @@
 import enum
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from sqlalchemy import Text
+import pytz
+from sqlalchemy import Text, text
 from app import db
 
 from sqlalchemy import Index
 
 from werkzeug.security import generate_password_hash, check_password_hash
 
+LIMA_TZ = pytz.timezone("America/Lima")
+
+
+def _access_local_date(context):
+    """Fecha en Lima de AccessLog.timestamp (UTC sin zona)"""
+    ts = context.get_current_parameters().get('timestamp') or datetime.utcnow()
+    if ts.tzinfo is None:
+        ts = pytz.utc.localize(ts)
+    return ts.astimezone(LIMA_TZ).date()
+
+
+def _attendance_work_date(context):
+    """Fecha en Lima de la entrada; sin zona se asume hora local (como los reportes)"""
+    entry = context.get_current_parameters().get('entry_time') or datetime.now(LIMA_TZ)
+    if entry.tzinfo is not None:
+        entry = entry.astimezone(LIMA_TZ)
+    return entry.date()
+
+
 class AccessStatusEnum(enum.Enum):
     Permitido = "Permitido"
     Denegado = "Denegado"
@@ -85,6 +105,8 @@ class User_iot(db.Model):
         }
 
 
+# En Postgres access_log está particionada por mes sobre timestamp (PK id + timestamp);
+# ver app/services/access_log_partitions.py
 class AccessLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user_iot.id'), nullable=True, index=True)
@@ -97,10 +119,34 @@ class AccessLog(db.Model):
     reason = db.Column(db.String(255), nullable=True)
     action_type = db.Column(db.String(255), nullable=True)
     motivo_decision = db.Column(db.String(255))
+    # Día en Lima del acceso; los filtros por día usan (user_id, local_date)
+    local_date = db.Column(db.Date, nullable=True, default=_access_local_date)
 
 
     user = db.relationship('User_iot', backref='access_logs')
 
+class DeviceEvent(db.Model):
+    """Eventos subidos en lote por un lector (idempotencia por device_id + event_id)"""
+    __tablename__ = 'device_event'
+    device_id = db.Column(db.String(80), primary_key=True)
+    event_id = db.Column(db.String(64), primary_key=True)
+    event_time = db.Column(db.DateTime, nullable=False)  # hora del lector (UTC)
+    access_log_id = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(20), nullable=False)  # 'processed' o 'denied'
+    reason = db.Column(db.String(255), nullable=True)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PresenceState(db.Model):
+    """Último estado ENTRADA/SALIDA de cada usuario (se actualiza con cada acceso)"""
+    __tablename__ = 'presence_state'
+    user_id = db.Column(db.Integer, db.ForeignKey('user_iot.id', ondelete='CASCADE'), primary_key=True)
+    last_action = db.Column(db.String(10), nullable=True)
+    last_action_type = db.Column(db.String(255), nullable=True)
+    last_sensor = db.Column(db.String(20), nullable=True)
+    last_timestamp = db.Column(db.DateTime, nullable=True)
+    open_attendance_id = db.Column(db.Integer, db.ForeignKey('attendance.id', ondelete='SET NULL'), nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class Attendance(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user_iot.id'), nullable=False, index=True)
@@ -108,6 +154,23 @@ class Attendance(db.Model):
     exit_time = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     estado_entrada = db.Column(db.String(50))
+    # Jornada (día en Lima) a la que pertenece la entrada
+    work_date = db.Column(db.Date, nullable=True, default=_attendance_work_date)
+
+class AttendanceDaily(db.Model):
+    """Resumen por usuario y día local (Lima) que se actualiza con cada asistencia"""
+    __tablename__ = 'attendance_daily'
+    user_id = db.Column(db.Integer, db.ForeignKey('user_iot.id', ondelete='CASCADE'), primary_key=True)
+    work_date = db.Column(db.Date, primary_key=True, index=True)
+    first_entry = db.Column(db.DateTime, nullable=True)  # hora local de Lima sin zona
+    last_exit = db.Column(db.DateTime, nullable=True)
+    estado_entrada = db.Column(db.String(50))
+    minutes_late = db.Column(db.Integer, nullable=True)
+    worked_minutes = db.Column(db.Integer, nullable=False, default=0)
+    punches = db.Column(db.Integer, nullable=False, default=0)  # entradas del día
+    late = db.Column(db.Boolean, nullable=False, default=False)
+    open_entry = db.Column(db.Boolean, nullable=False, default=False)  # entrada sin salida
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class Huella(db.Model):
     __tablename__ = 'huella'
@@ -120,9 +183,31 @@ class Huella(db.Model):
         import base64
         return {"huella_id": self.id, "template": base64.b64encode(self.template).decode()}
 
+class FingerprintChange(db.Model):
+    """Registro de cambios de huellas para la sincronización incremental de los lectores"""
+    __tablename__ = 'fingerprint_change'
+    version = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    huella_id = db.Column(db.Integer, nullable=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 
 
 
+class Device(db.Model):
+    """Lector ESP32 registrado; health/firmware los actualiza el prober en segundo plano"""
+    __tablename__ = 'device'
+    id = db.Column(db.String(80), primary_key=True)  # mismo valor que AccessLog.device_id
+    base_url = db.Column(db.String(255), nullable=False)
+    nombre = db.Column(db.String(80), nullable=True)
+    firmware = db.Column(db.String(40), nullable=True)
+    health = db.Column(db.String(20), default='unknown')  # 'online', 'offline' o 'unknown'
+    last_seen = db.Column(db.DateTime, nullable=True)
+    last_checked = db.Column(db.DateTime, nullable=True)
+    last_latency_ms = db.Column(db.Float, nullable=True)
+    last_error = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class Schedule(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(80), nullable=False)
@@ -159,4 +244,27 @@ class FailedAttempt(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     reason = db.Column(db.String(255))
 
-Index('ix_access_user_date', AccessLog.user_id, AccessLog.timestamp)
\ No newline at end of file
+class FailedAttemptHit(db.Model):
+    """Un fallo dentro de la ventana deslizante compartida entre workers (FAILED_ATTEMPT_STORE='database')"""
+    __tablename__ = 'failed_attempt_hit'
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(200), nullable=False)  # 'id:rfid:XXXX' o 'device:D1'
+    hit_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+Index('ix_access_user_date', AccessLog.user_id, AccessLog.timestamp)
+
+# Índices de las consultas calientes (migración f1c3a9e7b2d4, ver check_query_plans.py)
+_DOOR_PERMITTED = text("status = 'Permitido' AND sensor_type IN ('Huella', 'RFID')")
+_OPEN_ATTENDANCE = text("exit_time IS NULL")
+Index('ix_access_log_door_permitted', AccessLog.user_id, AccessLog.timestamp,
+      postgresql_where=_DOOR_PERMITTED, sqlite_where=_DOOR_PERMITTED)
+Index('ix_attendance_user_entry', Attendance.user_id, Attendance.entry_time)
+Index('ix_attendance_open', Attendance.user_id, Attendance.work_date,
+      postgresql_where=_OPEN_ATTENDANCE, sqlite_where=_OPEN_ATTENDANCE)
+# Filtros por día local (migración a7d3e9c1f5b8)
+Index('ix_access_log_user_local_date', AccessLog.user_id, AccessLog.local_date)
+Index('ix_attendance_user_work_date', Attendance.user_id, Attendance.work_date)
+Index('ix_failed_attempt_identifier', FailedAttempt.identifier, FailedAttempt.identifier_type)
+Index('ix_user_schedule_user_dates', UserSchedule.user_id, UserSchedule.start_date, UserSchedule.end_date)
+# Ventanas compartidas de intentos fallidos (migración b6e2d9f4a8c3)
+Index('ix_failed_attempt_hit_key', FailedAttemptHit.key, FailedAttemptHit.hit_at)
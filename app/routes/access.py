@@ -1,15 +1,30 @@
 # app/routes/access.py
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime, timedelta
-from io import StringIO
-import csv
+from collections import namedtuple
+from math import ceil
 import pytz
+from sqlalchemy import select, literal, func, case, or_
+from sqlalchemy.exc import IntegrityError
 from app import db
-from app.models import AccessStatusEnum, User_iot, AccessLog, Role, UserSchedule, Schedule, FailedAttempt, Attendance
+from app.models import AccessStatusEnum, User_iot, AccessLog, Role, Attendance, PresenceState, DeviceEvent
+from app.services.credential_cache import credential_cache
+from app.services.access_log_writer import access_log_writer
+from app.services.failed_attempts import failed_attempts
+from app.services.throttle import throttler
+from app.services.pool_metrics import pool_metrics
+from app.services.sql_metrics import sql_metrics
+from app.services.db_routing import read_replica
+from app.services.schedule_timeline import schedule_timeline, local_date
+from app.services.compiled_schedule import compile_schedule, DAY_NAMES
+from app.services import presence
+from app.utils.csv_stream import csv_response
+from app.utils.pagination import decode_cursor, keyset_page, approximate_count
 
 bp = Blueprint('access', __name__)
 LIMA_TZ = pytz.timezone("America/Lima")
+EXPORT_BATCH_SIZE = 1000
 
 
 def _get_current_user_from_jwt():
@@ -22,23 +37,37 @@ def _get_current_user_from_jwt():
 
 
 def _record_failed_attempt(identifier, identifier_type, device_id=None, user_id=None, reason=None):
-    fa = FailedAttempt.query.filter_by(identifier=identifier, identifier_type=identifier_type).first()
-    if not fa:
-        fa = FailedAttempt(
-            user_id=user_id,
-            identifier=identifier,
-            identifier_type=identifier_type,
-            device_id=device_id,
-            count=1,
-            reason=reason
-        )
-        db.session.add(fa)
-    else:
-        fa.count = fa.count + 1
-        fa.timestamp = datetime.utcnow()
-        fa.reason = reason or fa.reason
-    db.session.commit()
-    return fa.count
+    """Conteo de fallos en la ventana deslizante (ver services/failed_attempts)"""
+    return failed_attempts.record(
+        identifier, identifier_type, device_id=device_id, user_id=user_id, reason=reason
+    )
+
+
+def _utc_naive(dt):
+    """
+    Cota comparable con AccessLog.timestamp (UTC sin zona). Comparar contra
+    un valor con zona obliga a Postgres a convertir la columna, lo que
+    impide usar el índice y la poda de particiones.
+    """
+    if dt.tzinfo is not None:
+        return dt.astimezone(pytz.utc).replace(tzinfo=None)
+    return dt
+
+
+def _filter_local_day(query, date_str):
+    """
+    Accesos del día YYYY-MM-DD en Lima: igualdad sobre local_date (índice
+    con user_id) más el rango UTC equivalente de timestamp, que permite
+    podar particiones. Lanza ValueError si la fecha es inválida.
+    """
+    day = datetime.strptime(date_str, '%Y-%m-%d')
+    start = _utc_naive(LIMA_TZ.localize(day))
+    end = _utc_naive(LIMA_TZ.localize(day + timedelta(days=1)))
+    return query.filter(
+        AccessLog.local_date == day.date(),
+        AccessLog.timestamp >= start,
+        AccessLog.timestamp < end
+    )
 
 
 # Modified: helper robusto para chequear si el usuario está activo (cubre distintos nombres de campo)
@@ -90,6 +119,7 @@ def assign_rfid():
 
 
 @bp.route('/fingerprint-access', methods=['POST'])
+@throttler.limit()
 def fingerprint_access():
     data = request.get_json() or {}
     huella_id = data.get('huella_id')
@@ -97,12 +127,13 @@ def fingerprint_access():
     if huella_id is None:
         return jsonify(success=False, reason='Falta huella_id'), 400
 
-    user = User_iot.query.filter_by(huella_id=huella_id).first()
+    user = credential_cache.by_huella(huella_id)
 
     if not user:
         failed_count = _record_failed_attempt(
             identifier=str(huella_id),
             identifier_type='huella',
+            device_id=data.get('device_id'),
             reason='Huella no registrada'
         )
         return jsonify({
@@ -117,6 +148,7 @@ def fingerprint_access():
         failed_count = _record_failed_attempt(
             identifier=str(huella_id),
             identifier_type='huella',
+            device_id=data.get('device_id'),
             user_id=user.id,
             reason='Usuario inactivo'
         )
@@ -127,17 +159,8 @@ def fingerprint_access():
             "failed_count": failed_count
         }), 403
 
-    last_access = AccessLog.query.filter(
-        AccessLog.user_id == user.id,
-        AccessLog.status == 'Permitido'
-    ).order_by(AccessLog.timestamp.desc()).first()
-
-    if not last_access or last_access.action_type == 'SALIDA':
-        action_type = 'ENTRADA'
-        message = "Entrada permitida"
-    else:
-        action_type = 'SALIDA'
-        message = "Salida permitida"
+    action_type = presence.next_action(presence.get_presence(user.id))
+    message = "Entrada permitida" if action_type == 'ENTRADA' else "Salida permitida"
 
     log = AccessLog(
         user_id=user.id,
@@ -149,8 +172,7 @@ def fingerprint_access():
         action_type=action_type
     )
 
-    db.session.add(log)
-    db.session.commit()
+    access_log_writer.write(log)
 
     return jsonify({
         "success": True,
@@ -164,18 +186,20 @@ def fingerprint_access():
 
 
 @bp.route('/rfid-access', methods=['POST'])
+@throttler.limit()
 def rfid_access():
     data = request.get_json() or {}
     rfid = data.get('rfid')
     if not rfid:
         return jsonify(success=False, reason='No se envió RFID'), 400
 
-    user = User_iot.query.filter_by(rfid=rfid).first()
+    user = credential_cache.by_rfid(rfid)
 
     if not user:
         failed_count = _record_failed_attempt(
             identifier=rfid,
             identifier_type='rfid',
+            device_id=data.get('device_id'),
             reason='RFID no registrado'
         )
         return jsonify({
@@ -190,6 +214,7 @@ def rfid_access():
         failed_count = _record_failed_attempt(
             identifier=rfid,
             identifier_type='rfid',
+            device_id=data.get('device_id'),
             user_id=user.id,
             reason='Usuario inactivo'
         )
@@ -200,18 +225,8 @@ def rfid_access():
             "failed_count": failed_count
         }), 403
 
-    last_access = AccessLog.query.filter(
-        AccessLog.user_id == user.id,
-        AccessLog.status == 'Permitido',
-        AccessLog.sensor_type == 'RFID'
-    ).order_by(AccessLog.timestamp.desc()).first()
-
-    if not last_access or last_access.action_type == 'SALIDA':
-        action_type = 'ENTRADA'
-        message = "Entrada permitida por RFID"
-    else:
-        action_type = 'SALIDA'
-        message = "Salida permitida por RFID"
+    action_type = presence.next_action(presence.get_presence(user.id))
+    message = "Entrada permitida por RFID" if action_type == 'ENTRADA' else "Salida permitida por RFID"
 
     log = AccessLog(
         user_id=user.id,
@@ -222,8 +237,7 @@ def rfid_access():
         reason=None,
         action_type=action_type
     )
-    db.session.add(log)
-    db.session.commit()
+    access_log_writer.write(log)
 
     return jsonify({
         "success": True,
@@ -237,26 +251,18 @@ def rfid_access():
 
 
 def determinar_accion_usuario(user_id, sensor_type='Huella'):
-
-    last_access = AccessLog.query.filter(
-        AccessLog.user_id == user_id,
-        AccessLog.status == 'Permitido',
-        AccessLog.sensor_type == sensor_type
-    ).order_by(AccessLog.timestamp.desc()).first()
-
-    if not last_access or last_access.action_type == 'SALIDA':
-        return 'ENTRADA'
-    else:
-        return 'SALIDA'
+    # La presencia es por usuario: Huella y RFID comparten el mismo toggle
+    return presence.next_action(presence.get_presence(user_id))
 
 
 @bp.route('/secure-zone', methods=['POST'])
+@throttler.limit()
 def secure_zone_access():
     data = request.get_json() or {}
     huella_id = data.get('huella_id')
     rfid = data.get('rfid')
 
-    user = User_iot.query.filter_by(huella_id=huella_id).first()
+    user = credential_cache.by_huella(huella_id)
 
     if not user:
         return jsonify({
@@ -273,7 +279,7 @@ def secure_zone_access():
             "buzzer": "error"
         }), 403
 
-    if user.role.name != "admin":
+    if user.role_name != "admin":
         return jsonify({
             "access": False,
             "reason": "Solo administradores",
@@ -295,8 +301,7 @@ def secure_zone_access():
         huella_id=huella_id,
         rfid=rfid
     )
-    db.session.add(log)
-    db.session.commit()
+    access_log_writer.write(log)
 
     return jsonify({
         "access": True,
@@ -309,6 +314,7 @@ def secure_zone_access():
 
 
 @bp.route('/fingerprint-attendance', methods=['POST'])
+@throttler.limit()
 def fingerprint_attendance():
 
     return jsonify({
@@ -330,7 +336,10 @@ def access_history():
     if user_id:
         query = query.filter_by(user_id=user_id)
     if date:
-        query = query.filter(db.func.date(AccessLog.timestamp) == date)
+        try:
+            query = _filter_local_day(query, date)
+        except ValueError:
+            return jsonify(msg='Fecha inválida. Use YYYY-MM-DD'), 400
     if sensor_type:
         query = query.filter_by(sensor_type=sensor_type)
 
@@ -351,6 +360,7 @@ def access_history():
 
 @bp.route('/export/csv', methods=['GET'])
 @jwt_required()
+@read_replica
 def export_csv():
     user_id = request.args.get('user_id')
     date = request.args.get('date')
@@ -360,17 +370,17 @@ def export_csv():
     if user_id:
         query = query.filter_by(user_id=user_id)
     if date:
-        query = query.filter(db.func.date(AccessLog.timestamp) == date)
+        try:
+            query = _filter_local_day(query, date)
+        except ValueError:
+            return jsonify(msg='Fecha inválida. Use YYYY-MM-DD'), 400
     if sensor_type:
         query = query.filter_by(sensor_type=sensor_type)
 
-    logs = query.order_by(AccessLog.timestamp.desc()).all()
+    logs = query.order_by(AccessLog.timestamp.desc()).yield_per(EXPORT_BATCH_SIZE)
 
-    si = StringIO()
-    cw = csv.writer(si)
-    cw.writerow(['id', 'user_id', 'timestamp', 'sensor_type', 'status', 'rfid', 'reason'])
-    for log in logs:
-        cw.writerow([
+    def build_row(log):
+        return [
             log.id,
             log.user_id,
             log.timestamp.isoformat() if log.timestamp else '',
@@ -378,19 +388,24 @@ def export_csv():
             str(log.status) if hasattr(log.status, 'value') else log.status,
             log.rfid,
             log.reason
-        ])
-    output = si.getvalue()
-    return Response(output, mimetype="text/csv",
-                    headers={"Content-Disposition": "attachment;filename=access_logs.csv"})
+        ]
+
+    return csv_response(
+        'access_logs.csv',
+        ['id', 'user_id', 'timestamp', 'sensor_type', 'status', 'rfid', 'reason'],
+        logs,
+        build_row
+    )
 
 
-def register_attendance_from_access(access_log):
+def register_attendance_from_access(access_log, commit=True, update_presence=True):
     from app.routes.attendance import register_attendance_from_access as new_attendance_func
-    return new_attendance_func(access_log)
+    return new_attendance_func(access_log, commit=commit, update_presence=update_presence)
 
 
 @bp.route('/admin/reports', methods=['GET'])
 @jwt_required()
+@read_replica
 def access_reports():
 
     try:
@@ -426,40 +441,82 @@ def access_reports():
         if start_date_str:
             try:
                 start_date = datetime.fromisoformat(start_date_str.replace('Z', '+00:00'))
-                query = query.filter(AccessLog.timestamp >= start_date)
+                query = query.filter(AccessLog.timestamp >= _utc_naive(start_date))
             except ValueError:
                 try:
                     start_date = datetime.strptime(start_date_str, '%Y-%m-%dT%H:%M:%S.%fZ')
-                    query = query.filter(AccessLog.timestamp >= start_date)
+                    query = query.filter(AccessLog.timestamp >= _utc_naive(start_date))
                 except:
                     return jsonify(msg='Formato de fecha inicial inválido. Use ISO format'), 400
 
         if end_date_str:
             try:
                 end_date = datetime.fromisoformat(end_date_str.replace('Z', '+00:00'))
-                query = query.filter(AccessLog.timestamp <= end_date)
+                query = query.filter(AccessLog.timestamp <= _utc_naive(end_date))
             except ValueError:
                 try:
                     end_date = datetime.strptime(end_date_str, '%Y-%m-%dT%H:%M:%S.%fZ')
-                    query = query.filter(AccessLog.timestamp <= end_date)
+                    query = query.filter(AccessLog.timestamp <= _utc_naive(end_date))
                 except:
                     return jsonify(msg='Formato de fecha final inválido. Use ISO format'), 400
 
-        query = query.order_by(AccessLog.timestamp.desc())
+        if page < 1:
+            page = 1
+        if per_page < 1:
+            per_page = 20
 
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        # Con ?cursor= (vacío para la primera página) se pagina por keyset
+        cursor = request.args.get('cursor')
+        cursor_values = None
+        if cursor:
+            try:
+                cursor_values = decode_cursor(cursor, (datetime, int))
+            except ValueError:
+                return jsonify(msg='Cursor inválido'), 400
+
+        statistics = None
+        total_count = None
+        if not cursor:
+            # Estadísticas en una sola pasada sobre access_log
+            stats = query.with_entities(
+                func.count(AccessLog.id),
+                func.count(case((AccessLog.status == AccessStatusEnum.Permitido, 1))),
+                func.count(case((AccessLog.status == AccessStatusEnum.Denegado, 1))),
+                func.count(case((AccessLog.sensor_type == 'Huella', 1))),
+                func.count(case((AccessLog.sensor_type == 'RFID', 1)))
+            ).one()
+            total_count, allowed_count, denied_count, fingerprint_count, rfid_count = stats
+            statistics = {
+                'total': total_count,
+                'allowed': allowed_count,
+                'denied': denied_count,
+                'fingerprint': fingerprint_count,
+                'rfid': rfid_count
+            }
 
-        total_count = query.count()
+        # Página de datos con el usuario en el mismo JOIN (sin N+1)
+        rows_query = query.outerjoin(
+            User_iot, AccessLog.user_id == User_iot.id
+        ).add_columns(
+            User_iot.nombre, User_iot.apellido, User_iot.username
+        )
 
-        allowed_count = query.filter(AccessLog.status == AccessStatusEnum.Permitido).count()
-        denied_count = query.filter(AccessLog.status == AccessStatusEnum.Denegado).count()
-        fingerprint_count = query.filter(AccessLog.sensor_type == 'Huella').count()
-        rfid_count = query.filter(AccessLog.sensor_type == 'RFID').count()
+        next_cursor = None
+        if cursor is None:
+            rows = rows_query.order_by(
+                AccessLog.timestamp.desc()
+            ).limit(per_page).offset((page - 1) * per_page).all()
+        else:
+            rows, next_cursor = keyset_page(
+                rows_query,
+                [AccessLog.timestamp, AccessLog.id],
+                cursor_values,
+                per_page,
+                key=lambda row: (row[0].timestamp, row[0].id)
+            )
 
         results = []
-        for log in pagination.items:
-            user = User_iot.query.get(log.user_id) if log.user_id else None
-
+        for log, nombre, apellido, username in rows:
             access_method = 'Desconocido'
             if log.huella_id:
                 access_method = f'Huella ID: {log.huella_id}'
@@ -488,8 +545,8 @@ def access_reports():
             results.append({
                 'id': log.id,
                 'user_id': log.user_id,
-                'user_name': f"{user.nombre} {user.apellido}" if user else 'Usuario no encontrado',
-                'user_username': user.username if user else None,
+                'user_name': f"{nombre} {apellido}" if nombre is not None else 'Usuario no encontrado',
+                'user_username': username,
                 'timestamp': log.timestamp.isoformat() if log.timestamp else None,
                 'local_time': lima_time.strftime('%Y-%m-%d %H:%M:%S') if lima_time else None,
                 'sensor_type': log.sensor_type,
@@ -500,22 +557,33 @@ def access_reports():
                 'full_action_type': log.action_type
             })
 
+        if cursor is None:
+            pagination = {
+                'page': page,
+                'per_page': per_page,
+                'total': total_count,
+                'pages': ceil(total_count / per_page) if total_count else 0
+            }
+        else:
+            pagination = {
+                'per_page': per_page,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None
+            }
+            # Total opcional: ?total=approx (estimación) o ?total=exact
+            total_mode = request.args.get('total')
+            if total_mode == 'exact':
+                pagination['total'] = total_count if total_count is not None else query.order_by(None).count()
+                pagination['total_is_estimate'] = False
+            elif total_mode == 'approx':
+                pagination['total'] = total_count if total_count is not None else approximate_count(query)
+                pagination['total_is_estimate'] = total_count is None
+
         return jsonify({
             'success': True,
             'data': results,
-            'pagination': {
-                'page': pagination.page,
-                'per_page': pagination.per_page,
-                'total': pagination.total,
-                'pages': pagination.pages
-            },
-            'statistics': {
-                'total': total_count,
-                'allowed': allowed_count,
-                'denied': denied_count,
-                'fingerprint': fingerprint_count,
-                'rfid': rfid_count
-            }
+            'pagination': pagination,
+            'statistics': statistics
         }), 200
 
     except Exception as e:
@@ -530,6 +598,7 @@ def access_reports():
 
 @bp.route('/admin/reports/export', methods=['GET'])
 @jwt_required()
+@read_replica
 def export_access_reports():
 
     current_user = _get_current_user_from_jwt()
@@ -543,8 +612,22 @@ def export_access_reports():
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
 
-    # Construir consulta
-    query = AccessLog.query
+    # Construir consulta (columnas del log + usuario en el mismo JOIN)
+    query = db.session.query(
+        AccessLog.id,
+        AccessLog.user_id,
+        AccessLog.timestamp,
+        AccessLog.sensor_type,
+        AccessLog.status,
+        AccessLog.huella_id,
+        AccessLog.rfid,
+        AccessLog.action_type,
+        AccessLog.reason,
+        AccessLog.motivo_decision,
+        User_iot.nombre,
+        User_iot.apellido,
+        User_iot.username
+    ).outerjoin(User_iot, AccessLog.user_id == User_iot.id)
 
     if user_id:
         query = query.filter(AccessLog.user_id == user_id)
@@ -558,25 +641,20 @@ def export_access_reports():
     if start_date_str:
         try:
             start_date = datetime.fromisoformat(start_date_str.replace('Z', '+00:00'))
-            query = query.filter(AccessLog.timestamp >= start_date)
+            query = query.filter(AccessLog.timestamp >= _utc_naive(start_date))
         except:
             return jsonify(msg='Fecha inicial inválida'), 400
 
     if end_date_str:
         try:
             end_date = datetime.fromisoformat(end_date_str.replace('Z', '+00:00'))
-            query = query.filter(AccessLog.timestamp <= end_date)
+            query = query.filter(AccessLog.timestamp <= _utc_naive(end_date))
         except:
             return jsonify(msg='Fecha final inválida'), 400
 
-    logs = query.order_by(AccessLog.timestamp.desc()).all()
-
-    # Crear CSV
-    si = StringIO()
-    cw = csv.writer(si)
+    logs = query.order_by(AccessLog.timestamp.desc()).yield_per(EXPORT_BATCH_SIZE)
 
-    # Encabezados
-    cw.writerow([
+    header = [
         'ID',
         'Usuario ID',
         'Nombre Usuario',
@@ -589,12 +667,9 @@ def export_access_reports():
         'Tipo de Acción',
         'Detalles',
         'Motivo'
-    ])
-
-    # Filas
-    for log in logs:
-        user = User_iot.query.get(log.user_id) if log.user_id else None
+    ]
 
+    def build_row(log):
         # Método de acceso
         access_method = ''
         if log.huella_id:
@@ -624,11 +699,11 @@ def export_access_reports():
         # Convertir enum a string
         status_str = log.status.value if hasattr(log.status, 'value') else str(log.status)
 
-        cw.writerow([
+        return [
             log.id,
             log.user_id,
-            f"{user.nombre} {user.apellido}" if user else 'N/A',
-            user.username if user else 'N/A',
+            f"{log.nombre} {log.apellido}" if log.nombre is not None else 'N/A',
+            log.username if log.username is not None else 'N/A',
             log.timestamp.isoformat() if log.timestamp else '',
             lima_time.strftime('%Y-%m-%d %H:%M:%S') if lima_time else '',
             log.sensor_type,
@@ -637,18 +712,58 @@ def export_access_reports():
             action,
             log.action_type or '',
             log.reason or log.motivo_decision or ''
-        ])
-
-    output = si.getvalue()
+        ]
 
     # Generar nombre de archivo con fecha
     filename = f"reporte_accesos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
 
-    return Response(
-        output,
-        mimetype="text/csv",
-        headers={"Content-Disposition": f"attachment;filename={filename}"}
-    )
+    return csv_response(filename, header, logs, build_row)
+
+
+@bp.route('/admin/ingestion-stats', methods=['GET'])
+@jwt_required()
+def access_log_ingestion_stats():
+    """Métricas de la cola de escritura diferida de AccessLog"""
+    current_user = _get_current_user_from_jwt()
+    if not current_user or not current_user.is_admin:
+        return jsonify(msg='Acceso denegado - Solo administradores'), 403
+
+    return jsonify({
+        'success': True,
+        'ingestion': access_log_writer.stats(),
+        'failed_attempts': failed_attempts.stats(),
+        'throttle': throttler.stats()
+    }), 200
+
+
+@bp.route('/admin/db-pool', methods=['GET'])
+@jwt_required()
+def db_pool_stats():
+    """Estado del pool de conexiones y esperas de checkout de este worker"""
+    current_user = _get_current_user_from_jwt()
+    if not current_user or not current_user.is_admin:
+        return jsonify(msg='Acceso denegado - Solo administradores'), 403
+
+    return jsonify({
+        'success': True,
+        'db_pool': pool_metrics.stats(db.engine)
+    }), 200
+
+
+@bp.route('/admin/sql-metrics', methods=['GET', 'DELETE'])
+@jwt_required()
+def sql_metrics_stats():
+    """Sentencias, tiempo en BD y posibles N+1 por endpoint (DELETE reinicia)"""
+    current_user = _get_current_user_from_jwt()
+    if not current_user or not current_user.is_admin:
+        return jsonify(msg='Acceso denegado - Solo administradores'), 403
+
+    if request.method == 'DELETE':
+        sql_metrics.reset()
+    return jsonify({
+        'success': True,
+        'sql': sql_metrics.stats()
+    }), 200
 
 
 @bp.route('/setup', methods=['POST'])
@@ -678,11 +793,13 @@ def setup_system():
     }), 201
 
 
-def decidir_accion_automatica(user, timestamp):
+def decidir_accion_automatica(user, timestamp, snapshot=None):
     """Determina la acción automática considerando cambios de horario"""
 
-    # Obtener horario activo
-    schedule = get_user_schedule(user.id, timestamp)
+    # Obtener horario activo (del snapshot si ya fue cargado)
+    if snapshot is None:
+        snapshot = load_decision_snapshot(user.id, timestamp)
+    schedule = snapshot.schedule
 
     if not is_user_active(user):  # Modified
         return {
@@ -691,7 +808,7 @@ def decidir_accion_automatica(user, timestamp):
             'razon': 'Usuario inactivo',
             'denegar_acceso': True
         }
-    if user.role.name == "admin":
+    if user.role_name == "admin":
         return {
             'tipo': 'ACCESO',
             'registrar_asistencia': False,
@@ -705,69 +822,22 @@ def decidir_accion_automatica(user, timestamp):
             'razon': 'Usuario sin horario asignado'
         }
 
-    # Verificar si el horario comenzó hoy
-    local_date = timestamp.astimezone(LIMA_TZ).date()
-    user_schedules = UserSchedule.query.filter(
-        UserSchedule.user_id == user.id,
-        UserSchedule.schedule_id == schedule.id,
-        UserSchedule.start_date <= local_date,
-        (UserSchedule.end_date == None) | (UserSchedule.end_date >= local_date)
-    ).first()
-
-    # Si el horario comenzó hoy, considerar horario completo
-    if user_schedules and user_schedules.start_date == local_date:
-        # Verificar si ya ha registrado entrada con este nuevo horario
-        hoy_inicio = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
-        hoy_fin = hoy_inicio + timedelta(days=1)
-
-        existing_entries = Attendance.query.filter(
-            Attendance.user_id == user.id,
-            Attendance.entry_time >= hoy_inicio,
-            Attendance.entry_time <= hoy_fin,
-            Attendance.estado_entrada != 'salida_registrada'
-        ).order_by(Attendance.entry_time.desc()).all()
-
-        # Si ya hay una entrada registrada hoy, verificar con qué horario
-        for entry in existing_entries:
-            entry_time_lima = entry.entry_time.astimezone(LIMA_TZ)
-            entry_schedule = get_user_schedule(user.id, entry_time_lima)
-
-            # Si la entrada anterior fue con un horario diferente
-            # y el nuevo horario comenzó hoy, permitir nueva entrada
-            if entry_schedule and entry_schedule.id != schedule.id:
-                # Resetear la lógica, permitir nueva entrada con nuevo horario
-                pass
-
-    # Resto de la lógica original...
-    dias = [d.strip() for d in schedule.dias.split(',')]
-    dia_text = ['Lun','Mar','Mie','Jue','Vie','Sab','Dom'][timestamp.weekday()]
-
-    if dia_text not in dias:
+    # Si el horario comenzó hoy (snapshot.schedule_starts_today) se aplica el
+    # horario completo: la ventana de entrada se evalúa igual que cualquier día.
+
+    compiled = compile_schedule(schedule)
+    if not compiled.works_on(timestamp):
+        dia_text = DAY_NAMES[timestamp.weekday()]
         return {
             'tipo': 'ACCESO',
             'registrar_asistencia': False,
             'razon': f'No es día laboral ({dia_text})'
         }
 
-    # Lógica original para determinar si es entrada o salida...
     hora_entrada = schedule.hora_entrada
     hora_salida = schedule.hora_salida
-    tolerancia_entrada = schedule.tolerancia_entrada or 0
-    tolerancia_salida = schedule.tolerancia_salida or 0
-
-    inicio_jornada = datetime.combine(timestamp.date(), hora_entrada)
-    fin_jornada = datetime.combine(timestamp.date(), hora_salida)
-
-    inicio_jornada = LIMA_TZ.localize(inicio_jornada)
-    fin_jornada = LIMA_TZ.localize(fin_jornada)
-
-    ventana_entrada_inicio = inicio_jornada - timedelta(minutes=10)
-    ventana_entrada_fin = inicio_jornada + timedelta(minutes=tolerancia_entrada)
 
-    ventana_salida_inicio = fin_jornada - timedelta(minutes=1)
-    ventana_salida_fin = fin_jornada + timedelta(minutes=tolerancia_salida)
-
-    if ventana_entrada_inicio <= timestamp <= ventana_entrada_fin:
+    if compiled.in_entry_window(timestamp):
         return {
             'tipo': 'ACCESO_Y_ASISTENCIA',
             'registrar_asistencia': True,
@@ -777,7 +847,7 @@ def decidir_accion_automatica(user, timestamp):
             'hora_salida_real': hora_salida.strftime('%H:%M')
         }
 
-    elif ventana_salida_inicio <= timestamp <= ventana_salida_fin:
+    elif compiled.in_exit_window(timestamp):
         return {
             'tipo': 'ACCESO_Y_ASISTENCIA',
             'registrar_asistencia': True,
@@ -787,7 +857,7 @@ def decidir_accion_automatica(user, timestamp):
             'hora_salida_real': hora_salida.strftime('%H:%M')
         }
     else:
-        if inicio_jornada <= timestamp <= fin_jornada + timedelta(minutes=tolerancia_salida):
+        if compiled.in_workday(timestamp):
             return {
                 'tipo': 'ACCESO',
                 'registrar_asistencia': False,
@@ -807,53 +877,137 @@ def decidir_accion_automatica(user, timestamp):
             }
 
 
-def get_user_schedule(user_id, dt):
-    """Obtiene el horario activo de un usuario para una fecha/hora específica"""
-    from app.models import UserSchedule, Schedule
+DecisionSnapshot = namedtuple(
+    'DecisionSnapshot',
+    ['schedule', 'schedule_starts_today', 'presence', 'open_attendance_id']
+)
 
-    # Convertir a fecha local
-    local_date = dt.astimezone(LIMA_TZ).date() if dt.tzinfo else dt.date()
 
-    # Obtener horarios activos ordenados por start_date descendente
-    active_schedules = UserSchedule.query.filter(
-        UserSchedule.user_id == user_id,
-        UserSchedule.start_date <= local_date,
-        (UserSchedule.end_date == None) | (UserSchedule.end_date >= local_date)
-    ).order_by(UserSchedule.start_date.desc()).all()
+def load_decision_snapshot(user_id, dt):
+    """
+    Carga lo que necesita una decisión de auto-access:
+      1. horario activo, desde la línea de tiempo en memoria (schedule_timeline)
+      2. estado de presencia (presence_state) y asistencia abierta de hoy,
+         en una sola consulta
+    """
+    # 1) El intervalo vigente es el de start_date más reciente (si empezó hoy, es ese)
+    active = schedule_timeline.active_interval(user_id, dt)
 
-    if not active_schedules:
-        return None
+    # 2) Presencia (por clave primaria) y asistencia abierta en una sola sentencia
+    open_attendance = select(Attendance.id).where(
+        Attendance.user_id == user_id,
+        Attendance.work_date == local_date(dt),
+        Attendance.exit_time.is_(None)
+    ).limit(1).scalar_subquery()
+
+    anchor = select(literal(1).label('one')).subquery()
+    row = db.session.execute(
+        select(
+            PresenceState.user_id,
+            PresenceState.last_action,
+            PresenceState.last_action_type,
+            PresenceState.last_sensor,
+            PresenceState.last_timestamp,
+            PresenceState.open_attendance_id,
+            open_attendance.label('today_open_attendance_id')
+        ).select_from(
+            anchor.outerjoin(PresenceState, PresenceState.user_id == user_id)
+        )
+    ).one()
 
-    # Priorizar horario que empiece HOY
-    for schedule in active_schedules:
-        if schedule.start_date == local_date:
-            return Schedule.query.get(schedule.schedule_id)
+    state = None
+    if row.user_id is not None:
+        state = presence.PresenceView(
+            row.last_action, row.last_action_type, row.last_sensor,
+            row.last_timestamp, row.open_attendance_id
+        )
 
-    # Si no hay horario que empiece hoy, usar el más reciente
-    return Schedule.query.get(active_schedules[0].schedule_id)
+    return DecisionSnapshot(
+        schedule=active.schedule if active else None,
+        schedule_starts_today=bool(active and active.start_date == local_date(dt)),
+        presence=presence.merge_pending(user_id, state),
+        open_attendance_id=row.today_open_attendance_id
+    )
 
 
 def determinar_accion_acceso(user_id):
-    last_access = AccessLog.query.filter(
+    return presence.next_action(presence.get_presence(user_id))
+
+
+def _presence_before(user_id, timestamp):
+    """
+    Estado de presencia tal como estaba justo antes de `timestamp` (UTC sin
+    zona): el último acceso de puerta permitido anterior, por
+    ix_access_log_door_permitted. Para eventos que llegan con atraso.
+    """
+    row = db.session.query(
+        AccessLog.action_type, AccessLog.sensor_type, AccessLog.timestamp
+    ).filter(
         AccessLog.user_id == user_id,
-        AccessLog.status == 'Permitido',
-        AccessLog.sensor_type.in_(['Huella', 'RFID'])
-    ).order_by(AccessLog.timestamp.desc()).first()
+        AccessLog.status == AccessStatusEnum.Permitido,
+        AccessLog.sensor_type.in_(presence.DOOR_SENSORS),
+        AccessLog.timestamp < timestamp
+    ).order_by(AccessLog.timestamp.desc(), AccessLog.id.desc()).first()
+    if row is None:
+        return None
+    return presence.PresenceView(
+        presence.action_from_type(row.action_type), row.action_type,
+        row.sensor_type, row.timestamp, None
+    )
+
+
+def _open_attendance_at(user_id, timestamp):
+    """
+    Asistencia que estaba abierta en `timestamp` (UTC sin zona): la del
+    día local con entrada anterior y sin salida o con salida posterior.
+    """
+    lima_dt = pytz.utc.localize(timestamp).astimezone(LIMA_TZ)
+    local_time = lima_dt.replace(tzinfo=None)
+    return db.session.query(Attendance.id).filter(
+        Attendance.user_id == user_id,
+        Attendance.work_date == lima_dt.date(),
+        Attendance.entry_time <= local_time,
+        or_(Attendance.exit_time.is_(None), Attendance.exit_time > local_time)
+    ).order_by(Attendance.entry_time.desc()).limit(1).scalar()
+
+
+def _resolve_door_access(user, timestamp, snapshot=None):
+    """
+    ENTRADA/SALIDA y decisión de asistencia para un acceso de puerta en
+    `timestamp` (UTC sin zona). Devuelve (hora Lima, snapshot, acción, decisión).
+    """
+    lima_timestamp = pytz.utc.localize(timestamp).astimezone(LIMA_TZ)
 
-    if not last_access:
-        return 'ENTRADA'
+    # Horario, último acceso y asistencia abierta en un solo viaje a la BD
+    if snapshot is None:
+        snapshot = load_decision_snapshot(user.id, lima_timestamp)
+    access_action = presence.next_action(snapshot.presence)
 
-    if last_access.action_type:
-        if 'ENTRADA' in last_access.action_type:
-            return 'SALIDA'
-        elif 'SALIDA' in last_access.action_type:
-            return 'ENTRADA'
+    decision = decidir_accion_automatica(user, lima_timestamp, snapshot)
 
-    total_accesos = AccessLog.query.filter_by(user_id=user_id, status='Permitido').count()
-    return 'SALIDA' if total_accesos % 2 == 1 else 'ENTRADA'
+    asistencia_abierta = snapshot.open_attendance_id is not None
+
+    if decision['registrar_asistencia']:
+        if decision.get('accion_asistencia') == 'salida' and not asistencia_abierta:
+            decision['registrar_asistencia'] = False
+            decision['tipo'] = 'ACCESO'
+            decision['razon'] = 'No tiene entrada registrada para marcar salida'
+        elif decision.get('accion_asistencia') == 'entrada' and asistencia_abierta:
+            decision['registrar_asistencia'] = False
+            decision['tipo'] = 'ACCESO'
+            decision['razon'] = 'Ya tiene asistencia abierta hoy'
+    else:
+        if access_action == 'SALIDA' and asistencia_abierta:
+            decision['registrar_asistencia'] = True
+            decision['tipo'] = 'ACCESO_Y_ASISTENCIA'
+            decision['razon'] = 'Cierre de jornada laboral'
+            decision['accion_asistencia'] = 'salida'
+
+    return lima_timestamp, snapshot, access_action, decision
 
 
 @bp.route('/auto-access', methods=['POST'])
+@throttler.limit()
 def auto_access():
     data = request.get_json() or {}
     huella_id = data.get('huella_id')
@@ -862,9 +1016,9 @@ def auto_access():
     es_zona_segura = (huella_id is not None and rfid is not None)
 
     if es_zona_segura:
-        user = User_iot.query.filter_by(huella_id=huella_id).first()
+        user = credential_cache.by_huella(huella_id)
 
-        if not user or user.role.name != "admin":
+        if not user or user.role_name != "admin":
             return jsonify({
                 "success": False,
                 "reason": "Acceso denegado - Zona solo para administradores",
@@ -895,8 +1049,7 @@ def auto_access():
             rfid=rfid,
             action_type="ACCESO_ZONA_SEGURA"
         )
-        db.session.add(log)
-        db.session.commit()
+        access_log_writer.write(log)
 
         return jsonify({
             "success": True,
@@ -909,11 +1062,11 @@ def auto_access():
         }), 200
 
     if huella_id:
-        user = User_iot.query.filter_by(huella_id=huella_id).first()
+        user = credential_cache.by_huella(huella_id)
         sensor_type = 'Huella'
         identifier = str(huella_id)
     elif rfid:
-        user = User_iot.query.filter_by(rfid=rfid).first()
+        user = credential_cache.by_rfid(rfid)
         sensor_type = 'RFID'
         identifier = rfid
     else:
@@ -923,6 +1076,7 @@ def auto_access():
         failed_count = _record_failed_attempt(
             identifier=identifier,
             identifier_type='huella' if huella_id else 'rfid',
+            device_id=data.get('device_id'),
             reason=f'{sensor_type} no registrado'
         )
         return jsonify({
@@ -938,6 +1092,7 @@ def auto_access():
         failed_count = _record_failed_attempt(
             identifier=identifier,
             identifier_type='huella' if huella_id else 'rfid',
+            device_id=data.get('device_id'),
             user_id=user.id,
             reason='Usuario inactivo'
         )
@@ -950,55 +1105,21 @@ def auto_access():
         }), 403
 
     timestamp = datetime.utcnow()
-    lima_timestamp = timestamp.astimezone(LIMA_TZ)
-
-    # Resto del código existente...
-    last_access = AccessLog.query.filter(
-        AccessLog.user_id == user.id,
-        AccessLog.status == 'Permitido',
-        AccessLog.sensor_type.in_(['Huella', 'RFID'])
-    ).order_by(AccessLog.timestamp.desc()).first()
-
-    if not last_access:
-        access_action = 'ENTRADA'
-    else:
-        if last_access.action_type:
-            if 'ENTRADA' in last_access.action_type:
-                access_action = 'SALIDA'
-            elif 'SALIDA' in last_access.action_type:
-                access_action = 'ENTRADA'
-            else:
-                access_action = 'SALIDA' if last_access.action_type == 'ENTRADA' else 'ENTRADA'
-        else:
-            access_action = 'SALIDA' if last_access.action_type == 'ENTRADA' else 'ENTRADA'
-
-    decision = decidir_accion_automatica(user, lima_timestamp)
-
-    hoy = lima_timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
-    mañana = hoy + timedelta(days=1)
-
-    asistencia_abierta = Attendance.query.filter(
-        Attendance.user_id == user.id,
-        Attendance.entry_time >= hoy,
-        Attendance.entry_time < mañana,
-        Attendance.exit_time.is_(None)
-    ).first()
+    lima_timestamp, snapshot, access_action, decision = _resolve_door_access(user, timestamp)
+    last_access = snapshot.presence
+    asistencia_abierta = snapshot.open_attendance_id is not None
 
-    if decision['registrar_asistencia']:
-        if decision.get('accion_asistencia') == 'salida' and not asistencia_abierta:
-            decision['registrar_asistencia'] = False
-            decision['tipo'] = 'ACCESO'
-            decision['razon'] = 'No tiene entrada registrada para marcar salida'
-        elif decision.get('accion_asistencia') == 'entrada' and asistencia_abierta:
-            decision['registrar_asistencia'] = False
-            decision['tipo'] = 'ACCESO'
-            decision['razon'] = 'Ya tiene asistencia abierta hoy'
-    else:
-        if access_action == 'SALIDA' and asistencia_abierta:
-            decision['registrar_asistencia'] = True
-            decision['tipo'] = 'ACCESO_Y_ASISTENCIA'
-            decision['razon'] = 'Cierre de jornada laboral'
-            decision['accion_asistencia'] = 'salida'
+    # Se lee antes del commit para no recargar el horario expirado
+    horario_response = {}
+    schedule = snapshot.schedule
+    if schedule:
+        horario_response = {
+            "hora_entrada": schedule.hora_entrada.strftime('%H:%M'),
+            "hora_salida": schedule.hora_salida.strftime('%H:%M'),
+            "dias_laborales": schedule.dias,
+            "tolerancia_entrada": schedule.tolerancia_entrada,
+            "tolerancia_salida": schedule.tolerancia_salida
+        }
 
     log = AccessLog(
         user_id=user.id,
@@ -1010,13 +1131,16 @@ def auto_access():
         action_type=f"{access_action}_{decision['tipo']}",
         motivo_decision=decision['razon']
     )
-    db.session.add(log)
-
+    # Los accesos que afectan asistencia se escriben en la misma transacción;
+    # el resto puede ir a la cola de escritura diferida
     attendance_data = None
     if decision['registrar_asistencia']:
+        db.session.add(log)
+        presence.record_access(log)
         attendance_data = register_attendance_from_access(log)
-
-    db.session.commit()
+        db.session.commit()
+    else:
+        access_log_writer.write(log)
 
     response = {
         "success": True,
@@ -1029,20 +1153,12 @@ def auto_access():
         "registrar_asistencia": decision['registrar_asistencia'],
         "decision_razon": decision['razon'],
         "hora_actual": lima_timestamp.strftime('%H:%M'),
-        "ultimo_acceso": last_access.timestamp.isoformat() if last_access else None,
-        "ultima_accion": last_access.action_type if last_access else None,
+        "ultimo_acceso": last_access.last_timestamp.isoformat() if last_access and last_access.last_timestamp else None,
+        "ultima_accion": last_access.last_action_type if last_access else None,
         "asistencia_abierta": bool(asistencia_abierta)
     }
 
-    schedule = get_user_schedule(user.id, lima_timestamp)
-    if schedule:
-        response.update({
-            "hora_entrada": schedule.hora_entrada.strftime('%H:%M'),
-            "hora_salida": schedule.hora_salida.strftime('%H:%M'),
-            "dias_laborales": schedule.dias,
-            "tolerancia_entrada": schedule.tolerancia_entrada,
-            "tolerancia_salida": schedule.tolerancia_salida
-        })
+    response.update(horario_response)
 
     if attendance_data and attendance_data.get('ok'):
         response['asistencia_registrada'] = True
@@ -1058,7 +1174,195 @@ def auto_access():
     return jsonify(response), 200
 
 
+def _parse_event_time(value):
+    """Hora de un evento del lector: epoch (s) o ISO 8601; sin zona se asume UTC"""
+    if isinstance(value, bool) or value is None:
+        raise ValueError('timestamp requerido')
+    if isinstance(value, (int, float)):
+        return datetime.utcfromtimestamp(value)
+    return _utc_naive(datetime.fromisoformat(str(value).replace('Z', '+00:00')))
+
+
+def _batch_event(event, device_id, event_time):
+    """Procesa un evento del lote (sin commit); devuelve el resultado para el lector"""
+    huella_id = event.get('huella_id')
+    rfid = event.get('rfid')
+
+    if huella_id is not None and rfid is not None:
+        return {'status': 'denied', 'reason': 'Zona segura requiere validación en línea'}
+    if huella_id is not None:
+        user = credential_cache.by_huella(huella_id)
+        sensor_type = 'Huella'
+    elif rfid:
+        user = credential_cache.by_rfid(rfid)
+        sensor_type = 'RFID'
+    else:
+        return {'status': 'invalid', 'reason': 'Falta huella_id o rfid'}
+
+    if not user:
+        return {'status': 'denied', 'reason': f'{sensor_type} no registrado'}
+    if not is_user_active(user):
+        return {'status': 'denied', 'reason': 'Usuario inactivo', 'user_id': user.id}
+
+    snapshot = load_decision_snapshot(user.id, pytz.utc.localize(event_time).astimezone(LIMA_TZ))
+    # Evento anterior al último acceso conocido: la acción sale del acceso
+    # previo a su hora, no de la presencia actual, y no toca la presencia
+    backdated = (snapshot.presence is not None and snapshot.presence.last_timestamp is not None
+                 and event_time < snapshot.presence.last_timestamp)
+    if backdated:
+        snapshot = snapshot._replace(
+            presence=_presence_before(user.id, event_time),
+            open_attendance_id=_open_attendance_at(user.id, event_time)
+        )
+    _, _, access_action, decision = _resolve_door_access(user, event_time, snapshot)
+
+    log = AccessLog(
+        user_id=user.id,
+        timestamp=event_time,
+        sensor_type=sensor_type,
+        status='Permitido',
+        huella_id=huella_id,
+        rfid=rfid if rfid else None,
+        device_id=device_id,
+        action_type=f"{access_action}_{decision['tipo']}",
+        motivo_decision=decision['razon']
+    )
+    db.session.add(log)
+
+    result = {
+        'status': 'processed',
+        'user_id': user.id,
+        'access_action': access_action,
+        'tipo': decision['tipo'],
+        'reason': decision['razon']
+    }
+    if decision['registrar_asistencia']:
+        attendance_data = register_attendance_from_access(
+            log, commit=False, update_presence=not backdated
+        )
+        if attendance_data.get('ok'):
+            result['asistencia_action'] = attendance_data.get('action')
+        else:
+            # La asistencia se rechazó: el acceso queda como solo puerta,
+            # con el motivo del rechazo
+            log.action_type = f"{access_action}_ACCESO"
+            log.motivo_decision = attendance_data.get('reason')
+            result['tipo'] = 'ACCESO'
+            result['reason'] = attendance_data.get('reason')
+    presence.record_access(log)
+    db.session.flush()
+    result['access_log_id'] = log.id
+    return result
+
+
+@bp.route('/batch-events', methods=['POST'])
+@throttler.limit(credential_fields=())
+def batch_events():
+    """
+    Accesos que un lector guardó sin conexión. Se procesan en orden
+    cronológico con la misma lógica que /auto-access pero con la hora del
+    lector, todo en una transacción; los event_id ya recibidos se omiten.
+    """
+    data = request.get_json(silent=True) or {}
+    device_id = data.get('device_id')
+    events = data.get('events')
+    if not device_id or not isinstance(events, list):
+        return jsonify(success=False, reason='Falta device_id o events'), 400
+
+    max_events = current_app.config.get('BATCH_EVENTS_MAX', 500)
+    if len(events) > max_events:
+        return jsonify(success=False, reason=f'Máximo {max_events} eventos por lote'), 413
+
+    device_id = str(device_id)
+    max_time = datetime.utcnow() + timedelta(seconds=current_app.config.get('BATCH_EVENTS_MAX_SKEW', 300))
+
+    results = [None] * len(events)
+    pending = []
+    seen = set()
+    for index, event in enumerate(events):
+        event_id = event.get('event_id') if isinstance(event, dict) else None
+        if event_id is None or str(event_id) == '':
+            results[index] = {'event_id': None, 'status': 'invalid', 'reason': 'Falta event_id'}
+            continue
+        event_id = str(event_id)[:64]
+        if event_id in seen:
+            results[index] = {'event_id': event_id, 'status': 'duplicate'}
+            continue
+        seen.add(event_id)
+        try:
+            event_time = _parse_event_time(event.get('timestamp'))
+        except (ValueError, TypeError, OverflowError, OSError):
+            results[index] = {'event_id': event_id, 'status': 'invalid', 'reason': 'timestamp inválido'}
+            continue
+        if event_time > max_time:
+            results[index] = {'event_id': event_id, 'status': 'invalid', 'reason': 'timestamp en el futuro'}
+            continue
+        pending.append((event_time, index, event_id, event))
+
+    # Reintentos del lector: lo ya guardado se informa tal cual
+    if pending:
+        existing = {
+            row.event_id: row for row in DeviceEvent.query.filter(
+                DeviceEvent.device_id == device_id,
+                DeviceEvent.event_id.in_([item[2] for item in pending])
+            )
+        }
+    else:
+        existing = {}
+
+    # Orden cronológico; a igual hora, el del lector
+    pending.sort(key=lambda item: (item[0], item[1]))
+    try:
+        for event_time, index, event_id, event in pending:
+            previous = existing.get(event_id)
+            if previous is not None:
+                results[index] = {
+                    'event_id': event_id,
+                    'status': 'duplicate',
+                    'original_status': previous.status,
+                    'access_log_id': previous.access_log_id
+                }
+                continue
+
+            result = _batch_event(event, device_id, event_time)
+            results[index] = dict(result, event_id=event_id)
+            if result['status'] == 'invalid':
+                continue
+            db.session.add(DeviceEvent(
+                device_id=device_id,
+                event_id=event_id,
+                event_time=event_time,
+                access_log_id=result.get('access_log_id'),
+                status=result['status'],
+                reason=(result.get('reason') or '')[:255] or None
+            ))
+        db.session.commit()
+    except IntegrityError:
+        # Otro envío del mismo lote se guardó primero; el lector reintenta
+        db.session.rollback()
+        return jsonify(success=False, reason='Lote en proceso, reintente'), 409
+    except Exception as e:
+        db.session.rollback()
+        import traceback
+        print(f"Error en batch_events: {str(e)}")
+        print(traceback.format_exc())
+        return jsonify(success=False, reason=f'Error interno del servidor: {str(e)}'), 500
+
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+
+    return jsonify({
+        "success": True,
+        "device_id": device_id,
+        "received": len(events),
+        "summary": summary,
+        "results": results
+    }), 200
+
+
 @bp.route('/secure-zone/double-auth', methods=['POST'])
+@throttler.limit()
 def secure_zone_double_auth():
     """
     Endpoint para acceso a Zona Segura (solo administradores con doble factor)
@@ -1110,6 +1414,7 @@ def secure_zone_double_auth():
         failed_count = _record_failed_attempt(
             identifier=str(huella_id),
             identifier_type='huella_secure_zone',
+            device_id=data.get('device_id'),
             reason='Huella no registrada - Zona Segura'
         )
         db.session.commit()
@@ -1140,6 +1445,7 @@ def secure_zone_double_auth():
         failed_count = _record_failed_attempt(
             identifier=str(user.id),
             identifier_type='secure_zone_inactive',
+            device_id=data.get('device_id'),
             user_id=user.id,
             reason='Usuario inactivo intentó acceder a Zona Segura'
         )
@@ -1171,6 +1477,7 @@ def secure_zone_double_auth():
         failed_count = _record_failed_attempt(
             identifier=str(user.id),
             identifier_type='secure_zone_admin',
+            device_id=data.get('device_id'),
             user_id=user.id,
             reason='Usuario no administrador intentó acceder a Zona Segura'
         )
@@ -1202,6 +1509,7 @@ def secure_zone_double_auth():
         failed_count = _record_failed_attempt(
             identifier=str(user.id),
             identifier_type='secure_zone_rfid_mismatch',
+            device_id=data.get('device_id'),
             user_id=user.id,
             reason='RFID no coincide para Zona Segura'
         )
@@ -1228,8 +1536,7 @@ def secure_zone_double_auth():
         action_type="ENTRADA_ZONA_SEGURA",
         motivo_decision="Acceso doble factor exitoso - Administrador"
     )
-    db.session.add(log)
-    db.session.commit()
+    access_log_writer.write(log)
 
     # Respuesta especial para Zona Segura
     return jsonify({
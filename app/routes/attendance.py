@@ -1,18 +1,25 @@
 # app/routes/attendance.py
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from math import ceil
+import numpy as np
 import pytz
-from sqlalchemy import func, or_
-from io import StringIO
-import csv
+from sqlalchemy import and_, case, func, or_
 
 from app import db
-from app.models import Attendance, AccessLog, User_iot, Schedule, UserSchedule
+from app.models import Attendance, AccessLog, User_iot, AttendanceDaily
+from app.services import presence, attendance_engine, attendance_rollup
+from app.services.schedule_timeline import get_user_schedule, schedule_timeline
+from app.services.compiled_schedule import compile_schedule
+from app.services.db_routing import read_replica
+from app.utils.csv_stream import csv_response
+from app.utils.pagination import decode_cursor, keyset_page, approximate_count
 
 bp = Blueprint('attendance', __name__)
 
 LIMA_TZ = pytz.timezone("America/Lima")
+EXPORT_BATCH_SIZE = 1000
 
 
 def _get_user_from_identity(identity):
@@ -27,79 +34,14 @@ def _get_user_from_identity(identity):
     return User_iot.query.get(user_id)
 
 
-def get_user_schedule(user_id, dt):
-    """
-    Obtiene el horario activo de un usuario para una fecha específica.
-    Prioriza el horario más reciente si hay múltiples activos.
-    """
-    from app.models import UserSchedule, Schedule
-    
-    # Convertir a fecha local si tiene timezone
-    if dt.tzinfo:
-        local_date = dt.date()
-    else:
-        # Si no tiene timezone, asumir UTC y convertir a Lima
-        try:
-            utc_dt = pytz.utc.localize(dt)
-            lima_dt = utc_dt.astimezone(LIMA_TZ)
-            local_date = lima_dt.date()
-        except:
-            local_date = dt.date()
-    
-    # Obtener TODOS los horarios activos para esta fecha
-    active_schedules = UserSchedule.query.filter(
-        UserSchedule.user_id == user_id,
-        UserSchedule.start_date <= local_date,
-        (UserSchedule.end_date == None) | (UserSchedule.end_date >= local_date)
-    ).order_by(UserSchedule.start_date.desc()).all()
-    
-    if not active_schedules:
-        return None
-    
-    # Si hay múltiples horarios activos, usar el más reciente (por start_date)
-    # Esto maneja el caso donde se cambió de horario durante el día
-    latest_schedule = active_schedules[0]
-    
-    # Verificar si hay un horario que empiece HOY específicamente
-    for schedule in active_schedules:
-        if schedule.start_date == local_date:
-            # Este horario comenzó hoy, tiene prioridad
-            latest_schedule = schedule
-            break
-    
-    return Schedule.query.get(latest_schedule.schedule_id)
+def _local_naive(dt):
+    return dt.astimezone(LIMA_TZ).replace(tzinfo=None) if dt.tzinfo else dt
+
 
 def check_schedule_status(schedule, dt):
     if schedule is None:
         return {'state': 'sin_horario', 'minutes_diff': None}
-
-    dias = [d.strip() for d in schedule.dias.split(',')]
-    dia_text = ['Lun','Mar','Mie','Jue','Vie','Sab','Dom'][dt.weekday()]
-    if dia_text not in dias:
-        return {'state': 'fuera_de_horario', 'minutes_diff': None}
-
-    entrada_dt = datetime.combine(dt.date(), schedule.hora_entrada)
-    salida_dt = datetime.combine(dt.date(), schedule.hora_salida)
-
-    entrada_dt = LIMA_TZ.localize(entrada_dt)
-    salida_dt = LIMA_TZ.localize(salida_dt)
-
-    tolerancia_entrada = int(schedule.tolerancia_entrada or 0)
-    tolerancia_salida = int(schedule.tolerancia_salida or 0)
-    
-    minutes_diff_entrada = int((dt - entrada_dt).total_seconds() / 60)
-
-    # Lógica para entrada
-    if dt <= entrada_dt + timedelta(minutes=tolerancia_entrada):
-        return {'state': 'presente', 'minutes_diff': max(0, minutes_diff_entrada)}
-    elif entrada_dt + timedelta(minutes=tolerancia_entrada) < dt < salida_dt:
-        return {'state': 'tarde', 'minutes_diff': minutes_diff_entrada}
-    # Lógica para salida - MÁS RESTRICTIVA
-    # Solo permitir desde 1 minuto antes y con tolerancia máxima
-    elif dt >= salida_dt - timedelta(minutes=1) and dt <= salida_dt + timedelta(minutes=tolerancia_salida):
-        return {'state': 'presente', 'minutes_diff': None}
-    else:
-        return {'state': 'fuera_de_horario', 'minutes_diff': None}
+    return compile_schedule(schedule).status(dt)
 
 
 def _serialize_attendance(record):
@@ -131,13 +73,11 @@ def determine_attendance_action(user_id, current_time):
     """Determina si es entrada o salida considerando el horario del usuario"""
     
     # Primero, verificar si hay una entrada abierta para hoy
-    today_start = current_time.replace(hour=0, minute=0, second=0, microsecond=0)
-    today_end = today_start + timedelta(days=1)
+    work_date = current_time.date()
     
     open_attendance = Attendance.query.filter(
         Attendance.user_id == user_id,
-        Attendance.entry_time >= today_start,
-        Attendance.entry_time <= today_end,
+        Attendance.work_date == work_date,
         Attendance.exit_time.is_(None)
     ).first()
     
@@ -149,15 +89,9 @@ def determine_attendance_action(user_id, current_time):
     schedule = get_user_schedule(user_id, current_time)
     
     if schedule:
-        # Calcular la hora de salida exacta (sin tolerancia para salidas tempranas)
-        salida_dt = datetime.combine(current_time.date(), schedule.hora_salida)
-        salida_dt = LIMA_TZ.localize(salida_dt)
-        
         # ¡IMPORTANTE! NO permitir salida antes de la hora exacta de salida
         # Solo permitir desde 1 minuto antes como máximo
-        salida_permitida_desde = salida_dt - timedelta(minutes=1)
-        
-        if current_time >= salida_permitida_desde:
+        if compile_schedule(schedule).exit_allowed(current_time):
             return 'exit'
         else:
             # Aún no es hora de salida, mostrar error
@@ -168,14 +102,12 @@ def determine_attendance_action(user_id, current_time):
 
 def register_attendance_entry(user, timestamp, schedule_status):
    
-    today_start = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
-    today_end = today_start + timedelta(days=1)
+    work_date = timestamp.date()
     
 
     existing_entry = Attendance.query.filter(
         Attendance.user_id == user.id,
-        Attendance.entry_time >= today_start,
-        Attendance.entry_time <= today_end
+        Attendance.work_date == work_date
     ).first()
     
     if existing_entry:
@@ -187,10 +119,16 @@ def register_attendance_entry(user, timestamp, schedule_status):
 
     attendance = Attendance(
         user_id=user.id,
-        entry_time=timestamp,
+        entry_time=_local_naive(timestamp),
+        work_date=work_date,
         estado_entrada=schedule_status['state']
     )
     db.session.add(attendance)
+    db.session.flush()
+    presence.set_open_attendance(user.id, attendance.id)
+    attendance_rollup.record_entry(
+        user.id, timestamp, schedule_status['state'], schedule_status['minutes_diff']
+    )
     db.session.commit()
     
     return jsonify({
@@ -234,13 +172,11 @@ def rfid_attendance():
         
         if action == 'exit':
             # Verificar si ya existe una entrada para hoy
-            today_start = lima_now.replace(hour=0, minute=0, second=0, microsecond=0)
-            today_end = today_start + timedelta(days=1)
+            work_date = lima_now.date()
             
             open_attendance = Attendance.query.filter(
                 Attendance.user_id == user.id,
-                Attendance.entry_time >= today_start,
-                Attendance.entry_time <= today_end,
+                Attendance.work_date == work_date,
                 Attendance.exit_time.is_(None)
             ).first()
             
@@ -296,13 +232,11 @@ def rfid_attendance():
             schedule_status = check_schedule_status(schedule, lima_now)
             
             # Verificar si ya tiene entrada hoy
-            today_start = lima_now.replace(hour=0, minute=0, second=0, microsecond=0)
-            today_end = today_start + timedelta(days=1)
+            work_date = lima_now.date()
             
             existing_entry = Attendance.query.filter(
                 Attendance.user_id == user.id,
-                Attendance.entry_time >= today_start,
-                Attendance.entry_time <= today_end
+                Attendance.work_date == work_date
             ).first()
             
             if existing_entry:
@@ -335,13 +269,11 @@ def rfid_attendance():
         }), 500
 def register_attendance_exit(user, timestamp):
    
-    today_start = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
-    today_end = today_start + timedelta(days=1)
+    work_date = timestamp.date()
     
     open_attendance = Attendance.query.filter(
         Attendance.user_id == user.id,
-        Attendance.entry_time >= today_start,
-        Attendance.entry_time <= today_end,
+        Attendance.work_date == work_date,
         Attendance.exit_time.is_(None)
     ).first()
     
@@ -351,10 +283,14 @@ def register_attendance_exit(user, timestamp):
             "reason": "No se encontró entrada registrada para hoy"
         }), 404
     
-    open_attendance.exit_time = timestamp
+    # Attendance guarda la hora local sin zona
+    exit_time = _local_naive(timestamp)
+    duration = exit_time - open_attendance.entry_time
+    open_attendance.exit_time = exit_time
+    presence.set_open_attendance(user.id, None)
+    attendance_rollup.record_exit(user.id, open_attendance.entry_time, timestamp)
     db.session.commit()
     
-    duration = open_attendance.exit_time - open_attendance.entry_time
     hours = int(duration.total_seconds() // 3600)
     minutes = int((duration.total_seconds() % 3600) // 60)
     
@@ -371,7 +307,12 @@ def register_attendance_exit(user, timestamp):
     }), 200
 
 
-def register_attendance_from_access(access_log: AccessLog):
+def register_attendance_from_access(access_log: AccessLog, commit=True, update_presence=True):
+    """
+    Entrada/salida a partir de un acceso; con commit=False solo hace flush
+    (lotes). Con update_presence=False no cambia la asistencia abierta de
+    presence_state (eventos atrasados de batch-events).
+    """
     if not access_log or not access_log.user_id:
         return {'ok': False, 'reason': 'Datos insuficientes'}
 
@@ -379,17 +320,17 @@ def register_attendance_from_access(access_log: AccessLog):
     if ts.tzinfo is None:
         ts = pytz.utc.localize(ts)
     lima_dt = ts.astimezone(LIMA_TZ)
+    # Attendance guarda la hora local de Lima sin zona, igual que rfid-attendance
+    local_time = lima_dt.replace(tzinfo=None)
 
     user_id = access_log.user_id
     
-    hoy = lima_dt.replace(hour=0, minute=0, second=0, microsecond=0)
-    mañana = hoy + timedelta(days=1)
+    work_date = lima_dt.date()
     
     # Buscar asistencia abierta HOY
     open_att = Attendance.query.filter(
         Attendance.user_id == user_id,
-        Attendance.entry_time >= hoy,
-        Attendance.entry_time < mañana,
+        Attendance.work_date == work_date,
         Attendance.exit_time.is_(None)
     ).first()
     
@@ -414,10 +355,16 @@ def register_attendance_from_access(access_log: AccessLog):
                 }
         
         # Registrar salida
-        open_att.exit_time = access_log.timestamp
-        db.session.commit()
-        
+        open_att.exit_time = local_time
+        if update_presence:
+            presence.set_open_attendance(user_id, None)
         duracion = open_att.exit_time - open_att.entry_time
+        attendance_rollup.record_exit(user_id, open_att.entry_time, lima_dt)
+        if commit:
+            db.session.commit()
+        else:
+            db.session.flush()
+        
         horas = int(duracion.total_seconds() // 3600)
         minutos = int((duracion.total_seconds() % 3600) // 60)
         
@@ -429,14 +376,13 @@ def register_attendance_from_access(access_log: AccessLog):
             'estado': 'salida_registrada',
             'duracion_jornada': f"{horas}h {minutos}m",
             'entry_time': open_att.entry_time,
-            'exit_time': access_log.timestamp
+            'exit_time': local_time
         }
     else:
         # Verificar si ya tiene entrada hoy
         existing_entry = Attendance.query.filter(
             Attendance.user_id == user_id,
-            Attendance.entry_time >= hoy,
-            Attendance.entry_time < mañana
+            Attendance.work_date == work_date
         ).first()
         
         if existing_entry:
@@ -460,11 +406,17 @@ def register_attendance_from_access(access_log: AccessLog):
         estado = schedule_info.get('state') or 'sin_horario'
         att = Attendance(
             user_id=user_id, 
-            entry_time=access_log.timestamp, 
+            entry_time=local_time,
+            work_date=work_date,
             estado_entrada=estado
         )
         db.session.add(att)
-        db.session.commit()
+        db.session.flush()
+        if update_presence:
+            presence.set_open_attendance(user_id, att.id)
+        attendance_rollup.record_entry(user_id, lima_dt, estado, schedule_info.get('minutes_diff'))
+        if commit:
+            db.session.commit()
         
         return {
             'ok': True, 
@@ -502,13 +454,11 @@ def fingerprint_attendance():
         
         if action == 'exit':
             # Verificar si ya existe una entrada para hoy
-            today_start = lima_now.replace(hour=0, minute=0, second=0, microsecond=0)
-            today_end = today_start + timedelta(days=1)
+            work_date = lima_now.date()
             
             open_attendance = Attendance.query.filter(
                 Attendance.user_id == user.id,
-                Attendance.entry_time >= today_start,
-                Attendance.entry_time <= today_end,
+                Attendance.work_date == work_date,
                 Attendance.exit_time.is_(None)
             ).first()
             
@@ -568,13 +518,11 @@ def fingerprint_attendance():
             schedule_status = check_schedule_status(schedule, lima_now)
             
             # Verificar si ya tiene entrada hoy
-            today_start = lima_now.replace(hour=0, minute=0, second=0, microsecond=0)
-            today_end = today_start + timedelta(days=1)
+            work_date = lima_now.date()
             
             existing_entry = Attendance.query.filter(
                 Attendance.user_id == user.id,
-                Attendance.entry_time >= today_start,
-                Attendance.entry_time <= today_end
+                Attendance.work_date == work_date
             ).first()
             
             if existing_entry:
@@ -619,6 +567,35 @@ def get_attendance_history():
 
     page = int(request.args.get('page', 1))
     per_page = int(request.args.get('per_page', 50))
+
+    # Con ?cursor= (vacío para la primera página) se pagina por keyset
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        cursor_values = None
+        if cursor:
+            try:
+                cursor_values = decode_cursor(cursor, (datetime, int))
+            except ValueError:
+                return jsonify({'msg': 'Cursor inválido'}), 400
+        q = Attendance.query.filter_by(user_id=user.id)
+        rows, next_cursor = keyset_page(
+            q,
+            [Attendance.entry_time, Attendance.id],
+            cursor_values,
+            per_page,
+            key=lambda r: (r.entry_time, r.id)
+        )
+        response = {
+            'items': [_serialize_attendance(r) for r in rows],
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        }
+        if request.args.get('total') == 'approx':
+            response['total'] = approximate_count(q)
+        elif request.args.get('total') == 'exact':
+            response['total'] = q.count()
+        return jsonify(response), 200
+
     q = Attendance.query.filter_by(user_id=user.id).order_by(Attendance.entry_time.desc())
     pag = q.paginate(page=page, per_page=per_page, error_out=False)
 
@@ -639,33 +616,39 @@ def user_attendance(user_id):
     access_logs = AccessLog.query.filter_by(user_id=user_id).order_by(AccessLog.timestamp.desc()).all()
     attends = Attendance.query.filter_by(user_id=user_id).order_by(Attendance.entry_time.desc()).all()
 
+    # Clasificación de todos los eventos en una sola pasada vectorizada
+    timelines = schedule_timeline.timelines([user_id])
+    log_cls = attendance_engine.classify(
+        [user_id] * len(access_logs), [log.timestamp for log in access_logs], timelines
+    )
+    log_states = attendance_engine.state_names(log_cls)
+    # Attendance guarda la hora local de Lima sin zona
+    entry_cls = attendance_engine.classify(
+        [user_id] * len(attends), [a.entry_time for a in attends], timelines, naive_tz=LIMA_TZ
+    )
+    entry_states = attendance_engine.state_names(entry_cls)
+
     events = []
-    for log in access_logs:
-        ts = log.timestamp
-        if ts.tzinfo is None:
-            ts = pytz.utc.localize(ts)
-        lima_ts = ts.astimezone(LIMA_TZ)
-        schedule = get_user_schedule(user_id, lima_ts) if log.timestamp else None
-        schedule_status = check_schedule_status(schedule, lima_ts) if schedule else {'state': 'sin_horario', 'minutes_diff': None}
+    for i, log in enumerate(access_logs):
         events.append({
             'type': 'access',
             'id': log.id,
             'timestamp': log.timestamp.isoformat(),
             'sensor': log.sensor_type,
-            'access_status': log.status,
-            'schedule_state': schedule_status['state'],
-            'minutes_diff': schedule_status['minutes_diff'],
+            'access_status': log.status.value if hasattr(log.status, 'value') else log.status,
+            'schedule_state': log_states[i],
+            'minutes_diff': int(log_cls.minutes_diff[i]) if log_cls.has_minutes[i] else None,
             'rfid': log.rfid,
             'reason': log.reason
         })
-    for a in attends:
+    for i, a in enumerate(attends):
         events.append({
             'type': 'attendance_entry',
             'id': a.id,
             'timestamp': a.entry_time.isoformat() if a.entry_time else None,
             'sensor': None,
             'access_status': 'Entry',
-            'schedule_state': (check_schedule_status(get_user_schedule(user_id, a.entry_time.astimezone(LIMA_TZ) if a.entry_time.tzinfo else pytz.utc.localize(a.entry_time).astimezone(LIMA_TZ)), a.entry_time.astimezone(LIMA_TZ))['state'] if a.entry_time else None) if a.entry_time else None,
+            'schedule_state': entry_states[i] if a.entry_time else None,
             'minutes_diff': None,
             'estado_entrada': a.estado_entrada
         })
@@ -694,61 +677,78 @@ def _calculate_work_duration(entry_time, exit_time):
     return f"{hours}h {minutes}m"
 
 
-@bp.route('/admin/report', methods=['GET'])
-@jwt_required()
-def admin_attendance_report():
-    identity = get_jwt_identity()
-    admin_user = _get_user_from_identity(identity)
-    
-    if not admin_user or not admin_user.is_admin:
-        return jsonify({'msg': 'No autorizado - Se requiere rol de administrador'}), 403
-
+def _apply_admin_report_filters(query):
+    """Filtros comunes del reporte de administración (user_id, fechas, área)"""
     user_id = request.args.get('user_id', type=int)
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
     area = request.args.get('area', '').strip()
 
-    query = db.session.query(
-        Attendance,
-        User_iot
-    ).join(
-        User_iot, Attendance.user_id == User_iot.id
-    )
-
     if user_id:
         query = query.filter(Attendance.user_id == user_id)
-    
+
     if start_date_str:
         try:
             start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
             start_dt = LIMA_TZ.localize(datetime.combine(start_date, datetime.min.time()))
             query = query.filter(Attendance.entry_time >= start_dt)
         except ValueError:
-            return jsonify({'msg': 'Formato de fecha inicial inválido'}), 400
-    
+            return None, (jsonify({'msg': 'Formato de fecha inicial inválido'}), 400)
+
     if end_date_str:
         try:
             end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
             end_dt = LIMA_TZ.localize(datetime.combine(end_date, datetime.max.time()))
             query = query.filter(Attendance.entry_time <= end_dt)
         except ValueError:
-            return jsonify({'msg': 'Formato de fecha final inválido'}), 400
-    
+            return None, (jsonify({'msg': 'Formato de fecha final inválido'}), 400)
+
     if area:
         query = query.filter(User_iot.area_trabajo.ilike(f'%{area}%'))
 
+    return query, None
+
+
+@bp.route('/admin/report', methods=['GET'])
+@jwt_required()
+@read_replica
+def admin_attendance_report():
+    identity = get_jwt_identity()
+    admin_user = _get_user_from_identity(identity)
+    
+    if not admin_user or not admin_user.is_admin:
+        return jsonify({'msg': 'No autorizado - Se requiere rol de administrador'}), 403
+
+    query = db.session.query(
+        Attendance,
+        User_iot
+    ).join(
+        User_iot, Attendance.user_id == User_iot.id
+    )
+
+    query, error = _apply_admin_report_filters(query)
+    if error:
+        return error
+
     query = query.order_by(Attendance.entry_time.desc())
 
     results = query.all()
 
+    # Estado respecto al horario y duración de todas las filas en una pasada
+    # (Attendance guarda la hora local de Lima sin zona)
+    user_ids = [attendance.user_id for attendance, _ in results]
+    entries = [attendance.entry_time for attendance, _ in results]
+    classification = attendance_engine.classify(
+        user_ids, entries, schedule_timeline.timelines(user_ids), naive_tz=LIMA_TZ
+    )
+    states = attendance_engine.state_names(classification)
+    worked = attendance_engine.worked_seconds(
+        entries, [attendance.exit_time for attendance, _ in results], naive_tz=LIMA_TZ
+    )
+
     asistencias = []
-    for attendance, user in results:
-        duracion_jornada = None
-        if attendance.entry_time and attendance.exit_time:
-            duration = attendance.exit_time - attendance.entry_time
-            hours = int(duration.total_seconds() // 3600)
-            minutes = int((duration.total_seconds() % 3600) // 60)
-            duracion_jornada = f"{hours}h {minutes}m"
+    for i, (attendance, user) in enumerate(results):
+        duracion_jornada = attendance_engine.format_duration(worked[i])
 
         asistencia_data = {
             'id': attendance.id,
@@ -760,7 +760,10 @@ def admin_attendance_report():
             'entry_time': attendance.entry_time.isoformat() if attendance.entry_time else None,
             'exit_time': attendance.exit_time.isoformat() if attendance.exit_time else None,
             'estado_entrada': attendance.estado_entrada,
-            'duracion_jornada': duracion_jornada
+            'duracion_jornada': duracion_jornada,
+            'schedule_state': states[i],
+            'minutes_diff': int(classification.minutes_diff[i]) if classification.has_minutes[i] else None,
+            'worked_minutes': None if np.isnan(worked[i]) else int(worked[i] // 60)
         }
         asistencias.append(asistencia_data)
 
@@ -771,6 +774,74 @@ def admin_attendance_report():
     }), 200
 
 
+@bp.route('/admin/report/export', methods=['GET'])
+@jwt_required()
+@read_replica
+def export_admin_attendance_report():
+    identity = get_jwt_identity()
+    admin_user = _get_user_from_identity(identity)
+
+    if not admin_user or not admin_user.is_admin:
+        return jsonify({'msg': 'No autorizado - Se requiere rol de administrador'}), 403
+
+    # Solo las columnas necesarias, sin materializar objetos ORM
+    query = db.session.query(
+        Attendance.id,
+        Attendance.user_id,
+        User_iot.nombre,
+        User_iot.apellido,
+        User_iot.username,
+        User_iot.area_trabajo,
+        Attendance.entry_time,
+        Attendance.exit_time,
+        Attendance.estado_entrada
+    ).join(
+        User_iot, Attendance.user_id == User_iot.id
+    )
+
+    query, error = _apply_admin_report_filters(query)
+    if error:
+        return error
+
+    rows = query.order_by(Attendance.entry_time.desc()).yield_per(EXPORT_BATCH_SIZE)
+
+    header = [
+        'ID',
+        'Usuario ID',
+        'Nombre',
+        'Apellido',
+        'Username',
+        'Área',
+        'Entrada',
+        'Salida',
+        'Estado Entrada',
+        'Duración'
+    ]
+
+    def build_row(row):
+        duracion_jornada = ''
+        if row.entry_time and row.exit_time:
+            duration = row.exit_time - row.entry_time
+            hours = int(duration.total_seconds() // 3600)
+            minutes = int((duration.total_seconds() % 3600) // 60)
+            duracion_jornada = f"{hours}h {minutes}m"
+        return [
+            row.id,
+            row.user_id,
+            row.nombre,
+            row.apellido,
+            row.username,
+            row.area_trabajo or '',
+            row.entry_time.isoformat() if row.entry_time else '',
+            row.exit_time.isoformat() if row.exit_time else '',
+            row.estado_entrada or '',
+            duracion_jornada
+        ]
+
+    filename = f"reporte_asistencias_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    return csv_response(filename, header, rows, build_row)
+
+
 @bp.route('/admin/users', methods=['GET'])
 @jwt_required()
 def get_users_for_admin():
@@ -853,3 +924,170 @@ def my_attendance_report():
             'area_trabajo': user.area_trabajo
         }
     }), 200
+
+
+def _daily_duration(day):
+    return attendance_engine.format_duration(day.worked_minutes * 60) if day.last_exit else None
+
+
+def _serialize_daily(day, today):
+    return {
+        'user_id': day.user_id,
+        'work_date': day.work_date.isoformat(),
+        'first_entry': day.first_entry.isoformat() if day.first_entry else None,
+        'last_exit': day.last_exit.isoformat() if day.last_exit else None,
+        'estado_entrada': day.estado_entrada,
+        'minutes_late': day.minutes_late,
+        'worked_minutes': day.worked_minutes,
+        'duracion_jornada': _daily_duration(day),
+        'punches': day.punches,
+        'late': day.late,
+        'open_entry': day.open_entry,
+        # Entrada de un día pasado que nunca se cerró
+        'missing_exit': day.open_entry and day.work_date < today
+    }
+
+
+def _apply_daily_filters(query):
+    """Rango de fechas locales (inclusive) sobre AttendanceDaily.work_date"""
+    try:
+        if request.args.get('start_date'):
+            start_date = datetime.strptime(request.args['start_date'], '%Y-%m-%d').date()
+            query = query.filter(AttendanceDaily.work_date >= start_date)
+        if request.args.get('end_date'):
+            end_date = datetime.strptime(request.args['end_date'], '%Y-%m-%d').date()
+            query = query.filter(AttendanceDaily.work_date <= end_date)
+    except ValueError:
+        return None, (jsonify({'success': False, 'reason': 'Formato de fecha inválido'}), 400)
+    return query, None
+
+
+def _admin_daily_query():
+    """Resumen diario con su usuario y los filtros del reporte (user_id, fechas, área)"""
+    query = db.session.query(AttendanceDaily, User_iot).join(
+        User_iot, AttendanceDaily.user_id == User_iot.id
+    )
+    user_id = request.args.get('user_id', type=int)
+    if user_id:
+        query = query.filter(AttendanceDaily.user_id == user_id)
+    area = request.args.get('area', '').strip()
+    if area:
+        query = query.filter(User_iot.area_trabajo.ilike(f'%{area}%'))
+    return _apply_daily_filters(query)
+
+
+def _daily_totals(query, today):
+    """Totales de todo el rango filtrado (no solo de la página) en una consulta"""
+    days, late_days, minutes_late, worked_minutes, missing_exit_days = query.with_entities(
+        func.count(),
+        func.sum(case((AttendanceDaily.late.is_(True), 1), else_=0)),
+        func.sum(AttendanceDaily.minutes_late),
+        func.sum(AttendanceDaily.worked_minutes),
+        func.sum(case((and_(AttendanceDaily.open_entry.is_(True), AttendanceDaily.work_date < today), 1), else_=0))
+    ).order_by(None).one()
+    return {
+        'days': days,
+        'late_days': late_days or 0,
+        'minutes_late': minutes_late or 0,
+        'worked_minutes': worked_minutes or 0,
+        'missing_exit_days': missing_exit_days or 0
+    }
+
+
+@bp.route('/admin/daily-report', methods=['GET'])
+@jwt_required()
+@read_replica
+def admin_daily_report():
+    """Reporte por usuario y día desde el resumen (sin recorrer cada marcación)"""
+    admin_user = _get_user_from_identity(get_jwt_identity())
+    if not admin_user or not admin_user.is_admin:
+        return jsonify({'msg': 'No autorizado - Se requiere rol de administrador'}), 403
+
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 50, type=int)
+    if page < 1:
+        page = 1
+    if per_page < 1:
+        per_page = 50
+
+    # Con ?cursor= (vacío para la primera página) se pagina por keyset
+    cursor = request.args.get('cursor')
+    cursor_values = None
+    if cursor:
+        try:
+            cursor_values = decode_cursor(cursor, (date, int))
+        except ValueError:
+            return jsonify({'msg': 'Cursor inválido'}), 400
+
+    query, error = _admin_daily_query()
+    if error:
+        return error
+
+    next_cursor = None
+    if cursor is None:
+        rows = query.order_by(
+            AttendanceDaily.work_date.desc(), AttendanceDaily.user_id.desc()
+        ).limit(per_page).offset((page - 1) * per_page).all()
+    else:
+        rows, next_cursor = keyset_page(
+            query,
+            [AttendanceDaily.work_date, AttendanceDaily.user_id],
+            cursor_values,
+            per_page,
+            key=lambda r: (r[0].work_date, r[0].user_id)
+        )
+
+    today = datetime.now(LIMA_TZ).date()
+    days = []
+    for day, user in rows:
+        data = _serialize_daily(day, today)
+        data.update({
+            'nombre': user.nombre,
+            'apellido': user.apellido,
+            'username': user.username,
+            'area_trabajo': user.area_trabajo
+        })
+        days.append(data)
+
+    totals = _daily_totals(query, today)
+    response = {
+        'success': True,
+        'dias': days,
+        'totals': totals,
+        'total': totals['days']
+    }
+    if cursor is None:
+        response.update({
+            'page': page,
+            'per_page': per_page,
+            'pages': ceil(totals['days'] / per_page) if totals['days'] else 0
+        })
+    else:
+        response.update({
+            'per_page': per_page,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        })
+    return jsonify(response), 200
+
+
+@bp.route('/my-attendance/daily', methods=['GET'])
+@jwt_required()
+def my_daily_report():
+    user = _get_user_from_identity(get_jwt_identity())
+    if not user:
+        return jsonify({'success': False, 'reason': 'Usuario no autenticado'}), 401
+
+    query, error = _apply_daily_filters(AttendanceDaily.query.filter_by(user_id=user.id))
+    if error:
+        return error
+
+    today = datetime.now(LIMA_TZ).date()
+    days = [_serialize_daily(d, today) for d in query.order_by(AttendanceDaily.work_date.desc())]
+    totals = _daily_totals(query, today)
+    return jsonify({
+        'success': True,
+        'dias': days,
+        'totals': totals,
+        'total': totals['days']
+    }), 200
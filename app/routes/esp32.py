@@ -1,9 +1,14 @@
 # app/routes/esp32.py
 from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
 import requests
 from datetime import datetime
 from urllib.parse import urlparse
 
+from app.services.device_dispatcher import device_dispatcher, build_esp32_url
+from app.services.device_registry import device_registry
+from app.services.throttle import throttler
+
 esp32_bp = Blueprint('esp32', __name__, url_prefix='/esp32')
 
 
@@ -57,6 +62,7 @@ def send_command_to_esp32():
 
 
 @esp32_bp.route('/listen-fingerprint', methods=['POST'])
+@throttler.limit()
 def listen_fingerprint_result():
     """Recibir notificación de registro de huella desde ESP32"""
     data = request.get_json() or {}
@@ -128,6 +134,7 @@ def listen_fingerprint_result():
         }), 200
 
 @esp32_bp.route('/listen-rfid', methods=['POST'])
+@throttler.limit()
 def listen_rfid_result():
     """Recibir notificación de lectura RFID desde ESP32"""
     data = request.get_json() or {}
@@ -178,23 +185,177 @@ def listen_rfid_result():
     }), 200
 
 
-def build_esp32_url(esp32_ip):
-    """Construir URL correcta para el ESP32"""
-    # Si ya es una URL completa
-    if esp32_ip.startswith('http://') or esp32_ip.startswith('https://'):
-        return esp32_ip
-    
-    # Si es un dominio ngrok, usar HTTPS
-    if 'ngrok' in esp32_ip:
-        return f"https://{esp32_ip}"
-    
-    # Para IPs locales, usar HTTP
-    return f"http://{esp32_ip}"
+def _command_response(esp32_ip, outcome):
+    """Respuesta HTTP de /proxy/command a partir del resultado del dispatcher"""
+    error = outcome.get('error')
+    if error is None:
+        print(f"[PROXY] Respuesta del ESP32: {outcome['status_code']}")
+        if outcome['status_code'] == 200:
+            return {
+                "success": True,
+                "status": "success",
+                "message": f"Comando enviado a ESP32 ({esp32_ip})",
+                # Si no es JSON, devolver texto
+                "esp32_response": outcome['json'] if outcome['json'] is not None else outcome['text']
+            }, 200
+        return {
+            "success": False,
+            "message": f"ESP32 respondió con error: {outcome['status_code']}",
+            "response_text": outcome['text'][:200]
+        }, outcome['status_code']
+
+    if error == 'timeout':
+        return {
+            "success": False,
+            "message": f"Timeout - ESP32 en {esp32_ip} no responde en {device_dispatcher.command_timeout} segundos",
+            "solution": "Verifique que ngrok esté funcionando y el ESP32 encendido"
+        }, 408
+
+    if error == 'connection':
+        return {
+            "success": False,
+            "message": f"No se puede conectar al ESP32 en {esp32_ip}",
+            "error": outcome.get('detail'),
+            "solution": "Verifique la URL de ngrok y que el ESP32 esté encendido"
+        }, 503
+
+    return {
+        "success": False,
+        "message": f"Error inesperado: {outcome.get('detail')}",
+        "error_type": outcome.get('error_type')
+    }, 500
+
+
+def _status_response(esp32_ip, outcome):
+    """Respuesta HTTP de /proxy/status a partir del resultado del dispatcher"""
+    error = outcome.get('error')
+    if error is None:
+        print(f"[PROXY STATUS] Respuesta: {outcome['status_code']}")
+        if outcome['status_code'] == 200:
+            if outcome['json'] is not None:
+                return {
+                    "success": True,
+                    "status": "online",
+                    "esp32_data": outcome['json'],
+                    "message": f"ESP32 en {esp32_ip} está conectado"
+                }, 200
+            # Si no es JSON válido
+            return {
+                "success": True,
+                "status": "online",
+                "esp32_data": {"raw_response": outcome['text'][:100]},
+                "message": f"ESP32 responde pero no con JSON válido"
+            }, 200
+        return {
+            "success": True,
+            "status": "offline",
+            "message": f"ESP32 respondió con código {outcome['status_code']}"
+        }, 200
+
+    if error == 'timeout':
+        message = f"Timeout - ESP32 no responde en {device_dispatcher.status_timeout} segundos"
+    elif error == 'connection':
+        message = f"No se puede conectar al ESP32 en {esp32_ip}"
+    else:
+        message = f"Error de conexión: {outcome.get('detail')}"
+    return {"success": True, "status": "offline", "message": message}, 200
+
+
+def _cached_status_response(esp32_ip, snapshot):
+    """Misma forma que _status_response pero con el último sondeo del registro"""
+    if snapshot['health'] == 'online':
+        body = {
+            "success": True,
+            "status": "online",
+            "esp32_data": snapshot['esp32_data'],
+            "message": f"ESP32 en {esp32_ip} está conectado"
+        }
+    else:
+        body = {
+            "success": True,
+            "status": "offline",
+            "message": f"No se puede conectar al ESP32 en {esp32_ip}"
+        }
+    body["cached"] = True
+    body["device_id"] = snapshot['device_id']
+    body["last_checked"] = _iso(snapshot['last_checked'])
+    return body
+
+
+def _broadcast_response(_, result):
+    """Resumen de un broadcast terminado, un resultado por dispositivo"""
+    results = []
+    for device_id, outcome in result['outcomes'].items():
+        body, status = _command_response(outcome['esp32_ip'], outcome)
+        results.append({
+            "device_id": device_id,
+            "success": body["success"],
+            "http_status": status,
+            "message": body.get("message"),
+            "esp32_response": body.get("esp32_response"),
+            "elapsed_ms": outcome.get('elapsed_ms')
+        })
+
+    succeeded = sum(1 for r in results if r["success"])
+    return {
+        "success": succeeded == len(results),
+        "command": result['command'],
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "elapsed_ms": result['elapsed_ms'],
+        "results": results
+    }, 200
+
+
+_RESPONSE_BUILDERS = {
+    'command': _command_response,
+    'status': _status_response,
+    'broadcast': _broadcast_response,
+}
+
+
+def _dispatch(job_id, kind, esp32_ip, wait):
+    """
+    Espera el job (modo síncrono) o devuelve 202 con el job_id para
+    consultarlo. La espera síncrona dura como mucho ESP32_SYNC_WAIT
+    segundos: si el lector tarda más, el hilo de gunicorn no queda
+    bloqueado hasta el timeout del comando y se responde 202.
+    """
+    if not wait:
+        return jsonify({
+            "success": True,
+            "status": "pending",
+            "job_id": job_id,
+            "poll_url": f"/esp32/jobs/{job_id}"
+        }), 202
+
+    timeout = device_dispatcher.command_timeout if kind == 'command' else device_dispatcher.status_timeout
+    outcome = device_dispatcher.wait(job_id, timeout=min(device_dispatcher.sync_wait, timeout + 2))
+    if outcome is None:
+        return jsonify({
+            "success": True,
+            "status": "pending",
+            "job_id": job_id,
+            "poll_url": f"/esp32/jobs/{job_id}"
+        }), 202
+    body, status = _RESPONSE_BUILDERS[kind](esp32_ip, outcome)
+    body["job_id"] = job_id
+    return jsonify(body), status
+
+
+def _wants_async(data):
+    return bool(data.get('async')) or request.args.get('async', 'false').lower() == 'true'
 
 
 @esp32_bp.route('/proxy/command', methods=['POST', 'OPTIONS'])
 def proxy_command_to_esp32():
-    """Proxy para enviar comandos al ESP32 evitando mixed content"""
+    """
+    Proxy para enviar comandos al ESP32 evitando mixed content.
+    Con "async": true (o ?async=true), o si el ESP32 no responde en
+    ESP32_SYNC_WAIT segundos, responde 202 con un job_id y el resultado se
+    consulta en /esp32/jobs/<job_id> (requiere JWT).
+    """
     if request.method == 'OPTIONS':
         return jsonify({"success": True}), 200
     
@@ -207,88 +368,23 @@ def proxy_command_to_esp32():
     
     if not esp32_ip:
         return jsonify({"success": False, "message": "IP del ESP32 requerida"}), 400
-    
-    try:
-        # Construir URL correcta
-        esp32_url = build_esp32_url(esp32_ip)
-        target_url = f"{esp32_url}/command"
-        
-        print(f"[PROXY] Enviando comando {command} a {target_url}")
-        
-        # Enviar comando al ESP32
-        response = requests.post(
-            target_url,
-            json={
-                "command": command,
-                "huella_id": huella_id,
-                "user_id": user_id,
-                "timestamp": datetime.now().isoformat(),
-                "source": "backend_proxy"
-            },
-            timeout=15,
-            verify=False  # IMPORTANTE: Desactivar verificación SSL para ngrok
-        )
-        
-        print(f"[PROXY] Respuesta del ESP32: {response.status_code}")
-        
-        if response.status_code == 200:
-            try:
-                esp32_response = response.json()
-                return jsonify({
-                    "success": True,
-                    "status": "success",
-                    "message": f"Comando enviado a ESP32 ({esp32_ip})",
-                    "esp32_response": esp32_response
-                }), 200
-            except ValueError:
-                # Si no es JSON, devolver texto
-                return jsonify({
-                    "success": True,
-                    "status": "success",
-                    "message": f"Comando enviado a ESP32 ({esp32_ip})",
-                    "esp32_response": response.text
-                }), 200
-        else:
-            return jsonify({
-                "success": False,
-                "message": f"ESP32 respondió con error: {response.status_code}",
-                "response_text": response.text[:200]
-            }), response.status_code
-        
-    except requests.exceptions.Timeout:
-        return jsonify({
-            "success": False,
-            "message": f"Timeout - ESP32 en {esp32_ip} no responde en 15 segundos",
-            "solution": "Verifique que ngrok esté funcionando y el ESP32 encendido"
-        }), 408
-        
-    except requests.exceptions.ConnectionError as e:
-        return jsonify({
-            "success": False,
-            "message": f"No se puede conectar al ESP32 en {esp32_ip}",
-            "error": str(e),
-            "solution": "Verifique la URL de ngrok y que el ESP32 esté encendido"
-        }), 503
-        
-    except requests.exceptions.SSLError as e:
-        return jsonify({
-            "success": False,
-            "message": f"Error SSL al conectar a {esp32_ip}",
-            "error": str(e),
-            "solution": "Ngrok puede tener problemas de certificado. Intente usar verify=False"
-        }), 500
-        
-    except Exception as e:
-        return jsonify({
-            "success": False,
-            "message": f"Error inesperado: {str(e)}",
-            "error_type": type(e).__name__
-        }), 500
+
+    print(f"[PROXY] Enviando comando {command} a {build_esp32_url(esp32_ip)}/command")
+
+    # Enviar comando al ESP32 desde el pool del dispatcher (conexión reutilizada)
+    job_id = device_dispatcher.send_command(esp32_ip, {
+        "command": command,
+        "huella_id": huella_id,
+        "user_id": user_id,
+        "timestamp": datetime.now().isoformat(),
+        "source": "backend_proxy"
+    })
+    return _dispatch(job_id, 'command', esp32_ip, wait=not _wants_async(data))
 
 
 @esp32_bp.route('/proxy/status', methods=['POST', 'OPTIONS'])
 def proxy_esp32_status():
-    """Proxy para verificar estado del ESP32"""
+    """Proxy para verificar estado del ESP32 (acepta "async" como /proxy/command)"""
     if request.method == 'OPTIONS':
         return jsonify({"success": True}), 200
     
@@ -297,74 +393,212 @@ def proxy_esp32_status():
     
     if not esp32_ip:
         return jsonify({"success": False, "message": "IP del ESP32 requerida"}), 400
-    
-    try:
-        # Construir URL correcta
-        esp32_url = build_esp32_url(esp32_ip)
-        target_url = f"{esp32_url}/status"
-        
-        print(f"[PROXY STATUS] Probando conexión a {target_url}")
-        
-        # Intentar conectar al ESP32
-        response = requests.get(
-            target_url,
-            timeout=8,
-            verify=False  # IMPORTANTE: Desactivar verificación SSL para ngrok
-        )
-        
-        print(f"[PROXY STATUS] Respuesta: {response.status_code}")
-        
-        if response.status_code == 200:
-            try:
-                esp32_data = response.json()
-                return jsonify({
-                    "success": True,
-                    "status": "online",
-                    "esp32_data": esp32_data,
-                    "message": f"ESP32 en {esp32_ip} está conectado"
-                }), 200
-            except ValueError:
-                # Si no es JSON válido
-                return jsonify({
-                    "success": True,
-                    "status": "online",
-                    "esp32_data": {"raw_response": response.text[:100]},
-                    "message": f"ESP32 responde pero no con JSON válido"
-                }), 200
-        else:
-            return jsonify({
-                "success": True,
-                "status": "offline",
-                "message": f"ESP32 respondió con código {response.status_code}"
-            }), 200
-        
-    except requests.exceptions.Timeout:
-        return jsonify({
-            "success": True,
-            "status": "offline",
-            "message": "Timeout - ESP32 no responde en 8 segundos"
-        }), 200
-        
-    except requests.exceptions.ConnectionError:
+
+    # Si el dispositivo está registrado y el prober lo revisó hace poco,
+    # se responde desde memoria sin ir a la red
+    if not request.args.get('live'):
+        snapshot = device_registry.find_by_url(esp32_ip)
+        if device_registry.is_fresh(snapshot):
+            return jsonify(_cached_status_response(esp32_ip, snapshot)), 200
+
+    print(f"[PROXY STATUS] Probando conexión a {build_esp32_url(esp32_ip)}/status")
+
+    job_id = device_dispatcher.check_status(esp32_ip)
+    return _dispatch(job_id, 'status', esp32_ip, wait=not _wants_async(data))
+
+
+@esp32_bp.route('/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_dispatch_job(job_id):
+    """Estado/resultado de un comando enviado en modo asíncrono"""
+    job = device_dispatcher.get_job(job_id)
+    if job is None:
         return jsonify({
-            "success": True,
-            "status": "offline",
-            "message": f"No se puede conectar al ESP32 en {esp32_ip}"
-        }), 200
-        
-    except requests.exceptions.SSLError:
+            "success": False,
+            "message": "Job no encontrado o expirado"
+        }), 404
+
+    if job['status'] != 'done':
         return jsonify({
             "success": True,
-            "status": "offline",
-            "message": f"Error SSL al conectar a {esp32_ip}"
-        }), 200
-        
-    except Exception as e:
+            "status": job['status'],
+            "job_id": job_id
+        }), 202
+
+    body, status = _RESPONSE_BUILDERS[job['kind']](job['esp32_ip'], job['result'])
+    body["job_id"] = job_id
+    return jsonify(body), status
+
+
+# ========== REGISTRO DE DISPOSITIVOS ==========
+
+def _current_admin():
+    from app.models import User_iot
+    identity = get_jwt_identity()
+    user_id = identity.get('id') if isinstance(identity, dict) else identity
+    user = User_iot.query.get(user_id) if user_id else None
+    return user if user and user.is_admin else None
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _device_payload(snapshot):
+    return {
+        "device_id": snapshot['device_id'],
+        "base_url": snapshot['base_url'],
+        "nombre": snapshot['nombre'],
+        "health": snapshot['health'],
+        "firmware": snapshot['firmware'],
+        "esp32_data": snapshot['esp32_data'],
+        "last_seen": _iso(snapshot['last_seen']),
+        "last_checked": _iso(snapshot['last_checked']),
+        "latency_ms": snapshot['latency_ms'],
+        "error": snapshot['error'],
+        "stale": not device_registry.is_fresh(snapshot),
+    }
+
+
+@esp32_bp.route('/devices', methods=['GET'])
+@jwt_required()
+def list_devices():
+    """Dispositivos registrados con su último estado conocido (sin I/O de red)"""
+    devices = [_device_payload(s) for s in device_registry.all_status()]
+    return jsonify({
+        "success": True,
+        "devices": devices,
+        "online": sum(1 for d in devices if d["health"] == 'online'),
+        "total": len(devices)
+    }), 200
+
+
+@esp32_bp.route('/devices', methods=['POST'])
+@jwt_required()
+def register_device():
+    """Registra o actualiza un dispositivo (device_id + esp32_ip/URL)"""
+    if not _current_admin():
+        return jsonify(msg='Acceso denegado - Solo administradores'), 403
+
+    data = request.get_json() or {}
+    device_id = (data.get('device_id') or '').strip()
+    esp32_ip = (data.get('esp32_ip') or data.get('base_url') or '').strip()
+    if not device_id or not esp32_ip:
+        return jsonify({"success": False, "message": "device_id y esp32_ip requeridos"}), 400
+    if len(device_id) > 80:
+        return jsonify({"success": False, "message": "device_id demasiado largo (máx. 80)"}), 400
+
+    device_registry.register(device_id, esp32_ip, data.get('nombre'))
+    return jsonify({
+        "success": True,
+        "message": f"Dispositivo {device_id} registrado",
+        "device": _device_payload(device_registry.status(device_id))
+    }), 201
+
+
+@esp32_bp.route('/devices/<device_id>', methods=['DELETE'])
+@jwt_required()
+def unregister_device(device_id):
+    if not _current_admin():
+        return jsonify(msg='Acceso denegado - Solo administradores'), 403
+    if not device_registry.unregister(device_id):
+        return jsonify({"success": False, "message": "Dispositivo no encontrado"}), 404
+    return jsonify({"success": True, "message": f"Dispositivo {device_id} eliminado"}), 200
+
+
+@esp32_bp.route('/devices/<device_id>/status', methods=['GET'])
+@jwt_required()
+def device_status(device_id):
+    """Estado en caché de un dispositivo registrado"""
+    snapshot = device_registry.status(device_id)
+    if snapshot is None:
+        return jsonify({"success": False, "message": "Dispositivo no encontrado"}), 404
+    return jsonify({"success": True, "device": _device_payload(snapshot)}), 200
+
+
+@esp32_bp.route('/devices/probe', methods=['POST'])
+@jwt_required()
+def probe_devices():
+    """Pide al prober un sondeo inmediato (el resultado llega en segundos)"""
+    if not _current_admin():
+        return jsonify(msg='Acceso denegado - Solo administradores'), 403
+    device_registry.probe_soon()
+    return jsonify({"success": True, "message": "Sondeo solicitado"}), 202
+
+
+BROADCAST_COMMANDS = ["REGISTER_FINGERPRINT", "READ_RFID", "SYNC_TEMPLATES"]
+
+
+@esp32_bp.route('/broadcast', methods=['POST'])
+@jwt_required()
+def broadcast_command():
+    """
+    Envía un comando a varios dispositivos registrados en paralelo.
+    Body: command, device_ids (lista o "all"), y opcionalmente huella_id,
+    user_id, parallelism y timeout (segundos por dispositivo). Responde 202
+    con un job_id; el resultado por dispositivo se consulta en
+    /esp32/jobs/<job_id>.
+    """
+    if not _current_admin():
+        return jsonify(msg='Acceso denegado - Solo administradores'), 403
+
+    from app.models import Device
+
+    data = request.get_json() or {}
+    command = data.get('command')
+    device_ids = data.get('device_ids')
+
+    if command not in BROADCAST_COMMANDS:
         return jsonify({
-            "success": True,
-            "status": "offline",
-            "message": f"Error de conexión: {str(e)}"
-        }), 200
+            "success": False,
+            "message": f"Comando no soportado: {command}",
+            "supported_commands": BROADCAST_COMMANDS
+        }), 400
+
+    if device_ids == 'all':
+        devices = Device.query.order_by(Device.id).all()
+        not_found = []
+    elif isinstance(device_ids, list) and device_ids:
+        requested = list(dict.fromkeys(str(d) for d in device_ids))
+        found = {d.id: d for d in Device.query.filter(Device.id.in_(requested)).all()}
+        devices = [found[d] for d in requested if d in found]
+        not_found = [d for d in requested if d not in found]
+    else:
+        return jsonify({"success": False, "message": 'device_ids requerido (lista o "all")'}), 400
+
+    if not devices:
+        return jsonify({"success": False, "message": "Ningún dispositivo registrado coincide", "not_found": not_found}), 404
+
+    try:
+        parallelism = int(data['parallelism']) if data.get('parallelism') else None
+        timeout = min(float(data['timeout']), device_dispatcher.command_timeout) if data.get('timeout') else None
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "parallelism y timeout deben ser numéricos"}), 400
+
+    payload = {
+        "command": command,
+        "huella_id": data.get('huella_id'),
+        "user_id": data.get('user_id'),
+        "timestamp": datetime.now().isoformat(),
+        "source": "backend_broadcast"
+    }
+    if command == 'SYNC_TEMPLATES':
+        # El lector compara con su versión y pide /users/huella/sync?since=
+        from app.services import fingerprint_sync
+        payload["version"] = fingerprint_sync.current_version()
+
+    job_id = device_dispatcher.broadcast(
+        [(d.id, d.base_url) for d in devices], payload, parallelism=parallelism, timeout=timeout
+    )
+    return jsonify({
+        "success": True,
+        "status": "pending",
+        "command": command,
+        "total": len(devices),
+        "not_found": not_found,
+        "job_id": job_id,
+        "poll_url": f"/esp32/jobs/{job_id}"
+    }), 202
 
 
 # ========== ENDPOINT PARA DEBUG ==========
@@ -7,6 +7,9 @@ from sqlalchemy import or_
 
 from app import db
 from app.models import Schedule, UserSchedule, ScheduleAudit, User_iot
+from app.services.schedule_timeline import schedule_timeline
+from app.services.compiled_schedule import compile_schedule
+from app.services.db_routing import read_replica
 
 schedule_bp = Blueprint('schedule', __name__, url_prefix='/schedules')
 
@@ -180,24 +183,6 @@ def assign_schedule():
         )
     ).all()
 
-    def _to_time(t):
-        if isinstance(t, str):
-            return datetime.strptime(t, "%H:%M").time()
-        return t
-
-    def horarios_chocan(h1: Schedule, h2: Schedule):
-        dias1 = set([d.strip() for d in h1.dias.split(",")])
-        dias2 = set([d.strip() for d in h2.dias.split(",")])
-        if dias1.isdisjoint(dias2):
-            return False
-
-        e1 = _to_time(h1.hora_entrada)
-        s1 = _to_time(h1.hora_salida)
-        e2 = _to_time(h2.hora_entrada)
-        s2 = _to_time(h2.hora_salida)
-
-        return not (s1 <= e2 or s2 <= e1)
-
     for us in existing_schedules:
         if horarios_chocan(schedule, us.schedule):
             # Si se está asignando para hoy y hay conflicto, terminar el horario anterior
@@ -214,6 +199,7 @@ def assign_schedule():
     )
     db.session.add(us)
     db.session.commit()
+    schedule_timeline.invalidate_user(user_id)
 
     admin = _get_user_from_identity(get_jwt_identity())
     details = f'Asignado schedule {schedule_id} a user {user_id} desde {start_date} hasta {end_date}'
@@ -280,6 +266,7 @@ def update_schedule(schedule_id):
             return jsonify(msg=f"Valor inválido para {field}", detail=str(e)), 400
 
     db.session.commit()
+    schedule_timeline.invalidate_schedule(schedule_id)
     admin = _get_user_from_identity(get_jwt_identity())
     record_audit(
         schedule_id=schedule.id,
@@ -310,6 +297,7 @@ def force_delete_schedule(schedule_id):
         # 2. Ahora eliminar el horario
         db.session.delete(schedule)
         db.session.commit()
+        schedule_timeline.invalidate_schedule(schedule_id)
         
         admin = _get_user_from_identity(get_jwt_identity())
         record_audit(schedule_id=schedule_id, admin_id=admin.id if admin else None,
@@ -367,6 +355,7 @@ def reassign_and_delete_schedule(schedule_id):
         # 2. Eliminar el horario original
         db.session.delete(schedule)
         db.session.commit()
+        schedule_timeline.invalidate_schedule(schedule_id)
         
         admin = _get_user_from_identity(get_jwt_identity())
         record_audit(
@@ -415,6 +404,7 @@ def end_schedule_assignments(schedule_id):
             ended_count += 1
         
         db.session.commit()
+        schedule_timeline.invalidate_schedule(schedule_id)
         
         admin = _get_user_from_identity(get_jwt_identity())
         record_audit(
@@ -477,6 +467,7 @@ def get_schedule_assignments(schedule_id):
 @schedule_bp.route('/audit', methods=['GET'])
 @jwt_required()
 @admin_required
+@read_replica
 def schedule_audit():
     audits = ScheduleAudit.query.order_by(ScheduleAudit.timestamp.desc()).all()
     result = []
@@ -568,6 +559,7 @@ def delete_schedule(schedule_id):
     # Eliminar el horario
     db.session.delete(schedule)
     db.session.commit()
+    schedule_timeline.invalidate_schedule(schedule_id)
 
     admin = _get_user_from_identity(get_jwt_identity())
     change_type = 'force_delete' if force else 'delete'
@@ -726,6 +718,7 @@ def update_assignment(assignment_id):
                          msg='La fecha de inicio no puede ser posterior a la fecha de fin'), 400
         
         db.session.commit()
+        schedule_timeline.invalidate_user(assignment.user_id)
         
         # Registrar auditoría
         admin = _get_user_from_identity(get_jwt_identity())
@@ -751,24 +744,4 @@ def update_assignment(assignment_id):
     
 def horarios_chocan(h1: Schedule, h2: Schedule):
     """Verifica si dos horarios se superponen en días y horas"""
-    # Convertir días a sets
-    dias1 = set([d.strip() for d in h1.dias.split(",")])
-    dias2 = set([d.strip() for d in h2.dias.split(",")])
-    
-    # Si no tienen días en común, no chocan
-    if dias1.isdisjoint(dias2):
-        return False
-    
-    # Helper para convertir a time
-    def _to_time(t):
-        if isinstance(t, str):
-            return datetime.strptime(t, "%H:%M").time()
-        return t
-    
-    # Obtener horas
-    e1 = _to_time(h1.hora_entrada)
-    s1 = _to_time(h1.hora_salida)
-    e2 = _to_time(h2.hora_entrada)
-    s2 = _to_time(h2.hora_salida)
-    
-    return not (s1 <= e2 or s2 <= e1)
+    return compile_schedule(h1).overlaps(compile_schedule(h2))
@@ -1,10 +1,15 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, make_response
 from flask_jwt_extended import get_jwt, jwt_required, get_jwt_identity
 from datetime import datetime
 from functools import wraps
 import base64
 from flask_cors import cross_origin
+from sqlalchemy.orm import joinedload
 from ..models import User_iot, Role, Huella
+from ..utils.pagination import decode_cursor, keyset_page, approximate_count
+from ..services import fingerprint_sync
+from ..services.template_bundle import template_bundle, COMPRESSIONS
+from ..services.throttle import throttler
 
 from app import db
 
@@ -232,36 +237,22 @@ def register_huella():
 def sync_all_fingerprints():
 
     try:
- 
-        huellas_data = db.session.query(
-            Huella.id,
-            Huella.template,
-            User_iot.id.label("user_id"),
-            User_iot.nombre,
-            User_iot.apellido
-        ).join(
-            User_iot, User_iot.huella_id == Huella.id
-        ).filter(
-            User_iot.huella_id.isnot(None)
-        ).all()
-        
-        huellas_list = []
-        for h in huellas_data:
-            if h.template and len(h.template) > 0:
-                huellas_list.append({
-                    "huella_id": h.id,
-                    "user_id": h.user_id,
-                    "nombre": h.nombre,
-                    "apellido": h.apellido,
-                    "template": base64.b64encode(h.template).decode() if h.template else None
-                })
-        
-        return jsonify({
+        version = fingerprint_sync.current_version()
+        etag = fingerprint_sync.etag_for(version)
+        if request.if_none_match.contains(etag):
+            return _not_modified(etag)
+
+        huellas_list = fingerprint_sync.load_templates()
+
+        response = jsonify({
             "success": True,
             "huellas": huellas_list,
             "total": len(huellas_list),
+            "version": version,
             "message": f"Se encontraron {len(huellas_list)} huellas registradas"
-        }), 200
+        })
+        response.set_etag(etag)
+        return response, 200
         
     except Exception as e:
         return jsonify({
@@ -270,6 +261,84 @@ def sync_all_fingerprints():
         }), 500
 
 
+@user_bp.route("/huella/sync", methods=["GET"])
+def sync_fingerprints_delta():
+    """
+    Sincronización incremental: ?since=<version> devuelve solo las huellas
+    agregadas/cambiadas ('upserts') y las eliminadas ('removed') desde esa
+    versión. Sin since (o since=0) devuelve todas, como /huella/sync-all.
+    """
+    since = request.args.get("since", 0, type=int)
+
+    try:
+        version = fingerprint_sync.current_version()
+        etag = fingerprint_sync.etag_for(version)
+        if since == version or request.if_none_match.contains(etag):
+            return _not_modified(etag)
+
+        # El lector viene de otra base (restaurada o recreada): recarga completa
+        reset = since <= 0 or since > version
+        if reset:
+            upserts, removed = fingerprint_sync.load_templates(), []
+        else:
+            upserts, removed = fingerprint_sync.changes_since(since, version)
+
+        response = jsonify({
+            "success": True,
+            "version": version,
+            "since": since,
+            "reset": reset,
+            "upserts": upserts,
+            "removed": removed
+        })
+        response.set_etag(etag)
+        return response, 200
+
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"Error al sincronizar huellas: {str(e)}"
+        }), 500
+
+
+@user_bp.route("/huella/bundle", methods=["GET"])
+def fingerprint_bundle():
+    """
+    Todas las huellas en formato binario (ver app/services/template_bundle.py).
+    ?compression=deflate lo devuelve comprimido con zlib.
+    """
+    compression = request.args.get("compression", "none")
+    if compression not in COMPRESSIONS:
+        return jsonify(success=False, message=f"compression debe ser uno de {', '.join(COMPRESSIONS)}"), 400
+
+    try:
+        version = fingerprint_sync.current_version()
+        etag = f"{fingerprint_sync.etag_for(version)}-{compression}"
+        if request.if_none_match.contains(etag):
+            return _not_modified(etag)
+
+        payload, version, count = template_bundle.get(compression)
+        response = make_response(payload, 200)
+        response.mimetype = "application/octet-stream"
+        response.headers["X-Template-Version"] = str(version)
+        response.headers["X-Template-Count"] = str(count)
+        response.headers["X-Bundle-Compression"] = compression
+        response.set_etag(f"{fingerprint_sync.etag_for(version)}-{compression}")
+        return response
+
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "message": f"Error al generar bundle de huellas: {str(e)}"
+        }), 500
+
+
+def _not_modified(etag):
+    response = make_response("", 304)
+    response.set_etag(etag)
+    return response
+
+
 @user_bp.route("/huella/check/<int:huella_id>", methods=["GET"])
 def check_fingerprint(huella_id):
 
@@ -412,25 +481,35 @@ def list_all_users():
   
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 50, type=int)
-    
-    users = User_iot.query.paginate(page=page, per_page=per_page, error_out=False)
-    
-    users_data = [
-        {
-            "id": u.id,
-            "username": u.username,
-            "nombre": u.nombre,
-            "apellido": u.apellido,
-            "role": u.role.name if u.role else None,
-            "area_trabajo": u.area_trabajo,
-            "huella_id": u.huella_id,
-            "rfid": u.rfid,
-            "is_active": u.is_active,
-            "created_at": u.created_at.isoformat() if u.created_at else None,
-            "updated_at": u.updated_at.isoformat() if u.updated_at else None
+
+    # Con ?cursor= (vacío para la primera página) se pagina por id
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        cursor_values = None
+        if cursor:
+            try:
+                cursor_values = decode_cursor(cursor, (int,))
+            except ValueError:
+                return jsonify({"msg": "Cursor inválido"}), 400
+        query = User_iot.query.options(joinedload(User_iot.role))
+        items, next_cursor = keyset_page(
+            query, [User_iot.id], cursor_values, per_page,
+            key=lambda u: (u.id,), descending=False
+        )
+        response = {
+            "users": [_serialize_user_row(u) for u in items],
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None
         }
-        for u in users.items
-    ]
+        if request.args.get('total') == 'approx':
+            response["total"] = approximate_count(User_iot.query)
+        elif request.args.get('total') == 'exact':
+            response["total"] = User_iot.query.count()
+        return jsonify(response), 200
+
+    users = User_iot.query.paginate(page=page, per_page=per_page, error_out=False)
+
+    users_data = [_serialize_user_row(u) for u in users.items]
     
     return jsonify({
         "users": users_data,
@@ -438,6 +517,24 @@ def list_all_users():
         "pages": users.pages,
         "current_page": page
     }), 200
+
+
+def _serialize_user_row(u):
+    return {
+        "id": u.id,
+        "username": u.username,
+        "nombre": u.nombre,
+        "apellido": u.apellido,
+        "role": u.role.name if u.role else None,
+        "area_trabajo": u.area_trabajo,
+        "huella_id": u.huella_id,
+        "rfid": u.rfid,
+        "is_active": u.is_active,
+        "created_at": u.created_at.isoformat() if u.created_at else None,
+        "updated_at": u.updated_at.isoformat() if u.updated_at else None
+    }
+
+
 @user_bp.route("/huella/assign-id", methods=["POST"])
 def assign_huella_id():
     """Asigna un ID de huella disponible a un usuario"""
@@ -1019,6 +1116,7 @@ def bulk_activate_users():
 # En user.py, busca las funciones de huella y añade versiones públicas SIN @jwt_required()
 
 @user_bp.route('/huella/public/register', methods=['POST'])
+@throttler.limit()
 def public_register_fingerprint():
     """Endpoint público para que ESP32 confirme registro de huella"""
     try:
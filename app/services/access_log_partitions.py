@@ -0,0 +1,227 @@
+# app/services/access_log_partitions.py
+import csv
+import gzip
+import os
+from datetime import date, datetime
+
+from sqlalchemy import column, select, table, text
+
+from app import db
+from app.models import AccessLog
+
+
+ARCHIVE_COLUMNS = [c.key for c in AccessLog.__table__.columns]
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_bounds(month):
+    """[inicio, fin) del mes como datetime UTC sin zona (igual que AccessLog.timestamp)"""
+    start = datetime.combine(month, datetime.min.time())
+    return start, datetime.combine(add_months(month, 1), datetime.min.time())
+
+
+def partition_name(month):
+    return f"access_log_{month:%Y_%m}"
+
+
+def is_partitioned():
+    """True si access_log es una tabla particionada de Postgres (migración b3f8d2a1c7e5)"""
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return db.session.execute(text("""
+        SELECT 1 FROM pg_partitioned_table p
+        JOIN pg_class c ON c.oid = p.partrelid
+        WHERE c.relname = 'access_log'
+    """)).first() is not None
+
+
+def existing_partitions():
+    """Meses que ya tienen partición propia"""
+    rows = db.session.execute(text("""
+        SELECT child.relname FROM pg_inherits i
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE parent.relname = 'access_log'
+    """)).scalars()
+    months = set()
+    for name in rows:
+        try:
+            months.add(datetime.strptime(name, 'access_log_%Y_%m').date())
+        except ValueError:
+            continue  # access_log_default
+    return months
+
+
+def ensure_partitions(months_ahead=3, today=None):
+    """
+    Crea las particiones que falten desde el mes actual hasta `months_ahead`
+    meses adelante. Si la partición DEFAULT ya tiene filas de ese mes, se
+    mueven a la nueva antes de adjuntarla. Devuelve los nombres creados.
+    """
+    if not is_partitioned():
+        return []
+
+    current = month_start(today or datetime.utcnow())
+    existing = existing_partitions()
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if month in existing:
+            continue
+        name = partition_name(month)
+        start, end = month_bounds(month)
+        params = {'start': start, 'end': end}
+        db.session.execute(text(
+            f"CREATE TABLE {name} (LIKE access_log INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        ))
+        db.session.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM access_log_default
+                WHERE "timestamp" >= :start AND "timestamp" < :end
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """), params)
+        db.session.execute(text(
+            f"ALTER TABLE access_log ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        ))
+        db.session.commit()
+        created.append(name)
+    return created
+
+
+def _archive_value(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'name'):  # AccessStatusEnum
+        return value.name
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _source_table(name=None):
+    """access_log o una partición ya separada (mismas columnas)"""
+    if name is None:
+        return AccessLog.__table__
+    return table(name, *[column(c) for c in ARCHIVE_COLUMNS])
+
+
+def write_archive(month, archive_dir, source=None, batch_size=1000):
+    """
+    Vuelca las filas del mes a <archive_dir>/access_log_YYYY_MM.csv.gz.
+    Se escribe en un temporal y se renombra al terminar; devuelve
+    (ruta, filas, id máximo archivado).
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{partition_name(month)}.csv.gz")
+    tmp_path = path + '.tmp'
+    start, end = month_bounds(month)
+    src = _source_table(source)
+
+    rows = db.session.execute(
+        select(src).where(src.c.timestamp >= start, src.c.timestamp < end).order_by(src.c.id),
+        execution_options={'yield_per': batch_size}
+    )
+
+    count = 0
+    max_id = None
+    with gzip.open(tmp_path, 'wt', newline='', encoding='utf-8') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(ARCHIVE_COLUMNS)
+        for row in rows:
+            writer.writerow([_archive_value(getattr(row, c)) for c in ARCHIVE_COLUMNS])
+            count += 1
+            max_id = row.id
+    os.replace(tmp_path, path)
+    return path, count, max_id
+
+
+def archive_month(month, archive_dir):
+    """
+    Archiva un mes y elimina sus filas. Con partición propia primero se
+    separa (DETACH), así lo que llegue mientras tanto cae en DEFAULT y no
+    se pierde; sin partición se borra por rango solo hasta el último id
+    archivado. Devuelve (ruta, filas).
+    """
+    start, end = month_bounds(month)
+    if is_partitioned() and month in existing_partitions():
+        name = partition_name(month)
+        db.session.execute(text(f"ALTER TABLE access_log DETACH PARTITION {name}"))
+        db.session.commit()
+        try:
+            path, count, _ = write_archive(month, archive_dir, source=name)
+        except Exception:
+            db.session.rollback()
+            db.session.execute(text(
+                f"ALTER TABLE access_log ATTACH PARTITION {name} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            ))
+            db.session.commit()
+            raise
+        db.session.execute(text(f"DROP TABLE {name}"))
+        db.session.commit()
+        return path, count
+
+    path, count, max_id = write_archive(month, archive_dir)
+    if max_id is not None:
+        db.session.execute(
+            AccessLog.__table__.delete().where(
+                AccessLog.timestamp >= start,
+                AccessLog.timestamp < end,
+                AccessLog.id <= max_id
+            )
+        )
+        db.session.commit()
+    return path, count
+
+
+def expired_months(retention_months, today=None):
+    """Meses con datos anteriores al período de retención (del más antiguo al más nuevo)"""
+    cutoff = add_months(month_start(today or datetime.utcnow()), -retention_months)
+    oldest = db.session.query(db.func.min(AccessLog.timestamp)).scalar()
+    if oldest is None:
+        return []
+    months = []
+    month = month_start(oldest)
+    while month < cutoff:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def _count_month(month):
+    start, end = month_bounds(month)
+    return db.session.query(db.func.count(AccessLog.id)).filter(
+        AccessLog.timestamp >= start,
+        AccessLog.timestamp < end
+    ).scalar()
+
+
+def archive_expired(retention_months, archive_dir, today=None, dry_run=False):
+    """
+    Archiva (CSV comprimido) y elimina los meses fuera de retención.
+    Un mes solo se elimina después de escribir su archivo completo.
+    """
+    partitions = existing_partitions() if is_partitioned() else set()
+    result = []
+    for month in expired_months(retention_months, today):
+        count = _count_month(month)
+        if dry_run:
+            if count:
+                result.append({'month': month.isoformat(), 'rows': count, 'archive': None})
+            continue
+        if not count and month not in partitions:
+            continue
+        path, count = archive_month(month, archive_dir)
+        result.append({'month': month.isoformat(), 'rows': count, 'archive': path})
+    return result
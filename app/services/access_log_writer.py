@@ -0,0 +1,217 @@
+# app/services/access_log_writer.py
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+from app import db
+from app.models import AccessLog
+from app.services import presence
+from app.services.schedule_timeline import local_date
+
+
+class AccessLogWriter:
+    """
+    Escritura de AccessLog en modo síncrono (por defecto) o diferido.
+
+    En modo 'batched' los eventos se encolan en una cola acotada y un hilo
+    los inserta con un INSERT multi-fila cuando se llena el lote o pasa el
+    intervalo de flush. Durabilidad:
+      - 'safe': si la cola está llena el evento se escribe en la petición
+      - 'fast': si la cola está llena el evento se descarta (y se cuenta);
+        los lotes se confirman con synchronous_commit=off en Postgres
+    """
+
+    def __init__(self):
+        self.app = None
+        self.mode = 'sync'
+        self.durability = 'safe'
+        self.batch_size = 200
+        self.flush_interval = 0.5
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'flushed': 0,
+            'batches': 0,
+            'dropped': 0,
+            'sync_fallbacks': 0,
+            'flush_errors': 0,
+            'max_queue_depth': 0,
+            'last_batch_size': 0,
+            'last_flush_ms': None,
+        }
+
+    def init_app(self, app):
+        self.app = app
+        self.mode = app.config.get('ACCESS_LOG_MODE', 'sync')
+        self.durability = app.config.get('ACCESS_LOG_DURABILITY', 'safe')
+        self.batch_size = app.config.get('ACCESS_LOG_BATCH_SIZE', 200)
+        self.flush_interval = app.config.get('ACCESS_LOG_FLUSH_INTERVAL', 0.5)
+        if self.mode == 'batched':
+            self._queue = queue.Queue(maxsize=app.config.get('ACCESS_LOG_QUEUE_SIZE', 5000))
+            atexit.register(self.shutdown)
+
+    @property
+    def batched(self):
+        return self.mode == 'batched' and self._queue is not None
+
+    def write(self, log):
+        """Registra un AccessLog. En modo síncrono hace add + commit."""
+        if not self.batched:
+            db.session.add(log)
+            presence.record_access(log)
+            db.session.commit()
+            return
+
+        self._ensure_started()
+        row = self._to_row(log)
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            if self.durability == 'fast':
+                self._incr('dropped')
+                return
+            self._incr('sync_fallbacks')
+            db.session.execute(AccessLog.__table__.insert(), [row])
+            presence.record_access(row)
+            db.session.commit()
+            return
+
+        # El toggle ENTRADA/SALIDA debe ver este acceso antes del flush
+        presence.remember_pending(row)
+        self._incr('enqueued')
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            if depth > self._stats['max_queue_depth']:
+                self._stats['max_queue_depth'] = depth
+
+    def stats(self):
+        with self._stats_lock:
+            data = dict(self._stats)
+        data.update({
+            'mode': self.mode,
+            'durability': self.durability,
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'queue_capacity': self._queue.maxsize if self._queue is not None else 0,
+            'flusher_alive': bool(self._thread and self._thread.is_alive()),
+        })
+        return data
+
+    def shutdown(self, timeout=10):
+        """Detiene el hilo y escribe lo que quede en la cola"""
+        if not self.batched:
+            return
+        self._stop.set()
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self._drain()
+
+    def _to_row(self, log):
+        row = {
+            c.key: getattr(log, c.key)
+            for c in AccessLog.__table__.columns
+            if c.key != 'id'
+        }
+        if row.get('timestamp') is None:
+            row['timestamp'] = datetime.utcnow()
+        if row.get('local_date') is None:
+            row['local_date'] = local_date(row['timestamp'])
+        return row
+
+    def _incr(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _ensure_started(self):
+        # Con gunicorn --preload el hilo del master no existe en los workers
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='access-log-writer', daemon=True
+            )
+            self._thread.start()
+
+    def _take_batch(self, wait):
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=wait))
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._take_batch(self.flush_interval)
+            if batch:
+                self._flush(batch)
+
+    def _drain(self):
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._flush(batch)
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        # En modo 'safe' un lote fallido se reintenta antes de darlo por perdido
+        attempts = 3 if self.durability == 'safe' else 1
+        with self.app.app_context():
+            try:
+                for attempt in range(attempts):
+                    try:
+                        if self.durability == 'fast' and db.engine.dialect.name == 'postgresql':
+                            db.session.execute(text("SET LOCAL synchronous_commit TO OFF"))
+                        db.session.execute(AccessLog.__table__.insert().values(batch))
+                        presence.record_access(*batch)
+                        db.session.commit()
+                        presence.forget_pending(batch)
+                        break
+                    except Exception as e:
+                        db.session.rollback()
+                        self._incr('flush_errors')
+                        print(f"[ACCESS LOG WRITER] Error escribiendo lote de {len(batch)} (intento {attempt + 1}): {e}")
+                        if attempt + 1 == attempts:
+                            self._incr('dropped', len(batch))
+                            presence.forget_pending(batch)
+                            return
+                        time.sleep(0.2 * (attempt + 1))
+            finally:
+                db.session.remove()
+
+        with self._stats_lock:
+            self._stats['flushed'] += len(batch)
+            self._stats['batches'] += 1
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 2)
+
+
+access_log_writer = AccessLogWriter()
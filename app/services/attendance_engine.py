@@ -0,0 +1,161 @@
+# app/services/attendance_engine.py
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+
+from app.services.compiled_schedule import compile_schedule
+
+
+LIMA_TZ = pytz.timezone("America/Lima")
+
+DAY_US = 86_400 * 1_000_000
+EPOCH = datetime(1970, 1, 1)
+EPOCH_UTC = pytz.utc.localize(EPOCH)
+ONE_US = timedelta(microseconds=1)
+NAT = np.iinfo(np.int64).min
+
+# Códigos de estado (mismos textos que check_schedule_status)
+SIN_HORARIO, PRESENTE, TARDE, FUERA_DE_HORARIO = 0, 1, 2, 3
+STATE_NAMES = np.array(['sin_horario', 'presente', 'tarde', 'fuera_de_horario'], dtype=object)
+
+Classification = namedtuple('Classification', ['state', 'minutes_diff', 'has_minutes'])
+
+
+def _offset_us(tz):
+    return int(tz.utcoffset(datetime(2020, 1, 1)).total_seconds() * 1_000_000)
+
+
+def to_utc_us(timestamps, naive_tz=pytz.utc):
+    """
+    Microsegundos UTC desde 1970 (int64). Los datetime sin zona se interpretan
+    en `naive_tz` (UTC para AccessLog.timestamp, Lima para Attendance);
+    None queda como NAT. Se evita np.array(list_of_datetimes), que es lento.
+    """
+    naive_offset = _offset_us(naive_tz)
+
+    def convert(dt):
+        if dt is None:
+            return NAT
+        if dt.tzinfo is None:
+            return (dt - EPOCH) // ONE_US - naive_offset
+        return (dt - EPOCH_UTC) // ONE_US
+
+    return np.fromiter((convert(t) for t in timestamps), dtype=np.int64, count=len(timestamps))
+
+
+# Lima no tiene horario de verano desde 1994: desplazamiento fijo respecto de UTC
+LIMA_OFFSET_US = _offset_us(LIMA_TZ)
+
+
+def _local_parts(utc_us):
+    """Día (desde 1970-01-01), segundos del día y día de semana en hora de Lima"""
+    local_us = utc_us + LIMA_OFFSET_US
+    days = np.floor_divide(local_us, DAY_US)
+    seconds = (local_us - days * DAY_US) / 1_000_000
+    weekday = (days + 3) % 7  # 1970-01-01 fue jueves (lunes = 0)
+    return days, seconds, weekday
+
+
+def _resolve_schedules(user_ids, days, timelines):
+    """
+    Parámetros del horario vigente de cada evento. Por usuario se recorren sus
+    asignaciones de menor a mayor prioridad (start_date, id) y cada una pisa a
+    las anteriores en los días que cubre: mismo resultado que interval_on().
+    """
+    n = len(user_ids)
+    params = {
+        'has': np.zeros(n, dtype=bool),
+        'day_mask': np.zeros(n, dtype=np.int64),
+        'entry_s': np.zeros(n),
+        'exit_s': np.zeros(n),
+        'on_time_until': np.zeros(n),
+        'exit_lo': np.zeros(n),
+        'exit_hi': np.zeros(n),
+    }
+    if n == 0:
+        return params
+
+    order = np.argsort(user_ids, kind='stable')
+    sorted_users = user_ids[order]
+    uniq, starts = np.unique(sorted_users, return_index=True)
+    ends = np.append(starts[1:], n)
+
+    epoch = EPOCH.toordinal()
+    for user_id, a, b in zip(uniq.tolist(), starts.tolist(), ends.tolist()):
+        timeline = timelines.get(user_id)
+        if timeline is None or not timeline.intervals:
+            continue
+        idx = order[a:b]
+        user_days = days[idx]
+        for interval in timeline.intervals:
+            covered = user_days >= interval.start_date.toordinal() - epoch
+            if interval.end_date is not None:
+                covered &= user_days <= interval.end_date.toordinal() - epoch
+            sel = idx[covered]
+            if not len(sel):
+                continue
+            c = compile_schedule(interval.schedule)
+            params['has'][sel] = True
+            params['day_mask'][sel] = c.day_mask
+            params['entry_s'][sel] = c.entry_s
+            params['exit_s'][sel] = c.exit_s
+            params['on_time_until'][sel] = c.on_time_until
+            params['exit_lo'][sel] = c.exit_window[0]
+            params['exit_hi'][sel] = c.exit_window[1]
+    return params
+
+
+def classify(user_ids, timestamps, timelines, naive_tz=pytz.utc):
+    """
+    Clasifica todos los eventos en una pasada vectorizada. Equivale a llamar
+    check_schedule_status(get_user_schedule(user, ts), ts) por evento.
+
+    `timelines` es {user_id: UserTimeline} (schedule_timeline.timelines()).
+    `naive_tz` es la zona de los datetime sin tzinfo (ver to_utc_us).
+    Devuelve Classification con arrays: state (códigos), minutes_diff y
+    has_minutes (False donde check_schedule_status devuelve None).
+    """
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    utc_us = to_utc_us(timestamps, naive_tz)
+    valid = utc_us != NAT
+    days, seconds, weekday = _local_parts(utc_us)
+    p = _resolve_schedules(user_ids, days, timelines)
+
+    has = p['has'] & valid
+    works = has & ((np.right_shift(p['day_mask'], weekday) & 1) == 1)
+    minutes = np.trunc((seconds - p['entry_s']) / 60).astype(np.int64)
+
+    on_time = works & (seconds <= p['on_time_until'])
+    late = works & ~on_time & (seconds < p['exit_s'])
+    at_exit = works & ~on_time & ~late & (p['exit_lo'] <= seconds) & (seconds <= p['exit_hi'])
+
+    state = np.full(len(user_ids), SIN_HORARIO, dtype=np.int8)
+    state[has] = FUERA_DE_HORARIO
+    state[on_time | at_exit] = PRESENTE
+    state[late] = TARDE
+
+    minutes_diff = np.where(on_time, np.maximum(minutes, 0), minutes)
+    return Classification(state, minutes_diff, on_time | late)
+
+
+def worked_seconds(entries, exits, naive_tz=pytz.utc):
+    """Duración de cada jornada en segundos; NaN si falta entrada o salida"""
+    start = to_utc_us(entries, naive_tz)
+    end = to_utc_us(exits, naive_tz)
+    missing = (start == NAT) | (end == NAT)
+    return np.where(missing, np.nan, (end - start) / 1_000_000)
+
+
+def state_names(classification):
+    return STATE_NAMES[classification.state]
+
+
+def format_duration(seconds):
+    """'Xh Ym' como _calculate_work_duration; None si no hay duración"""
+    if seconds is None or np.isnan(seconds):
+        return None
+    hours = int(seconds // 3600)
+    minutes = int((seconds % 3600) // 60)
+    return f"{hours}h {minutes}m"
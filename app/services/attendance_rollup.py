@@ -0,0 +1,135 @@
+# app/services/attendance_rollup.py
+from datetime import datetime
+
+import numpy as np
+import pytz
+
+from app import db
+from app.models import Attendance, AttendanceDaily
+from app.services import attendance_engine
+from app.services.schedule_timeline import schedule_timeline
+
+
+LIMA_TZ = pytz.timezone("America/Lima")
+
+
+def _local(dt):
+    """Hora de Lima sin zona; un datetime sin zona ya se asume en Lima (como Attendance)"""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(LIMA_TZ).replace(tzinfo=None)
+    return dt
+
+
+def _minutes_late(estado, minutes_diff):
+    if estado != 'tarde':
+        return 0
+    return max(0, int(minutes_diff or 0))
+
+
+def _day(user_id, work_date):
+    row = db.session.get(AttendanceDaily, (user_id, work_date))
+    if row is None:
+        row = AttendanceDaily(
+            user_id=user_id,
+            work_date=work_date,
+            worked_minutes=0,
+            punches=0,
+            late=False,
+            open_entry=False
+        )
+        db.session.add(row)
+    return row
+
+
+def record_entry(user_id, entry_dt, estado, minutes_diff=None):
+    """Suma una entrada al día; sin commit, va en la transacción de la asistencia"""
+    local = _local(entry_dt)
+    row = _day(user_id, local.date())
+    if row.first_entry is None or local < row.first_entry:
+        row.first_entry = local
+        row.estado_entrada = estado
+        row.minutes_late = _minutes_late(estado, minutes_diff)
+        row.late = estado == 'tarde'
+    row.punches = (row.punches or 0) + 1
+    row.open_entry = True
+    return row
+
+
+def record_exit(user_id, entry_dt, exit_dt):
+    """
+    Cierra la jornada abierta del día y acumula los minutos trabajados.
+    Entrada y salida se pasan a hora de Lima antes de restarlas.
+    """
+    entry, local = _local(entry_dt), _local(exit_dt)
+    row = _day(user_id, entry.date())
+    if row.last_exit is None or local > row.last_exit:
+        row.last_exit = local
+    worked_seconds = (local - entry).total_seconds()
+    row.worked_minutes = (row.worked_minutes or 0) + max(0, int(worked_seconds // 60))
+    row.open_entry = False
+    return row
+
+
+def rebuild(start_date=None, end_date=None):
+    """
+    Recalcula el resumen desde Attendance entre dos fechas locales
+    (inclusive); sin fechas, todo. Devuelve los días escritos.
+    """
+    query = db.session.query(
+        Attendance.user_id, Attendance.work_date, Attendance.entry_time,
+        Attendance.exit_time, Attendance.estado_entrada
+    )
+    delete = AttendanceDaily.query
+    if start_date:
+        query = query.filter(Attendance.work_date >= start_date)
+        delete = delete.filter(AttendanceDaily.work_date >= start_date)
+    if end_date:
+        query = query.filter(Attendance.work_date <= end_date)
+        delete = delete.filter(AttendanceDaily.work_date <= end_date)
+    rows = query.order_by(Attendance.user_id, Attendance.entry_time).all()
+
+    # Minutos de tardanza con el horario vigente de cada entrada, en una pasada
+    user_ids = [r.user_id for r in rows]
+    entries = [r.entry_time for r in rows]
+    classification = attendance_engine.classify(
+        user_ids, entries, schedule_timeline.timelines(user_ids), naive_tz=LIMA_TZ
+    )
+    worked = attendance_engine.worked_seconds(entries, [r.exit_time for r in rows], naive_tz=LIMA_TZ)
+
+    days = {}
+    for i, r in enumerate(rows):
+        entry = _local(r.entry_time)
+        key = (r.user_id, r.work_date or entry.date())
+        day = days.get(key)
+        if day is None:
+            estado = r.estado_entrada
+            minutes_diff = int(classification.minutes_diff[i]) if classification.has_minutes[i] else None
+            day = days[key] = {
+                'user_id': r.user_id,
+                'work_date': key[1],
+                'first_entry': entry,
+                'last_exit': None,
+                'estado_entrada': estado,
+                'minutes_late': _minutes_late(estado, minutes_diff),
+                'worked_minutes': 0,
+                'punches': 0,
+                'late': estado == 'tarde',
+                'open_entry': False,
+                'updated_at': datetime.utcnow()
+            }
+        day['punches'] += 1
+        if r.exit_time is None:
+            day['open_entry'] = True
+            continue
+        day['open_entry'] = False
+        exit_time = _local(r.exit_time)
+        if day['last_exit'] is None or exit_time > day['last_exit']:
+            day['last_exit'] = exit_time
+        if not np.isnan(worked[i]):
+            day['worked_minutes'] += max(0, int(worked[i] // 60))
+
+    delete.delete(synchronize_session=False)
+    if days:
+        db.session.bulk_insert_mappings(AttendanceDaily, list(days.values()))
+    db.session.commit()
+    return len(days)
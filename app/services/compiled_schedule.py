@@ -0,0 +1,134 @@
+# app/services/compiled_schedule.py
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+
+import pytz
+
+
+LIMA_TZ = pytz.timezone("America/Lima")
+
+DAY_NAMES = ('Lun', 'Mar', 'Mie', 'Jue', 'Vie', 'Sab', 'Dom')
+DAY_BITS = {name: 1 << i for i, name in enumerate(DAY_NAMES)}
+
+# Minutos antes de la hora de entrada en que abre la ventana de asistencia
+ENTRY_WINDOW_EARLY = 10
+# Minutos antes de la hora de salida en que se permite marcar salida
+EXIT_WINDOW_EARLY = 1
+
+
+class CompiledSchedule(namedtuple('CompiledSchedule', [
+    'day_mask', 'entry_min', 'exit_min', 'tolerancia_entrada', 'tolerancia_salida',
+    # Ventanas en segundos desde la medianoche (hora de Lima)
+    'entry_s', 'exit_s', 'on_time_until', 'entry_window', 'exit_window', 'workday_until'
+])):
+    """
+    Horario precalculado: días como máscara de bits y horas/ventanas como
+    enteros del día, así cada chequeo son comparaciones de enteros.
+    Las ventanas pueden salir de [0, 86400) (p. ej. salida 23:59 + tolerancia);
+    se comparan contra la hora del mismo día, igual que datetime.combine.
+    """
+
+    __slots__ = ()
+
+    def works_on(self, dt):
+        return bool(self.day_mask & (1 << dt.weekday()))
+
+    def status(self, dt):
+        """Mismo resultado que check_schedule_status: {'state', 'minutes_diff'}"""
+        dt = _lima(dt)
+        if not self.works_on(dt):
+            return {'state': 'fuera_de_horario', 'minutes_diff': None}
+
+        now = seconds_of_day(dt)
+        minutes_diff_entrada = int((now - self.entry_s) / 60)
+        if now <= self.on_time_until:
+            return {'state': 'presente', 'minutes_diff': max(0, minutes_diff_entrada)}
+        if self.on_time_until < now < self.exit_s:
+            return {'state': 'tarde', 'minutes_diff': minutes_diff_entrada}
+        if self.exit_window[0] <= now <= self.exit_window[1]:
+            return {'state': 'presente', 'minutes_diff': None}
+        return {'state': 'fuera_de_horario', 'minutes_diff': None}
+
+    def in_entry_window(self, dt):
+        return self.entry_window[0] <= seconds_of_day(_lima(dt)) <= self.entry_window[1]
+
+    def in_exit_window(self, dt):
+        return self.exit_window[0] <= seconds_of_day(_lima(dt)) <= self.exit_window[1]
+
+    def in_workday(self, dt):
+        return self.entry_s <= seconds_of_day(_lima(dt)) <= self.workday_until
+
+    def exit_allowed(self, dt):
+        """Se puede marcar salida desde EXIT_WINDOW_EARLY minutos antes de la hora"""
+        return seconds_of_day(_lima(dt)) >= self.exit_window[0]
+
+    def overlaps(self, other):
+        """Dos horarios chocan si comparten un día y sus franjas se cruzan"""
+        if not self.day_mask & other.day_mask:
+            return False
+        return not (self.exit_min <= other.entry_min or other.exit_min <= self.entry_min)
+
+
+def _lima(dt):
+    return dt.astimezone(LIMA_TZ) if dt.tzinfo else dt
+
+
+def seconds_of_day(dt):
+    return dt.hour * 3600 + dt.minute * 60 + dt.second + dt.microsecond / 1_000_000
+
+
+def _to_time(t):
+    if isinstance(t, str):
+        return datetime.strptime(t, "%H:%M").time()
+    return t
+
+
+def day_mask(dias):
+    mask = 0
+    for d in (dias or '').split(','):
+        mask |= DAY_BITS.get(d.strip(), 0)
+    return mask
+
+
+@lru_cache(maxsize=1024)
+def _compile(dias, hora_entrada, hora_salida, tolerancia_entrada, tolerancia_salida):
+    entrada = _to_time(hora_entrada)
+    salida = _to_time(hora_salida)
+    tol_e = int(tolerancia_entrada or 0)
+    tol_s = int(tolerancia_salida or 0)
+
+    entry_min = entrada.hour * 60 + entrada.minute
+    exit_min = salida.hour * 60 + salida.minute
+    entry_s = entry_min * 60 + entrada.second
+    exit_s = exit_min * 60 + salida.second
+
+    return CompiledSchedule(
+        day_mask=day_mask(dias),
+        entry_min=entry_min,
+        exit_min=exit_min,
+        tolerancia_entrada=tol_e,
+        tolerancia_salida=tol_s,
+        entry_s=entry_s,
+        exit_s=exit_s,
+        on_time_until=entry_s + tol_e * 60,
+        entry_window=(entry_s - ENTRY_WINDOW_EARLY * 60, entry_s + tol_e * 60),
+        exit_window=(exit_s - EXIT_WINDOW_EARLY * 60, exit_s + tol_s * 60),
+        workday_until=exit_s + tol_s * 60
+    )
+
+
+def compile_schedule(schedule):
+    """
+    CompiledSchedule de un Schedule (o ScheduleRecord). Se cachea por los
+    valores del horario, así se construye una vez por versión del horario.
+    """
+    if schedule is None:
+        return None
+    return _compile(
+        schedule.dias,
+        schedule.hora_entrada,
+        schedule.hora_salida,
+        schedule.tolerancia_entrada,
+        schedule.tolerancia_salida
+    )
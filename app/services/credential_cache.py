@@ -0,0 +1,133 @@
+# app/services/credential_cache.py
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import User_iot, Role
+
+
+# Registro compacto e inmutable con lo que necesita una decisión de puerta
+CredentialRecord = namedtuple(
+    'CredentialRecord',
+    ['id', 'nombre', 'apellido', 'role_name', 'is_active', 'huella_id', 'rfid']
+)
+
+
+class CredentialCache:
+    """
+    Índice en memoria de credenciales (huella_id y rfid) -> CredentialRecord.
+
+    Se construye con una sola consulta (usuarios + rol) la primera vez que se
+    usa y se descarta cuando cambia un usuario o un rol. Como cada worker de
+    gunicorn tiene su propia copia, el índice también expira tras `ttl`
+    segundos para recoger cambios hechos en otros procesos.
+    """
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # (by_huella, by_rfid) se reemplaza entero: un lector nunca ve None
+        # ni una mitad de otra carga aunque invalidate() corra en paralelo
+        self._index = None
+        self._loaded_at = 0.0
+
+    def _fresh_index(self):
+        index = self._index
+        if index is None:
+            return None
+        if self.ttl is None or (time.monotonic() - self._loaded_at) < self.ttl:
+            return index
+        return None
+
+    def _load(self):
+        rows = db.session.query(
+            User_iot.id,
+            User_iot.nombre,
+            User_iot.apellido,
+            Role.name,
+            User_iot.is_active,
+            User_iot.huella_id,
+            User_iot.rfid
+        ).outerjoin(
+            Role, User_iot.role_id == Role.id
+        ).filter(
+            (User_iot.huella_id.isnot(None)) | (User_iot.rfid.isnot(None))
+        ).all()
+
+        by_huella = {}
+        by_rfid = {}
+        for row in rows:
+            record = CredentialRecord(*row)
+            if record.huella_id is not None:
+                by_huella[record.huella_id] = record
+            if record.rfid:
+                by_rfid[record.rfid] = record
+
+        self._loaded_at = time.monotonic()
+        self._index = (by_huella, by_rfid)
+        return self._index
+
+    def _ensure_loaded(self):
+        """Devuelve el índice (by_huella, by_rfid) vigente, cargándolo si hace falta"""
+        index = self._fresh_index()
+        if index is not None:
+            return index
+        with self._lock:
+            index = self._fresh_index()
+            if index is None:
+                index = self._load()
+            return index
+
+    def by_huella(self, huella_id):
+        """Devuelve el CredentialRecord asociado a una huella o None"""
+        if huella_id is None:
+            return None
+        try:
+            huella_id = int(huella_id)
+        except (TypeError, ValueError):
+            return None
+        by_huella, _ = self._ensure_loaded()
+        return by_huella.get(huella_id)
+
+    def by_rfid(self, rfid):
+        """Devuelve el CredentialRecord asociado a un RFID o None"""
+        if not rfid:
+            return None
+        _, by_rfid = self._ensure_loaded()
+        return by_rfid.get(rfid)
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+
+
+credential_cache = CredentialCache()
+
+
+def init_credential_cache(app):
+    credential_cache.ttl = app.config.get('CREDENTIAL_CACHE_TTL', credential_cache.ttl)
+
+
+# Invalidación automática: cualquier commit que toque User_iot o Role
+# (rutas de usuarios, esp32, assign-rfid, etc.) descarta el índice.
+@event.listens_for(Session, 'before_flush')
+def _track_credential_changes(session, flush_context, instances):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (User_iot, Role)):
+            session.info['credentials_changed'] = True
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    if session.info.pop('credentials_changed', False):
+        credential_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending_invalidation(session):
+    session.info.pop('credentials_changed', None)
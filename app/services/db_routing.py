@@ -0,0 +1,39 @@
+# app/services/db_routing.py
+from functools import wraps
+
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+
+
+# Clave de SQLALCHEMY_BINDS para la réplica de lectura (REPLICA_DATABASE_URL)
+REPLICA_BIND = 'replica'
+
+
+class RoutingSession(Session):
+    """
+    Sesión que manda las lecturas de los endpoints marcados con
+    @read_replica al bind 'replica'. Sin réplica configurada, durante un
+    flush o para modelos con otro bind_key se usa el bind normal.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        default = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or self._flushing or not replica_requested():
+            return default
+        engines = self._db.engines
+        if REPLICA_BIND in engines and default is engines.get(None):
+            return engines[REPLICA_BIND]
+        return default
+
+
+def replica_requested():
+    return has_app_context() and g.get('_db_read_replica', False)
+
+
+def read_replica(view):
+    """Ejecuta la vista (y su respuesta en streaming) contra la réplica de lectura"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g._db_read_replica = True
+        return view(*args, **kwargs)
+    return wrapper
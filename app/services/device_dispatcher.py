@@ -0,0 +1,246 @@
+# app/services/device_dispatcher.py
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+
+# Los túneles ngrok se usan con verify=False; evitar un warning por petición
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+
+def build_esp32_url(esp32_ip):
+    """Construir URL correcta para el ESP32"""
+    # Si ya es una URL completa
+    if esp32_ip.startswith('http://') or esp32_ip.startswith('https://'):
+        return esp32_ip.rstrip('/')
+
+    # Si es un dominio ngrok, usar HTTPS
+    if 'ngrok' in esp32_ip:
+        return f"https://{esp32_ip}"
+
+    # Para IPs locales, usar HTTP
+    return f"http://{esp32_ip}"
+
+
+class DeviceDispatcher:
+    """
+    Envío de peticiones HTTP a los ESP32 fuera del hilo de la petición.
+
+    - Una requests.Session por dispositivo (keep-alive: la conexión TCP/TLS
+      al túnel ngrok se reutiliza entre comandos).
+    - Un ThreadPoolExecutor acotado ejecuta las peticiones; la ruta puede
+      esperar el resultado o devolver un job_id y consultarlo después.
+    - Los broadcasts usan otro pool de `broadcast_parallelism` hilos, así un
+      envío a muchos lectores no deja sin hilos a los comandos sueltos.
+
+    Los jobs viven en memoria del proceso que los creó (se limpian tras
+    `job_ttl` segundos), igual que el resto de cachés por worker.
+    """
+
+    def __init__(self):
+        self.max_workers = 8
+        self.command_timeout = 15
+        self.status_timeout = 8
+        self.sync_wait = 3
+        self.job_ttl = 300
+        self.broadcast_parallelism = 8
+        self._executor = None
+        self._broadcast_executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._jobs = {}
+
+    def init_app(self, app):
+        self.max_workers = app.config.get('ESP32_DISPATCH_WORKERS', self.max_workers)
+        self.command_timeout = app.config.get('ESP32_COMMAND_TIMEOUT', self.command_timeout)
+        self.status_timeout = app.config.get('ESP32_STATUS_TIMEOUT', self.status_timeout)
+        self.sync_wait = app.config.get('ESP32_SYNC_WAIT', self.sync_wait)
+        self.job_ttl = app.config.get('ESP32_JOB_TTL', self.job_ttl)
+        self.broadcast_parallelism = app.config.get('ESP32_BROADCAST_PARALLELISM', self.broadcast_parallelism)
+
+    def _ensure_executor(self):
+        # Con gunicorn --preload el pool del master no sirve en los workers
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._sessions = {}
+                self._jobs = {}
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='esp32-dispatch'
+                )
+                self._broadcast_executor = ThreadPoolExecutor(
+                    max_workers=self.broadcast_parallelism, thread_name_prefix='esp32-broadcast'
+                )
+            return self._executor
+
+    def session_for(self, base_url):
+        with self._lock:
+            session = self._sessions.get(base_url)
+            if session is None:
+                session = requests.Session()
+                session.verify = False  # IMPORTANTE: certificados de ngrok
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[base_url] = session
+            return session
+
+    def _request(self, method, esp32_ip, path, payload, timeout):
+        """Ejecuta la petición y la resume en un dict (nunca lanza)"""
+        base_url = build_esp32_url(esp32_ip)
+        started = time.perf_counter()
+        outcome = {'esp32_ip': esp32_ip, 'url': f"{base_url}{path}"}
+        try:
+            response = self.session_for(base_url).request(
+                method, outcome['url'], json=payload, timeout=timeout
+            )
+            outcome['status_code'] = response.status_code
+            outcome['text'] = response.text
+            try:
+                outcome['json'] = response.json()
+            except ValueError:
+                outcome['json'] = None
+            outcome['error'] = None
+        except requests.exceptions.Timeout:
+            outcome['error'] = 'timeout'
+        except requests.exceptions.ConnectionError as e:
+            outcome['error'] = 'connection'
+            outcome['detail'] = str(e)
+        except Exception as e:
+            outcome['error'] = 'unexpected'
+            outcome['detail'] = str(e)
+            outcome['error_type'] = type(e).__name__
+        outcome['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return outcome
+
+    def _new_job(self, kind, esp32_ip):
+        self._prune_jobs()
+        job = {
+            'id': uuid.uuid4().hex,
+            'kind': kind,
+            'esp32_ip': esp32_ip,
+            'status': 'pending',
+            'created_at': time.time(),
+            'finished_at': None,
+            'result': None,
+        }
+        with self._lock:
+            self._jobs[job['id']] = job
+        return job
+
+    def submit(self, method, esp32_ip, path, payload=None, timeout=None, kind='command'):
+        """Encola la petición y devuelve el job_id"""
+        executor = self._ensure_executor()
+        job = self._new_job(kind, esp32_ip)
+
+        def run():
+            job['status'] = 'running'
+            job['result'] = self._request(method, esp32_ip, path, payload, timeout)
+            job['finished_at'] = time.time()
+            job['status'] = 'done'
+            return job['result']
+
+        job['future'] = executor.submit(run)
+        return job['id']
+
+    def send_command(self, esp32_ip, payload):
+        return self.submit('POST', esp32_ip, '/command', payload, self.command_timeout, kind='command')
+
+    def check_status(self, esp32_ip):
+        return self.submit('GET', esp32_ip, '/status', None, self.status_timeout, kind='status')
+
+    def fetch_status(self, esp32_ip):
+        """GET /status en el hilo que llama (sin pasar por el pool de comandos)"""
+        return self._request('GET', esp32_ip, '/status', None, self.status_timeout)
+
+    def broadcast(self, targets, payload, parallelism=None, timeout=None):
+        """
+        Envía el mismo comando a varios dispositivos y devuelve el job_id.
+
+        `targets` es [(device_id, esp32_ip)]. Las peticiones van al pool de
+        broadcasts con como mucho `parallelism` en vuelo: al terminar una se
+        lanza la siguiente, sin un hilo que espere a las demás. El resultado
+        del job es {'command', 'elapsed_ms', 'outcomes': {device_id: outcome}}
+        con los dispositivos en el orden de `targets`.
+        """
+        self._ensure_executor()
+        executor = self._broadcast_executor
+        job = self._new_job('broadcast', None)
+        job['future'] = Future()
+        parallelism = max(1, min(parallelism or self.broadcast_parallelism, len(targets) or 1))
+        timeout = timeout or self.command_timeout
+        pending = list(reversed(targets))
+        outcomes = {}
+        lock = threading.Lock()
+        started = time.perf_counter()
+
+        def finish():
+            job['result'] = {
+                'command': (payload or {}).get('command'),
+                'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+                'outcomes': {device_id: outcomes[device_id] for device_id, _ in targets},
+            }
+            job['finished_at'] = time.time()
+            job['status'] = 'done'
+            job['future'].set_result(job['result'])
+
+        def launch(device_id, esp32_ip):
+            future = executor.submit(self._request, 'POST', esp32_ip, '/command', payload, timeout)
+            future.add_done_callback(lambda f: finished(device_id, esp32_ip, f))
+
+        def finished(device_id, esp32_ip, future):
+            try:
+                outcome = future.result()
+            except Exception as e:
+                outcome = {'esp32_ip': esp32_ip, 'error': 'unexpected', 'detail': str(e)}
+            with lock:
+                outcomes[device_id] = outcome
+                following = pending.pop() if pending else None
+                done = len(outcomes) == len(targets)
+            if following:
+                launch(*following)
+            elif done:
+                finish()
+
+        job['status'] = 'running'
+        with lock:
+            first = [pending.pop() for _ in range(min(parallelism, len(pending)))]
+        if not first:
+            finish()
+        for device_id, esp32_ip in first:
+            launch(device_id, esp32_ip)
+        return job['id']
+
+    def wait(self, job_id, timeout=None):
+        """Espera el resultado del job (o None si no terminó a tiempo)"""
+        job = self.get_job(job_id)
+        if job is None:
+            return None
+        try:
+            return job['future'].result(timeout=timeout)
+        except Exception:
+            return job['result']
+
+    def get_job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune_jobs(self):
+        limit = time.time() - self.job_ttl
+        with self._lock:
+            stale = [
+                job_id for job_id, job in self._jobs.items()
+                if job['finished_at'] is not None and job['finished_at'] < limit
+            ]
+            for job_id in stale:
+                del self._jobs[job_id]
+
+
+device_dispatcher = DeviceDispatcher()
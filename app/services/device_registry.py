@@ -0,0 +1,306 @@
+# app/services/device_registry.py
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import func, select, update
+
+from app import db
+from app.models import Device
+from app.services.device_dispatcher import device_dispatcher, build_esp32_url
+
+
+def _firmware_of(data):
+    if not isinstance(data, dict):
+        return None
+    firmware = data.get('firmware') or data.get('version')
+    return str(firmware)[:40] if firmware else None
+
+
+# Clave del advisory lock que elige al único worker que sondea
+_PROBER_LOCK_KEY = 0x44455631  # 'DEV1'
+
+
+class DeviceRegistry:
+    """
+    Estado de salud de los ESP32 registrados (tabla device).
+
+    Cada worker tiene un hilo, pero solo sondea el que tiene el advisory
+    lock de Postgres (en SQLite, el único proceso). Ese hilo consulta /status
+    de todos los dispositivos cada `probe_interval` segundos, en paralelo en
+    su propio pool de `probe_workers` hilos (sin ocupar el de comandos de
+    device_dispatcher), guarda el resultado en memoria y lo persiste en la
+    tabla. Las consultas de estado leen de memoria o de la tabla (la escribe
+    el worker que sondea) sin hacer I/O de red.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.probe_interval = 30
+        self.probe_workers = 4
+        self.max_age = 90
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._snapshots = {}
+        # ids registrados, para validar device_id sin consultar por petición
+        self.known_ids_ttl = 60
+        self._known_ids = None
+        self._known_ids_at = 0.0
+        self._thread = None
+        self._pid = None
+        self._executor = None
+        self._leader_conn = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+        self.probe_interval = app.config.get('DEVICE_PROBE_INTERVAL', self.probe_interval)
+        self.probe_workers = app.config.get('DEVICE_PROBE_WORKERS', self.probe_workers)
+        self.max_age = app.config.get('DEVICE_STATUS_MAX_AGE', self.max_age)
+
+    # ---------- lectura (sin red) ----------
+
+    def _snapshot_from_row(self, device):
+        return {
+            'device_id': device.id,
+            'base_url': device.base_url,
+            'nombre': device.nombre,
+            'health': device.health or 'unknown',
+            'firmware': device.firmware,
+            'esp32_data': None,
+            'last_seen': device.last_seen,
+            'last_checked': device.last_checked,
+            'latency_ms': device.last_latency_ms,
+            'error': device.last_error,
+            'checked_at': None,  # monotonic del sondeo hecho por este worker
+        }
+
+    def status(self, device_id):
+        """Último estado conocido del dispositivo o None si no está registrado"""
+        self._ensure_started()
+        with self._lock:
+            snapshot = self._snapshots.get(device_id)
+        if snapshot is not None:
+            return snapshot
+        device = db.session.get(Device, device_id)
+        return self._snapshot_from_row(device) if device else None
+
+    def all_status(self):
+        self._ensure_started()
+        devices = Device.query.order_by(Device.id).all()
+        with self._lock:
+            return [self._snapshots.get(d.id) or self._snapshot_from_row(d) for d in devices]
+
+    def find_by_url(self, esp32_ip):
+        """Estado del dispositivo registrado con esa IP/URL (o None)"""
+        base_url = build_esp32_url(esp32_ip)
+        with self._lock:
+            for snapshot in self._snapshots.values():
+                if snapshot['base_url'] == base_url:
+                    return snapshot
+        device = Device.query.filter_by(base_url=base_url).first()
+        return self.status(device.id) if device else None
+
+    def is_registered(self, device_id):
+        """True si device_id es un dispositivo registrado (ids en caché known_ids_ttl s)"""
+        if not device_id:
+            return False
+        ids = self._known_ids
+        now = time.monotonic()
+        if ids is None or now - self._known_ids_at > self.known_ids_ttl:
+            ids = frozenset(db.session.execute(select(Device.id)).scalars())
+            self._known_ids, self._known_ids_at = ids, now
+        return str(device_id) in ids
+
+    def is_fresh(self, snapshot):
+        if not snapshot:
+            return False
+        checked_at = snapshot.get('checked_at')
+        if checked_at is not None:
+            return time.monotonic() - checked_at <= self.max_age
+        # Sondeado por otro worker: vale lo que persistió en la tabla
+        last_checked = snapshot.get('last_checked')
+        return last_checked is not None and (datetime.utcnow() - last_checked).total_seconds() <= self.max_age
+
+    # ---------- registro ----------
+
+    def register(self, device_id, esp32_ip, nombre=None):
+        device = db.session.get(Device, device_id)
+        if device is None:
+            device = Device(id=device_id, health='unknown')
+            db.session.add(device)
+        device.base_url = build_esp32_url(esp32_ip)
+        if nombre is not None:
+            device.nombre = nombre
+        db.session.commit()
+        with self._lock:
+            self._snapshots.pop(device_id, None)
+        self._known_ids = None
+        self.probe_soon()
+        return device
+
+    def unregister(self, device_id):
+        device = db.session.get(Device, device_id)
+        if device is None:
+            return False
+        db.session.delete(device)
+        db.session.commit()
+        with self._lock:
+            self._snapshots.pop(device_id, None)
+        self._known_ids = None
+        return True
+
+    # ---------- sondeo ----------
+
+    def probe_all(self):
+        """Sondea todos los dispositivos en paralelo; devuelve cuántos están online"""
+        devices = [(d.id, d.base_url, d.nombre) for d in Device.query.all()]
+        if not devices:
+            return 0
+
+        executor = self._ensure_executor()
+        jobs = [(device, executor.submit(device_dispatcher.fetch_status, device[1])) for device in devices]
+        now = datetime.utcnow()
+        rows = []
+        online = 0
+        for (device_id, base_url, nombre), future in jobs:
+            outcome = future.result()
+            is_online = outcome.get('error') is None and outcome.get('status_code') == 200
+            data = outcome.get('json') if is_online else None
+            if outcome.get('error') is not None:
+                error = outcome.get('detail') or outcome['error']
+            elif not is_online:
+                error = f"HTTP {outcome.get('status_code')}"
+            else:
+                error = None
+
+            with self._lock:
+                previous = self._snapshots.get(device_id) or {}
+            snapshot = {
+                'device_id': device_id,
+                'base_url': base_url,
+                'nombre': nombre,
+                'health': 'online' if is_online else 'offline',
+                'firmware': _firmware_of(data) or previous.get('firmware'),
+                'esp32_data': data,
+                'last_seen': now if is_online else previous.get('last_seen'),
+                'last_checked': now,
+                'latency_ms': outcome.get('elapsed_ms'),
+                'error': error[:255] if error else None,
+                'checked_at': time.monotonic(),
+            }
+            with self._lock:
+                self._snapshots[device_id] = snapshot
+            online += is_online
+
+            row = {
+                'id': device_id,
+                'health': snapshot['health'],
+                'last_checked': now,
+                'last_latency_ms': snapshot['latency_ms'],
+                'last_error': snapshot['error'],
+            }
+            if is_online:
+                row['last_seen'] = now
+                if snapshot['firmware']:
+                    row['firmware'] = snapshot['firmware']
+            rows.append(row)
+
+        # Un UPDATE por grupo de columnas (executemany por clave primaria)
+        for keys in {tuple(sorted(r)) for r in rows}:
+            db.session.execute(update(Device), [r for r in rows if tuple(sorted(r)) == keys])
+        db.session.commit()
+        return online
+
+    def probe_soon(self):
+        """Adelanta el siguiente sondeo (p. ej. tras registrar un dispositivo)"""
+        self._ensure_started()
+        self._wake.set()
+
+    def _ensure_started(self):
+        # Con gunicorn --preload el hilo del master no existe en los workers
+        if self.app is None or not self.probe_interval:
+            return
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Heredado del master: ni sus hilos ni su conexión sirven aquí
+                self._executor = None
+                self._leader_conn = None
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='device-prober', daemon=True)
+            self._thread.start()
+
+    def _ensure_executor(self):
+        # Solo lo usa el hilo de sondeo, que ya es de este proceso
+        with self._start_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.probe_workers, thread_name_prefix='device-probe'
+                )
+            return self._executor
+
+    def _is_leader(self):
+        """
+        True si este proceso debe sondear. En Postgres lo decide un advisory
+        lock de sesión sobre una conexión que el hilo conserva: si el worker
+        muere o la conexión se corta, el lock se libera y otro lo toma.
+        """
+        if db.engine.dialect.name != 'postgresql':
+            return True
+        if self._leader_conn is not None:
+            try:
+                self._leader_conn.exec_driver_sql('SELECT 1')
+                self._leader_conn.commit()
+                return True
+            except Exception:
+                self._release_leadership()
+        conn = db.engine.connect()
+        try:
+            acquired = conn.execute(select(func.pg_try_advisory_lock(_PROBER_LOCK_KEY))).scalar()
+            conn.commit()
+        except Exception:
+            conn.close()
+            raise
+        if not acquired:
+            conn.close()
+            return False
+        self._leader_conn = conn
+        return True
+
+    def _release_leadership(self):
+        conn, self._leader_conn = self._leader_conn, None
+        if conn is not None:
+            try:
+                conn.invalidate()  # cerrar la sesión libera el advisory lock
+            except Exception:
+                pass
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    if self._is_leader():
+                        self.probe_all()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"[DEVICE PROBER] Error sondeando dispositivos: {e}")
+                finally:
+                    db.session.remove()
+            self._wake.wait(self.probe_interval)
+            self._wake.clear()
+        self._release_leadership()
+
+    def shutdown(self):
+        self._stop.set()
+        self._wake.set()
+
+
+device_registry = DeviceRegistry()
@@ -0,0 +1,352 @@
+# app/services/failed_attempts.py
+import atexit
+import importlib
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from app import db
+from app.models import FailedAttempt, FailedAttemptHit
+from app.services.device_registry import device_registry
+
+
+class MemoryWindowStore:
+    """
+    Ventanas deslizantes en memoria del worker. Con varios workers cada uno
+    ve solo los intentos que le tocan (con N workers, ~1/N), así que el
+    umbral del buzzer se alcanza N veces más tarde: sirve para un solo
+    worker. Otro store solo necesita hit(keys, window), count(key, window)
+    y flush(window), que se llama en cada flush periódico.
+    """
+
+    def __init__(self, max_keys=50000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._evicted = 0
+
+    def hit(self, keys, window):
+        """Suma un fallo a cada clave y devuelve sus conteos en la ventana"""
+        now = time.monotonic()
+        with self._lock:
+            counts = [self._hit(key, now, window) for key in keys]
+            if len(self._windows) > self.max_keys:
+                self._evict(now, window)
+        return counts
+
+    def count(self, key, window):
+        now = time.monotonic()
+        with self._lock:
+            hits = self._windows.get(key)
+            if not hits:
+                return 0
+            self._expire(hits, now, window)
+            return len(hits)
+
+    def flush(self, window):
+        with self._lock:
+            self._evict(time.monotonic(), window)
+
+    def stats(self):
+        with self._lock:
+            return {'tracked_keys': len(self._windows), 'evicted': self._evicted}
+
+    def _expire(self, hits, now, window):
+        limit = now - window
+        while hits and hits[0] <= limit:
+            hits.popleft()
+
+    def _hit(self, key, now, window):
+        hits = self._windows.get(key)
+        if hits is None:
+            hits = self._windows[key] = deque()
+        self._expire(hits, now, window)
+        hits.append(now)
+        return len(hits)
+
+    def _evict(self, now, window):
+        # Muchas tarjetas distintas (fuerza bruta): descartar primero las
+        # ventanas vencidas y, si no alcanza, las más antiguas
+        for key in [k for k, hits in self._windows.items() if not hits or hits[-1] <= now - window]:
+            del self._windows[key]
+            self._evicted += 1
+        overflow = len(self._windows) - self.max_keys
+        if overflow > 0:
+            oldest = sorted(self._windows, key=lambda k: self._windows[k][-1])[:overflow]
+            for key in oldest:
+                del self._windows[key]
+            self._evicted += overflow
+
+
+class DatabaseWindowStore(MemoryWindowStore):
+    """
+    Ventanas locales del worker más los fallos de los demás workers leídos
+    de failed_attempt_hit. La petición no toca la base: los fallos nuevos se
+    insertan en bloque en el flush periódico, que también borra las filas
+    vencidas y relee, para las claves activas en este worker, cuántos
+    fallos aportaron los otros. Lo ajeno llega con hasta un flush de
+    retraso.
+    """
+
+    def __init__(self, max_keys=50000):
+        super().__init__(max_keys)
+        self._unsent = []
+        self._remote = {}
+
+    def hit(self, keys, window):
+        counts = super().hit(keys, window)
+        now = datetime.utcnow()
+        with self._lock:
+            self._unsent.extend({'key': key, 'hit_at': now} for key in keys)
+            return [count + self._remote.get(key, 0) for key, count in zip(keys, counts)]
+
+    def count(self, key, window):
+        local = super().count(key, window)
+        with self._lock:
+            return local + self._remote.get(key, 0)
+
+    def flush(self, window):
+        super().flush(window)
+        now = time.monotonic()
+        with self._lock:
+            rows, self._unsent = self._unsent, []
+            # Conteo propio en el mismo instante en que se toman las filas,
+            # para descontarlo del total de la tabla
+            local = {}
+            for key, hits in self._windows.items():
+                self._expire(hits, now, window)
+                if hits:
+                    local[key] = len(hits)
+        table = FailedAttemptHit.__table__
+        cutoff = datetime.utcnow() - timedelta(seconds=window)
+        try:
+            with db.engine.begin() as conn:
+                if rows:
+                    conn.execute(table.insert(), rows)
+                conn.execute(table.delete().where(table.c.hit_at <= cutoff))
+                totals = {}
+                keys = list(local)
+                for i in range(0, len(keys), 500):
+                    totals.update(conn.execute(window_counts(keys[i:i + 500], cutoff)).all())
+        except Exception:
+            with self._lock:
+                self._unsent[:0] = rows
+            raise
+        remote = {key: total - local[key] for key, total in totals.items() if total > local[key]}
+        with self._lock:
+            self._remote = remote
+
+    def stats(self):
+        data = super().stats()
+        with self._lock:
+            data.update({'unsent_hits': len(self._unsent), 'remote_keys': len(self._remote)})
+        return data
+
+
+def window_counts(keys, since):
+    """Fallos por clave desde `since` (por ix_failed_attempt_hit_key)"""
+    table = FailedAttemptHit.__table__
+    return select(table.c.key, func.count()).where(
+        table.c.key.in_(keys),
+        table.c.hit_at > since
+    ).group_by(table.c.key)
+
+
+class FailedAttemptTracker:
+    """
+    Intentos fallidos en ventanas deslizantes.
+
+    Se cuenta por identificador (tipo + valor) y por lector cuando device_id
+    es un dispositivo registrado (llega sin autenticar en el cuerpo, así que
+    un id desconocido no abre ventana propia). La IP no cuenta: detrás del
+    proxy o con varios lectores en la misma red es compartida, y para
+    limitar por origen ya está el throttle. El conteo que decide el buzzer es el de los últimos `window` segundos,
+    así que decae solo. La tabla FailedAttempt se actualiza cada
+    `flush_interval` segundos con los incrementos acumulados (un upsert por
+    identificador y un commit por flush).
+
+    Las ventanas viven en el store de FAILED_ATTEMPT_STORE: 'memory' (por
+    worker, ver MemoryWindowStore), 'database' (compartido a través del
+    flush periódico, ver DatabaseWindowStore) o 'modulo:Clase'.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.window = 300
+        self.flush_interval = 10
+        self.max_keys = 50000
+        self.store = MemoryWindowStore(self.max_keys)
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._pending = {}
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._stats = {'recorded': 0, 'flushed': 0, 'flushes': 0, 'flush_errors': 0}
+
+    def init_app(self, app):
+        self.app = app
+        self.window = app.config.get('FAILED_ATTEMPT_WINDOW', self.window)
+        self.flush_interval = app.config.get('FAILED_ATTEMPT_FLUSH_INTERVAL', self.flush_interval)
+        self.max_keys = app.config.get('FAILED_ATTEMPT_MAX_KEYS', self.max_keys)
+        self.store = self._load_store(app.config.get('FAILED_ATTEMPT_STORE', 'memory'))
+        atexit.register(self.shutdown)
+
+    def _load_store(self, spec):
+        """'memory', 'database' o 'paquete.modulo:Clase' (se instancia sin argumentos)"""
+        if not spec or spec == 'memory':
+            return MemoryWindowStore(self.max_keys)
+        if spec == 'database':
+            return DatabaseWindowStore(self.max_keys)
+        module_name, _, attr = spec.partition(':')
+        return getattr(importlib.import_module(module_name), attr)()
+
+    def record(self, identifier, identifier_type, device_id=None, user_id=None, reason=None):
+        """
+        Registra un fallo y devuelve el mayor conteo en ventana entre el del
+        identificador y el del lector registrado (una ráfaga de tarjetas
+        distintas en el mismo lector también dispara el buzzer).
+        """
+        keys = [f'id:{identifier_type}:{identifier}']
+        if device_id and device_registry.is_registered(device_id):
+            keys.append(f'device:{device_id}')
+        counts = self.store.hit(keys, self.window)
+
+        with self._lock:
+            pending_key = (identifier, identifier_type)
+            entry = self._pending.get(pending_key)
+            if entry is None:
+                entry = self._pending[pending_key] = {
+                    'identifier': identifier,
+                    'identifier_type': identifier_type,
+                    'count': 0,
+                }
+            entry['count'] += 1
+            entry['timestamp'] = datetime.utcnow()
+            if device_id:
+                entry['device_id'] = device_id
+            if user_id:
+                entry['user_id'] = user_id
+            if reason:
+                entry['reason'] = reason
+            self._stats['recorded'] += 1
+
+        if not self.flush_interval or self.app is None:
+            self.flush()
+            self.store.flush(self.window)
+        else:
+            self._ensure_started()
+        return max(counts)
+
+    def count(self, identifier, identifier_type):
+        return self.store.count(f'id:{identifier_type}:{identifier}', self.window)
+
+    def device_count(self, device_id):
+        return self.store.count(f'device:{device_id}', self.window)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data.update({
+                'pending_identifiers': len(self._pending),
+                'window_seconds': self.window,
+                'flush_interval': self.flush_interval,
+                'store': type(self.store).__name__,
+            })
+        data.update(self.store.stats())
+        return data
+
+    # ---------- persistencia ----------
+
+    def flush(self):
+        """Escribe en FailedAttempt los incrementos acumulados desde el último flush"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        try:
+            # identifier IN (...) recorre ix_failed_attempt_identifier por búsqueda;
+            # el tipo se compara aquí (la tupla IN no usa el índice en todos los motores)
+            existing = {
+                (fa.identifier, fa.identifier_type): fa
+                for fa in FailedAttempt.query.filter(
+                    FailedAttempt.identifier.in_({identifier for identifier, _ in pending})
+                ).all()
+                if (fa.identifier, fa.identifier_type) in pending
+            }
+            for key, entry in pending.items():
+                fa = existing.get(key)
+                if fa is None:
+                    db.session.add(FailedAttempt(
+                        identifier=entry['identifier'],
+                        identifier_type=entry['identifier_type'],
+                        device_id=entry.get('device_id'),
+                        user_id=entry.get('user_id'),
+                        count=entry['count'],
+                        timestamp=entry['timestamp'],
+                        reason=entry.get('reason')
+                    ))
+                else:
+                    fa.count = (fa.count or 0) + entry['count']
+                    fa.timestamp = entry['timestamp']
+                    fa.reason = entry.get('reason') or fa.reason
+                    fa.device_id = entry.get('device_id') or fa.device_id
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Se devuelven los incrementos para el siguiente flush
+            with self._lock:
+                self._stats['flush_errors'] += 1
+                for key, entry in pending.items():
+                    current = self._pending.get(key)
+                    if current is None:
+                        self._pending[key] = entry
+                    else:
+                        current['count'] += entry['count']
+            raise
+
+        with self._lock:
+            self._stats['flushed'] += len(pending)
+            self._stats['flushes'] += 1
+        return len(pending)
+
+    def _ensure_started(self):
+        # Con gunicorn --preload el hilo del master no existe en los workers
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='failed-attempt-flusher', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self._flush_in_context()
+
+    def _flush_in_context(self):
+        with self.app.app_context():
+            try:
+                self.flush()
+                self.store.flush(self.window)
+            except Exception as e:
+                print(f"[FAILED ATTEMPTS] Error persistiendo intentos fallidos: {e}")
+            finally:
+                db.session.remove()
+
+    def shutdown(self):
+        self._stop.set()
+        if self.app is not None and self._pending:
+            self._flush_in_context()
+
+
+failed_attempts = FailedAttemptTracker()
@@ -0,0 +1,129 @@
+# app/services/fingerprint_sync.py
+import base64
+from datetime import datetime
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import Huella, User_iot, FingerprintChange
+
+
+# Columnas de User_iot que viajan en el payload de sincronización
+_USER_FIELDS = ('huella_id', 'nombre', 'apellido')
+
+# Clave del advisory lock que serializa a quienes escriben fingerprint_change
+_CHANGE_LOCK_KEY = 0x46505331  # 'FPS1'
+
+
+def current_version():
+    """Última versión del registro de cambios (0 si nunca hubo cambios)"""
+    return db.session.query(func.coalesce(func.max(FingerprintChange.version), 0)).scalar()
+
+
+def etag_for(version):
+    return f"huellas-{version}"
+
+
+def template_rows(huella_ids=None):
+    """Filas (id, template, user_id, nombre, apellido) de huellas con usuario y template"""
+    query = db.session.query(
+        Huella.id,
+        Huella.template,
+        User_iot.id.label("user_id"),
+        User_iot.nombre,
+        User_iot.apellido
+    ).join(
+        User_iot, User_iot.huella_id == Huella.id
+    ).filter(
+        User_iot.huella_id.isnot(None)
+    )
+    if huella_ids is not None:
+        query = query.filter(Huella.id.in_(huella_ids))
+    return [h for h in query.order_by(Huella.id).all() if h.template and len(h.template) > 0]
+
+
+def load_templates(huella_ids=None):
+    """Huellas con usuario y template (mismo contenido que /huella/sync-all)"""
+    return [
+        {
+            "huella_id": h.id,
+            "user_id": h.user_id,
+            "nombre": h.nombre,
+            "apellido": h.apellido,
+            "template": base64.b64encode(h.template).decode()
+        }
+        for h in template_rows(huella_ids)
+    ]
+
+
+def changes_since(since, version):
+    """
+    Huellas que cambiaron entre `since` y `version`: las que siguen vigentes
+    van en 'upserts' y las que ya no (borradas, desasignadas o sin template)
+    en 'removed'.
+    """
+    changed_ids = [
+        row[0] for row in db.session.query(FingerprintChange.huella_id).filter(
+            FingerprintChange.version > since,
+            FingerprintChange.version <= version
+        ).distinct()
+    ]
+    if not changed_ids:
+        return [], []
+
+    upserts = load_templates(changed_ids)
+    present = {h["huella_id"] for h in upserts}
+    removed = sorted(set(changed_ids) - present)
+    return upserts, removed
+
+
+def _user_huella_ids(state, user):
+    """huella_id afectados por un cambio de usuario (el anterior y el nuevo)"""
+    ids = set()
+    history = state.attrs.huella_id.history
+    ids.update(h for h in history.deleted if h is not None)
+    ids.update(h for h in history.added if h is not None)
+    if user.huella_id is not None and any(
+        state.attrs[field].history.has_changes() for field in _USER_FIELDS
+    ):
+        ids.add(user.huella_id)
+    return ids
+
+
+# Cada flush que toca huellas o los datos sincronizados de un usuario deja
+# una fila por huella afectada; la versión es la clave autoincremental.
+# Un lector que ya vio la versión N no debe recibir después una N-1: en
+# Postgres dos transacciones podrían tomar 10 y 11 y confirmar primero la 11.
+# Por eso quien escribe toma un advisory lock hasta su commit, y las
+# versiones quedan visibles en el mismo orden en que se asignan.
+@event.listens_for(Session, 'after_flush')
+def _record_fingerprint_changes(session, flush_context):
+    changed = set()
+    for obj in session.new:
+        if isinstance(obj, Huella):
+            changed.add(obj.id)
+        elif isinstance(obj, User_iot) and obj.huella_id is not None:
+            changed.add(obj.huella_id)
+    for obj in session.dirty:
+        if isinstance(obj, Huella):
+            if inspect(obj).attrs.template.history.has_changes():
+                changed.add(obj.id)
+        elif isinstance(obj, User_iot):
+            changed.update(_user_huella_ids(inspect(obj), obj))
+    for obj in session.deleted:
+        if isinstance(obj, Huella):
+            changed.add(obj.id)
+        elif isinstance(obj, User_iot):
+            state = inspect(obj)
+            changed.update(h for h in state.attrs.huella_id.history.sum() if h is not None)
+
+    changed.discard(None)
+    if changed:
+        if session.get_bind(mapper=FingerprintChange.__mapper__).dialect.name == 'postgresql':
+            session.execute(select(func.pg_advisory_xact_lock(_CHANGE_LOCK_KEY)))
+        now = datetime.utcnow()
+        session.execute(
+            FingerprintChange.__table__.insert(),
+            [{"huella_id": huella_id, "changed_at": now} for huella_id in sorted(changed)]
+        )
@@ -2,7 +2,8 @@
 from flask import jsonify
 from datetime import datetime, time
 from app import db
-from app.models import User_iot, AccessLog, AccessStatusEnum, Attendance, FailedAttempt
+from app.models import User_iot, AccessLog, AccessStatusEnum, Attendance
+from app.services.failed_attempts import failed_attempts
 
 
 class IoTService:
@@ -110,14 +111,9 @@ class IoTService:
 
     def _failed(self, reason, sensor_type, identifier):
 
-        failed = FailedAttempt(identifier=identifier, reason=reason)
-        db.session.add(failed)
-        db.session.commit()
-
-        last_3 = FailedAttempt.query.filter_by(identifier=identifier)\
-            .order_by(FailedAttempt.timestamp.desc()).limit(3).count()
+        failed_count = failed_attempts.record(str(identifier), sensor_type.lower(), reason=reason)
 
-        alarm = last_3 >= 3
+        alarm = failed_count >= 3
 
         return jsonify({
             "success": False,
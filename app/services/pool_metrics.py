@@ -0,0 +1,88 @@
+# app/services/pool_metrics.py
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics:
+    """Tiempos de espera para obtener una conexión del pool (por worker)"""
+
+    def __init__(self, sample_size=1000):
+        self.slow_ms = 100
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=sample_size)
+        self._stats = {
+            'checkouts': 0,
+            'slow_checkouts': 0,
+            'timeouts': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+        }
+
+    def record(self, wait_ms):
+        with self._lock:
+            self._samples.append(wait_ms)
+            self._stats['checkouts'] += 1
+            self._stats['total_wait_ms'] += wait_ms
+            if wait_ms > self._stats['max_wait_ms']:
+                self._stats['max_wait_ms'] = wait_ms
+            if wait_ms >= self.slow_ms:
+                self._stats['slow_checkouts'] += 1
+
+    def record_timeout(self, wait_ms):
+        with self._lock:
+            self._stats['timeouts'] += 1
+        print(f"[DB POOL] Sin conexiones libres tras {wait_ms:.0f} ms (pool agotado)")
+
+    def stats(self, engine=None):
+        with self._lock:
+            data = dict(self._stats)
+            samples = sorted(self._samples)
+        data['avg_wait_ms'] = round(data['total_wait_ms'] / data['checkouts'], 3) if data['checkouts'] else 0.0
+        data['p95_wait_ms'] = round(samples[int(len(samples) * 0.95) - 1], 3) if samples else 0.0
+        data['total_wait_ms'] = round(data['total_wait_ms'], 3)
+        data['max_wait_ms'] = round(data['max_wait_ms'], 3)
+        data['slow_threshold_ms'] = self.slow_ms
+
+        pool = engine.pool if engine is not None else None
+        if isinstance(pool, QueuePool):
+            data['pool'] = {
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': pool.overflow(),
+                'max_overflow': pool._max_overflow,
+                'timeout': pool.timeout(),
+            }
+        elif pool is not None:
+            data['pool'] = {'class': type(pool).__name__, 'status': pool.status()}
+        return data
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool que mide cuánto espera cada checkout por una conexión libre"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.record_timeout((time.perf_counter() - started) * 1000)
+            raise
+        pool_metrics.record((time.perf_counter() - started) * 1000)
+        return connection
+
+
+def init_pool_metrics(app):
+    """Usa InstrumentedQueuePool (antes de db.init_app) cuando el engine lleva pool"""
+    pool_metrics.slow_ms = app.config.get('DB_POOL_SLOW_CHECKOUT_MS', pool_metrics.slow_ms)
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if 'pool_size' in options and 'poolclass' not in options:
+        options['poolclass'] = InstrumentedQueuePool
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
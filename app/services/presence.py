@@ -0,0 +1,184 @@
+# app/services/presence.py
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+from app import db
+from app.models import PresenceState
+
+
+# Sensores que alternan ENTRADA/SALIDA en la puerta
+DOOR_SENSORS = ('Huella', 'RFID')
+
+PresenceView = namedtuple(
+    'PresenceView',
+    ['last_action', 'last_action_type', 'last_sensor', 'last_timestamp', 'open_attendance_id']
+)
+
+# Accesos encolados por la escritura diferida que aún no llegan a la BD
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def action_from_type(action_type):
+    """Normaliza un action_type ('ENTRADA_ACCESO', 'SALIDA', ...) a ENTRADA/SALIDA"""
+    if not action_type:
+        return None
+    if 'ENTRADA' in action_type:
+        return 'ENTRADA'
+    if 'SALIDA' in action_type:
+        return 'SALIDA'
+    return None
+
+
+def next_action(presence):
+    """Acción que corresponde al siguiente acceso permitido"""
+    if presence and presence.last_action == 'ENTRADA':
+        return 'SALIDA'
+    return 'ENTRADA'
+
+
+def _value(row, key):
+    return row.get(key) if isinstance(row, dict) else getattr(row, key, None)
+
+
+def _presence_values(row):
+    """Valores de presence_state para un acceso, o None si no cambia el estado"""
+    status = _value(row, 'status')
+    status = getattr(status, 'value', status)
+    action = action_from_type(_value(row, 'action_type'))
+    if (not _value(row, 'user_id') or status != 'Permitido'
+            or _value(row, 'sensor_type') not in DOOR_SENSORS or action is None):
+        return None
+    return {
+        'user_id': _value(row, 'user_id'),
+        'last_action': action,
+        'last_action_type': _value(row, 'action_type'),
+        'last_sensor': _value(row, 'sensor_type'),
+        'last_timestamp': _value(row, 'timestamp') or datetime.utcnow(),
+        'updated_at': datetime.utcnow()
+    }
+
+
+def _insert_for_dialect():
+    name = db.session.get_bind(mapper=PresenceState.__mapper__).dialect.name
+    if name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
+
+
+def _upsert(values_list, columns, only_newer=False):
+    insert = _insert_for_dialect()
+    if insert is None:
+        # Motor sin ON CONFLICT: merge por clave primaria
+        for values in values_list:
+            state = db.session.get(PresenceState, values['user_id'])
+            if state is None:
+                state = PresenceState(user_id=values['user_id'])
+                db.session.add(state)
+            elif only_newer and state.last_timestamp and state.last_timestamp > values['last_timestamp']:
+                continue
+            for col in columns:
+                setattr(state, col, values[col])
+        db.session.flush()
+        return
+
+    stmt = insert(PresenceState.__table__)
+    where = None
+    if only_newer:
+        where = (PresenceState.__table__.c.last_timestamp.is_(None)) | \
+                (PresenceState.__table__.c.last_timestamp <= stmt.excluded.last_timestamp)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id'],
+        set_={col: stmt.excluded[col] for col in columns},
+        where=where
+    )
+    db.session.execute(stmt, values_list)
+
+
+def record_access(*rows):
+    """
+    Actualiza presence_state con uno o más accesos. Se ejecuta en la sesión
+    actual, así queda en la misma transacción que el INSERT del AccessLog.
+    """
+    latest = {}
+    for row in rows:
+        values = _presence_values(row)
+        if values is None:
+            continue
+        prev = latest.get(values['user_id'])
+        if prev is None or prev['last_timestamp'] <= values['last_timestamp']:
+            latest[values['user_id']] = values
+    if latest:
+        _upsert(
+            list(latest.values()),
+            ['last_action', 'last_action_type', 'last_sensor', 'last_timestamp', 'updated_at'],
+            only_newer=True
+        )
+
+
+def set_open_attendance(user_id, attendance_id):
+    """Guarda (o limpia con None) la asistencia abierta del usuario"""
+    _upsert(
+        [{'user_id': user_id, 'open_attendance_id': attendance_id, 'updated_at': datetime.utcnow()}],
+        ['open_attendance_id', 'updated_at']
+    )
+
+
+def remember_pending(row):
+    """Registra un acceso encolado para que el siguiente toggle lo vea"""
+    values = _presence_values(row)
+    if values is None:
+        return
+    with _pending_lock:
+        prev = _pending.get(values['user_id'])
+        if prev is None or prev['last_timestamp'] <= values['last_timestamp']:
+            _pending[values['user_id']] = values
+
+
+def forget_pending(rows):
+    """Descarta los accesos pendientes que ya fueron escritos"""
+    with _pending_lock:
+        for row in rows:
+            values = _presence_values(row)
+            if values is None:
+                continue
+            pending = _pending.get(values['user_id'])
+            if pending and pending['last_timestamp'] <= values['last_timestamp']:
+                del _pending[values['user_id']]
+
+
+def merge_pending(user_id, view):
+    """Combina el estado leído de la BD con un acceso pendiente más reciente"""
+    with _pending_lock:
+        pending = _pending.get(user_id)
+    if pending is None:
+        return view
+    if view is not None and view.last_timestamp and view.last_timestamp > pending['last_timestamp']:
+        return view
+    return PresenceView(
+        pending['last_action'],
+        pending['last_action_type'],
+        pending['last_sensor'],
+        pending['last_timestamp'],
+        view.open_attendance_id if view else None
+    )
+
+
+def get_presence(user_id):
+    """Estado de presencia del usuario: una lectura por clave primaria"""
+    state = db.session.get(PresenceState, user_id)
+    view = None
+    if state is not None:
+        view = PresenceView(
+            state.last_action,
+            state.last_action_type,
+            state.last_sensor,
+            state.last_timestamp,
+            state.open_attendance_id
+        )
+    return merge_pending(user_id, view)
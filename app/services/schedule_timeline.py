@@ -0,0 +1,165 @@
+# app/services/schedule_timeline.py
+import threading
+import time
+from bisect import bisect_right
+from collections import namedtuple
+
+import pytz
+
+from app import db
+from app.models import UserSchedule, Schedule
+
+
+LIMA_TZ = pytz.timezone("America/Lima")
+
+# Copia inmutable de Schedule: se puede compartir entre peticiones sin
+# depender de la sesión que la cargó
+ScheduleRecord = namedtuple(
+    'ScheduleRecord',
+    ['id', 'nombre', 'hora_entrada', 'tolerancia_entrada', 'hora_salida',
+     'tolerancia_salida', 'dias', 'tipo']
+)
+
+ScheduleInterval = namedtuple(
+    'ScheduleInterval',
+    ['start_date', 'end_date', 'assignment_id', 'schedule']
+)
+
+
+def local_date(dt):
+    """Fecha en Lima; un datetime sin zona se interpreta como UTC"""
+    if dt.tzinfo:
+        return dt.astimezone(LIMA_TZ).date()
+    return pytz.utc.localize(dt).astimezone(LIMA_TZ).date()
+
+
+class UserTimeline:
+    """Asignaciones de horario de un usuario ordenadas por start_date"""
+
+    def __init__(self, intervals):
+        # Empates de start_date: gana la asignación más nueva (id mayor)
+        self.intervals = sorted(intervals, key=lambda i: (i.start_date, i.assignment_id))
+        self._starts = [i.start_date for i in self.intervals]
+
+    def interval_on(self, day):
+        """
+        Asignación vigente en `day`: la de start_date más reciente que lo
+        cubre (si una empezó ese mismo día, es esa).
+        """
+        idx = bisect_right(self._starts, day)
+        for interval in reversed(self.intervals[:idx]):
+            if interval.end_date is None or interval.end_date >= day:
+                return interval
+        return None
+
+    def schedule_ids(self):
+        return {i.schedule.id for i in self.intervals}
+
+
+class ScheduleTimelineCache:
+    """
+    Línea de tiempo de horarios por usuario, cargada con una sola consulta
+    (UserSchedule + Schedule) y resuelta en memoria por bisect.
+
+    Las rutas de horarios invalidan explícitamente tras cada commit; el TTL
+    recoge los cambios hechos desde otros workers.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._timelines = {}
+
+    def _load(self, user_ids):
+        rows = db.session.query(
+            UserSchedule.user_id,
+            UserSchedule.id,
+            UserSchedule.start_date,
+            UserSchedule.end_date,
+            Schedule.id,
+            Schedule.nombre,
+            Schedule.hora_entrada,
+            Schedule.tolerancia_entrada,
+            Schedule.hora_salida,
+            Schedule.tolerancia_salida,
+            Schedule.dias,
+            Schedule.tipo
+        ).join(
+            Schedule, UserSchedule.schedule_id == Schedule.id
+        ).filter(
+            UserSchedule.user_id.in_(user_ids)
+        ).all()
+
+        intervals = {user_id: [] for user_id in user_ids}
+        for row in rows:
+            intervals[row[0]].append(
+                ScheduleInterval(row[2], row[3], row[1], ScheduleRecord(*row[4:]))
+            )
+        return {user_id: UserTimeline(items) for user_id, items in intervals.items()}
+
+    def timelines(self, user_ids):
+        """
+        Líneas de tiempo de varios usuarios; las que no están en caché se
+        cargan juntas en una sola consulta (reportes masivos).
+        """
+        now = time.monotonic()
+        result = {}
+        missing = []
+        with self._lock:
+            for user_id in set(user_ids):
+                entry = self._timelines.get(user_id)
+                if entry is not None and (self.ttl is None or now - entry[0] < self.ttl):
+                    result[user_id] = entry[1]
+                else:
+                    missing.append(user_id)
+
+        if missing:
+            loaded = self._load(missing)
+            with self._lock:
+                for user_id, timeline in loaded.items():
+                    self._timelines[user_id] = (now, timeline)
+            result.update(loaded)
+        return result
+
+    def timeline(self, user_id):
+        return self.timelines([user_id])[user_id]
+
+    def active_interval(self, user_id, dt):
+        """ScheduleInterval vigente para el usuario en la fecha/hora dada"""
+        return self.timeline(user_id).interval_on(local_date(dt))
+
+    def active_schedule(self, user_id, dt):
+        """ScheduleRecord vigente para el usuario en la fecha/hora dada"""
+        interval = self.active_interval(user_id, dt)
+        return interval.schedule if interval else None
+
+    def invalidate_user(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._timelines.pop(user_id, None)
+
+    def invalidate_schedule(self, schedule_id):
+        """Descarta las líneas de tiempo que usan el horario (p. ej. al editarlo)"""
+        with self._lock:
+            stale = [
+                user_id for user_id, (_, timeline) in self._timelines.items()
+                if schedule_id in timeline.schedule_ids()
+            ]
+            for user_id in stale:
+                del self._timelines[user_id]
+
+    def invalidate(self):
+        with self._lock:
+            self._timelines.clear()
+
+
+schedule_timeline = ScheduleTimelineCache()
+
+
+def init_schedule_timeline(app):
+    schedule_timeline.ttl = app.config.get('SCHEDULE_CACHE_TTL', schedule_timeline.ttl)
+
+
+def get_user_schedule(user_id, dt):
+    """Obtiene el horario activo de un usuario para una fecha/hora específica"""
+    return schedule_timeline.active_schedule(user_id, dt)
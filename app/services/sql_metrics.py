@@ -0,0 +1,184 @@
+# app/services/sql_metrics.py
+import re
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+_SPACES = re.compile(r'\s+')
+# Listas de parámetros de IN / VALUES: el largo varía pero es la misma consulta
+_PARAM_LIST = re.compile(r'\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))+\s*\)')
+
+
+def statement_shape(statement):
+    """Sentencia normalizada para agrupar repeticiones"""
+    return _PARAM_LIST.sub('(?)', _SPACES.sub(' ', statement).strip())
+
+
+class SqlMetrics:
+    """
+    Cuenta sentencias SQL, tiempo en BD y la sentencia más lenta por petición
+    y por endpoint (por worker). Avisa cuando una misma sentencia se repite
+    más de `n_plus_one_threshold` veces en una petición (típico N+1).
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.n_plus_one_threshold = 10
+        self.headers = False
+        self._listening = False
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def init_app(self, app):
+        self.enabled = app.config.get('SQL_METRICS_ENABLED', self.enabled)
+        self.n_plus_one_threshold = app.config.get('SQL_NPLUSONE_THRESHOLD', self.n_plus_one_threshold)
+        self.headers = app.config.get('SQL_METRICS_HEADERS', self.headers)
+        if not self.enabled:
+            return
+        if not self._listening:
+            # A nivel de clase: cubre el engine principal y el de la réplica
+            event.listen(Engine, 'before_cursor_execute', self._before_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_execute)
+            event.listen(Engine, 'handle_error', self._on_error)
+            self._listening = True
+        app.before_request(self._start_request)
+        app.after_request(self._add_headers)
+        # teardown corre al terminar la respuesta, también en CSV en streaming
+        app.teardown_request(self._finish_request)
+
+    # ---------- eventos de SQLAlchemy ----------
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_sql_metrics_started', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('_sql_metrics_started')
+        if not started:
+            return
+        elapsed_ms = (time.perf_counter() - started.pop()) * 1000
+        if not has_request_context():
+            return  # hilos de fondo (escritura diferida, sondeo de lectores)
+        state = g.get('_sql_metrics')
+        if state is None:
+            return
+
+        state['queries'] += 1
+        state['db_ms'] += elapsed_ms
+        if elapsed_ms > state['slowest_ms']:
+            state['slowest_ms'] = elapsed_ms
+            state['slowest_statement'] = statement
+
+        shape = statement_shape(statement)
+        repeats = state['shapes'].get(shape, 0) + 1
+        state['shapes'][shape] = repeats
+        if repeats == self.n_plus_one_threshold + 1:
+            print(f"[SQL] Posible N+1 en {request.endpoint}: la misma sentencia se repite "
+                  f"más de {self.n_plus_one_threshold} veces: {shape[:200]}")
+
+    def _on_error(self, exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get('_sql_metrics_started'):
+            conn.info['_sql_metrics_started'].pop()
+
+    # ---------- ciclo de la petición ----------
+
+    def _start_request(self):
+        g._sql_metrics = {
+            'queries': 0,
+            'db_ms': 0.0,
+            'slowest_ms': 0.0,
+            'slowest_statement': None,
+            'shapes': {},
+        }
+
+    def _add_headers(self, response):
+        state = g.get('_sql_metrics')
+        if self.headers and state is not None:
+            # En respuestas en streaming solo cuenta lo ejecutado antes del cuerpo
+            response.headers['X-DB-Queries'] = str(state['queries'])
+            response.headers['Server-Timing'] = (
+                f'db;dur={state["db_ms"]:.1f};desc="{state["queries"]} queries"'
+            )
+        return response
+
+    def _finish_request(self, exc=None):
+        state = g.pop('_sql_metrics', None)
+        if state is None:
+            return
+        endpoint = request.endpoint or 'sin_endpoint'
+        repeated = {
+            shape: n for shape, n in state['shapes'].items()
+            if n > self.n_plus_one_threshold
+        }
+
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = {
+                    'requests': 0,
+                    'queries': 0,
+                    'max_queries': 0,
+                    'db_ms': 0.0,
+                    'max_db_ms': 0.0,
+                    'slowest_ms': 0.0,
+                    'slowest_statement': None,
+                    'n_plus_one_requests': 0,
+                    'n_plus_one_statements': {},
+                }
+            stats['requests'] += 1
+            stats['queries'] += state['queries']
+            stats['max_queries'] = max(stats['max_queries'], state['queries'])
+            stats['db_ms'] += state['db_ms']
+            stats['max_db_ms'] = max(stats['max_db_ms'], state['db_ms'])
+            if state['slowest_ms'] > stats['slowest_ms']:
+                stats['slowest_ms'] = state['slowest_ms']
+                stats['slowest_statement'] = _SPACES.sub(' ', state['slowest_statement']).strip()
+            if repeated:
+                stats['n_plus_one_requests'] += 1
+                statements = stats['n_plus_one_statements']
+                for shape, n in repeated.items():
+                    statements[shape] = max(statements.get(shape, 0), n)
+
+    # ---------- consulta ----------
+
+    def stats(self):
+        with self._lock:
+            endpoints = {name: dict(data, n_plus_one_statements=dict(data['n_plus_one_statements']))
+                         for name, data in self._endpoints.items()}
+
+        result = []
+        for name, data in endpoints.items():
+            requests = data['requests']
+            repeated = sorted(data['n_plus_one_statements'].items(), key=lambda item: -item[1])
+            result.append({
+                'endpoint': name,
+                'requests': requests,
+                'avg_queries': round(data['queries'] / requests, 2) if requests else 0.0,
+                'max_queries': data['max_queries'],
+                'total_db_ms': round(data['db_ms'], 3),
+                'avg_db_ms': round(data['db_ms'] / requests, 3) if requests else 0.0,
+                'max_db_ms': round(data['max_db_ms'], 3),
+                'slowest_ms': round(data['slowest_ms'], 3),
+                'slowest_statement': data['slowest_statement'],
+                'n_plus_one_requests': data['n_plus_one_requests'],
+                'n_plus_one_statements': [
+                    {'statement': shape, 'max_repeats': n} for shape, n in repeated[:5]
+                ],
+            })
+        result.sort(key=lambda item: -item['total_db_ms'])
+        return {
+            'enabled': self.enabled,
+            'n_plus_one_threshold': self.n_plus_one_threshold,
+            'endpoints': result,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+
+sql_metrics = SqlMetrics()
@@ -0,0 +1,65 @@
+# app/services/template_bundle.py
+import struct
+import threading
+import zlib
+
+from app.services import fingerprint_sync
+
+
+# Formato del bundle (little-endian, como el ESP32):
+#   cabecera: b'HBND' | formato u8 | reservado u8 | cantidad u32 | versión u32
+#   registro: huella_id u32 | user_id u32 | largo u32 | template (largo bytes)
+MAGIC = b'HBND'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sBBII')
+RECORD = struct.Struct('<III')
+
+COMPRESSIONS = ('none', 'deflate')
+
+
+def build_bundle(rows, version):
+    """Serializa las filas de fingerprint_sync.template_rows() al formato binario"""
+    out = bytearray(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(rows), version))
+    for row in rows:
+        template = bytes(row.template)
+        out += RECORD.pack(row.id, row.user_id, len(template))
+        out += template
+    return bytes(out)
+
+
+class TemplateBundleCache:
+    """
+    Bundle binario de templates por versión del conjunto de huellas
+    (fingerprint_change). Se arma una vez por versión y compresión; una
+    versión nueva reemplaza a las anteriores.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._bundles = {}
+        self._count = 0
+
+    def get(self, compression='none'):
+        """Devuelve (payload, versión, cantidad de registros)"""
+        version = fingerprint_sync.current_version()
+        # Se arma bajo el lock: con muchos lectores a la vez solo uno lo construye
+        with self._lock:
+            if self._version != version:
+                rows = fingerprint_sync.template_rows()
+                self._bundles = {'none': build_bundle(rows, version)}
+                self._count = len(rows)
+                self._version = version
+
+            if compression not in self._bundles:
+                # zlib (deflate con cabecera): lo descomprime miniz/tinfl en el ESP32
+                self._bundles[compression] = zlib.compress(self._bundles['none'], 9)
+            return self._bundles[compression], version, self._count
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+            self._bundles = {}
+
+
+template_bundle = TemplateBundleCache()
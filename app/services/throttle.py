@@ -0,0 +1,151 @@
+# app/services/throttle.py
+import importlib
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import request, jsonify
+
+from app.services.device_registry import device_registry
+
+
+class MemoryBucketStore:
+    """
+    Token buckets en memoria del worker. Cualquier otro store (p. ej. uno
+    compartido entre workers) solo necesita implementar take(checks, now).
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> [tokens, last_refill]
+
+    def take(self, checks, now):
+        """
+        `checks` es [(key, rate, burst)]. Descuenta un token de cada bucket
+        solo si todos tienen uno; si no, devuelve (False, segundos de espera,
+        key que rechazó). Si todos aceptan devuelve (True, 0, None).
+        """
+        with self._lock:
+            states = []
+            for key, rate, burst in checks:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    tokens = float(burst)
+                else:
+                    tokens = min(float(burst), bucket[0] + (now - bucket[1]) * rate)
+                if tokens < 1:
+                    return False, (1 - tokens) / rate, key
+                states.append((key, tokens))
+
+            for key, tokens in states:
+                self._buckets[key] = [tokens - 1, now]
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return True, 0, None
+
+    def _prune(self, now):
+        # Un bucket sin uso por más de un minuto ya se habría rellenado
+        limit = now - 60
+        for key in [k for k, b in self._buckets.items() if b[1] < limit]:
+            del self._buckets[key]
+
+
+class Throttler:
+    """
+    Limitación por token bucket de los endpoints públicos de sensores,
+    por device_id, IP de origen y credencial (rfid / huella_id). Se evalúa
+    antes de ejecutar la vista, así que una ráfaga rechazada no toca la BD.
+
+    La IP es request.remote_addr: detrás del proxy hay que configurar
+    PROXY_FIX_HOPS. Un lector registrado no usa el bucket por IP, porque
+    varios lectores detrás de un mismo NAT comparten la IP.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.limits = {
+            'device': (5.0, 20),
+            'ip': (20.0, 60),
+            'credential': (1.0, 5),
+        }
+        self.store = MemoryBucketStore()
+        self._stats_lock = threading.Lock()
+        self._rejected = {'device': 0, 'ip': 0, 'credential': 0}
+
+    def init_app(self, app):
+        self.enabled = app.config.get('THROTTLE_ENABLED', self.enabled)
+        for scope in self.limits:
+            prefix = f'THROTTLE_{scope.upper()}'
+            rate = float(app.config.get(f'{prefix}_RATE', self.limits[scope][0]))
+            burst = int(app.config.get(f'{prefix}_BURST', self.limits[scope][1]))
+            if rate <= 0 or burst < 1:
+                raise ValueError(f'{prefix}_RATE debe ser > 0 y {prefix}_BURST >= 1')
+            self.limits[scope] = (rate, burst)
+        self.store = self._load_store(app.config.get('THROTTLE_STORE', 'memory'))
+
+    def _load_store(self, spec):
+        """'memory' o 'paquete.modulo:Clase' (se instancia sin argumentos)"""
+        if not spec or spec == 'memory':
+            return MemoryBucketStore()
+        module_name, _, attr = spec.partition(':')
+        return getattr(importlib.import_module(module_name), attr)()
+
+    def checks_for(self, data, credential_fields):
+        checks = []
+        device_id = data.get('device_id') or request.headers.get('X-Device-Id')
+        if device_id:
+            checks.append((f'device:{device_id}',) + self.limits['device'])
+        # Un device_id inventado no sirve para saltarse el bucket por IP
+        if request.remote_addr and not device_registry.is_registered(device_id):
+            checks.append((f'ip:{request.remote_addr}',) + self.limits['ip'])
+        for field in credential_fields:
+            value = data.get(field)
+            if value not in (None, ''):
+                checks.append((f'credential:{field}:{value}',) + self.limits['credential'])
+        return checks
+
+    def limit(self, credential_fields=('rfid', 'huella_id')):
+        """Decorador para rutas públicas; responde 429 si algún bucket está vacío"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or request.method == 'OPTIONS':
+                    return view(*args, **kwargs)
+                data = request.get_json(silent=True)
+                if not isinstance(data, dict):
+                    data = {}
+                allowed, retry_after, key = self.store.take(
+                    self.checks_for(data, credential_fields), time.monotonic()
+                )
+                if allowed:
+                    return view(*args, **kwargs)
+
+                scope = key.split(':', 1)[0]
+                with self._stats_lock:
+                    self._rejected[scope] = self._rejected.get(scope, 0) + 1
+                response = jsonify({
+                    "success": False,
+                    "reason": "Demasiadas solicitudes, intente nuevamente en unos segundos",
+                    "limited_by": scope,
+                    "retry_after": round(retry_after, 2)
+                })
+                response.status_code = 429
+                response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                return response
+            return wrapper
+        return decorator
+
+    def stats(self):
+        with self._stats_lock:
+            rejected = dict(self._rejected)
+        return {
+            'enabled': self.enabled,
+            'store': type(self.store).__name__,
+            'limits': {scope: {'rate': rate, 'burst': burst} for scope, (rate, burst) in self.limits.items()},
+            'rejected': rejected,
+        }
+
+
+throttler = Throttler()
@@ -0,0 +1,42 @@
+# app/utils/csv_stream.py
+import csv
+from io import StringIO
+
+from flask import Response, stream_with_context
+
+
+def iter_csv(header, rows, row_builder, chunk_rows=500):
+    """
+    Genera el CSV por bloques: primero el encabezado (sale de inmediato) y
+    luego un bloque cada `chunk_rows` filas. `rows` debe ser un iterable
+    perezoso (p. ej. query.yield_per) para que la memoria se mantenga plana.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(header)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate(0)
+
+    pending = 0
+    for row in rows:
+        writer.writerow(row_builder(row))
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+
+    if pending:
+        yield buffer.getvalue()
+
+
+def csv_response(filename, header, rows, row_builder, chunk_rows=500):
+    """Response de Flask que envía el CSV en streaming"""
+    return Response(
+        stream_with_context(iter_csv(header, rows, row_builder, chunk_rows)),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment;filename={filename}"}
+    )
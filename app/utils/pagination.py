@@ -0,0 +1,79 @@
+# app/utils/pagination.py
+import base64
+import json
+from datetime import date, datetime
+
+from sqlalchemy import tuple_
+
+from app import db
+
+
+def encode_cursor(*values):
+    """Cursor opaco (base64 urlsafe) con los valores de la clave de orden"""
+    payload = [v.isoformat() if isinstance(v, date) else v for v in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, types):
+    """
+    Decodifica un cursor generado por encode_cursor. `types` indica el tipo de
+    cada valor (datetime, date o int). Lanza ValueError si el cursor no es válido.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(raw)
+    except Exception:
+        raise ValueError('Cursor inválido')
+    if not isinstance(payload, list) or len(payload) != len(types):
+        raise ValueError('Cursor inválido')
+    values = []
+    for value, kind in zip(payload, types):
+        try:
+            if kind in (datetime, date):
+                values.append(kind.fromisoformat(value))
+            else:
+                values.append(kind(value))
+        except (TypeError, ValueError):
+            raise ValueError('Cursor inválido')
+    return tuple(values)
+
+
+def keyset_page(query, columns, cursor_values, per_page, key, descending=True):
+    """
+    Página por keyset: filtra por (columnas) < / > cursor y ordena por las
+    mismas columnas, así cada página es un rango del índice sin OFFSET.
+    `key(row)` devuelve los valores de la clave de una fila del resultado.
+    Devuelve (filas, siguiente_cursor o None).
+    """
+    if cursor_values is not None:
+        cols = tuple_(*columns) if len(columns) > 1 else columns[0]
+        vals = tuple_(*cursor_values) if len(columns) > 1 else cursor_values[0]
+        query = query.filter(cols < vals if descending else cols > vals)
+
+    order = [c.desc() if descending else c.asc() for c in columns]
+    rows = query.order_by(*order).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(*key(rows[-1]))
+    return rows, next_cursor
+
+
+def approximate_count(query):
+    """
+    Total aproximado para acompañar una página por cursor. En PostgreSQL usa
+    la estimación del planificador (EXPLAIN), sin recorrer la tabla; en otros
+    motores hace el COUNT exacto.
+    """
+    query = query.order_by(None)
+    if db.engine.dialect.name != 'postgresql':
+        return query.count()
+
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    result = db.session.connection().exec_driver_sql(
+        'EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params
+    ).scalar()
+    plan = result if isinstance(result, list) else json.loads(result)
+    return int(plan[0]['Plan']['Plan Rows'])
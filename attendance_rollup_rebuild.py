@@ -0,0 +1,34 @@
+# attendance_rollup_rebuild.py
+"""
+Recalcula attendance_daily desde Attendance para corregir un rango (el
+llenado inicial lo hace la migración c2f7a4e9d1b5).
+
+Uso:
+    python attendance_rollup_rebuild.py
+    python attendance_rollup_rebuild.py --start 2026-01-01 --end 2026-01-31
+"""
+import argparse
+import os
+from datetime import datetime
+
+# Recorre tablas enteras: sin el statement_timeout de las peticiones
+os.environ['DB_STATEMENT_TIMEOUT_MS'] = '0'
+
+from app import create_app  # noqa: E402
+from app.services import attendance_rollup  # noqa: E402
+
+
+def _date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+app = create_app()
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--start', type=_date, default=None)
+parser.add_argument('--end', type=_date, default=None)
+args = parser.parse_args()
+
+with app.app_context():
+    written = attendance_rollup.rebuild(args.start, args.end)
+    print(f"Días recalculados: {written}")
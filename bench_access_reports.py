@@ -0,0 +1,126 @@
+# bench_access_reports.py
+"""
+Benchmark de /access/admin/reports sobre una tabla access_log sembrada.
+
+Uso:
+    BENCH_DATABASE_URL=postgresql+psycopg2://... python bench_access_reports.py --rows 1000000
+    python bench_access_reports.py --rows 1000000          # SQLite en archivo temporal
+
+Muestra, para varias páginas y filtros, cuántas sentencias SQL ejecuta la
+petición y cuánto tarda. Usa una base de datos propia, nunca DATABASE_URL:
+BENCH_DATABASE_URL se vacía (drop_all) antes de sembrar.
+"""
+import argparse
+import os
+import random
+import re
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--rows', type=int, default=1_000_000)
+parser.add_argument('--users', type=int, default=500)
+parser.add_argument('--repeat', type=int, default=5)
+args = parser.parse_args()
+
+bench_url = os.environ.get('BENCH_DATABASE_URL')
+if not bench_url:
+    bench_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+os.environ['DATABASE_URL'] = bench_url
+
+from config import Config  # noqa: E402
+if not bench_url.startswith('postgresql'):
+    Config.SQLALCHEMY_ENGINE_OPTIONS = {}
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+from app.models import AccessLog, Role, User_iot  # noqa: E402
+
+app = create_app()
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+    admin_role = Role(name='admin')
+    db.session.add(admin_role)
+    db.session.flush()
+    admin = User_iot(username='bench_admin', nombre='Bench', apellido='Admin', role=admin_role)
+    admin.set_password('bench')
+    db.session.add(admin)
+    users = [
+        {'username': f'user{i}', 'password_hash': '-', 'nombre': f'N{i}', 'apellido': f'A{i}',
+         'role_id': admin_role.id, 'is_active': True}
+        for i in range(args.users)
+    ]
+    db.session.execute(User_iot.__table__.insert(), users)
+    db.session.commit()
+
+    rnd = random.Random(42)
+    start = datetime(2024, 1, 1)
+    span = 365 * 24 * 3600
+    chunk = 20_000
+    for offset in range(0, args.rows, chunk):
+        batch = []
+        for _ in range(min(chunk, args.rows - offset)):
+            sensor = rnd.choice(('Huella', 'RFID', 'ZonaSegura'))
+            batch.append({
+                'user_id': rnd.randint(2, args.users + 1),
+                'timestamp': start + timedelta(seconds=rnd.randrange(span)),
+                'sensor_type': sensor,
+                'status': 'Permitido' if rnd.random() < 0.9 else 'Denegado',
+                'huella_id': rnd.randint(1, 500) if sensor == 'Huella' else None,
+                'rfid': f'RF{rnd.randint(1, 500)}' if sensor == 'RFID' else None,
+                'action_type': rnd.choice(('ENTRADA_ACCESO', 'SALIDA_ACCESO')),
+            })
+        db.session.execute(AccessLog.__table__.insert(), batch)
+        db.session.commit()
+    return admin.id
+
+
+# Sentencias que cuentan como del reporte (las que leen access_log)
+REPORT_TABLE = re.compile(r'\baccess_log\b')
+
+
+def main():
+    with app.app_context():
+        print(f"Sembrando {args.rows} filas en {db.engine.url.render_as_string(hide_password=True)} ...")
+        t0 = time.perf_counter()
+        admin_id = seed()
+        print(f"Sembrado en {time.perf_counter() - t0:.1f}s")
+        token = create_access_token(identity=str(admin_id), additional_claims={'role': 'admin'})
+
+        statements = []
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, stmt, *a: statements.append(stmt))
+
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+    cases = [
+        ('página 1', '/access/admin/reports?page=1&per_page=10'),
+        ('página 1000', '/access/admin/reports?page=1000&per_page=10'),
+        ('filtro sensor + estado', '/access/admin/reports?sensor_type=RFID&status=Permitido'),
+        ('rango de un mes', '/access/admin/reports?start_date=2024-03-01T00:00:00&end_date=2024-03-31T23:59:59'),
+    ]
+
+    print(f"{'caso':<26}{'sentencias':>12}{'mediana ms':>14}{'máx ms':>10}")
+    for name, url in cases:
+        timings = []
+        for _ in range(args.repeat):
+            statements.clear()
+            t0 = time.perf_counter()
+            resp = client.get(url, headers=headers)
+            timings.append((time.perf_counter() - t0) * 1000)
+            assert resp.status_code == 200, resp.get_data(as_text=True)
+        # Solo las sentencias del reporte: el usuario y rol del JWT (chequeo
+        # de admin) no tocan access_log
+        queries = sum(1 for stmt in statements if REPORT_TABLE.search(stmt))
+        print(f"{name:<26}{queries:>12}{statistics.median(timings):>14.1f}{max(timings):>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+# check_query_plans.py
+"""
+Verifica con EXPLAIN que las consultas calientes usan índice (ninguna cae
+en un scan secuencial de su tabla) sobre una base sembrada.
+
+Uso:
+    BENCH_DATABASE_URL=postgresql+psycopg2://... python check_query_plans.py
+    python check_query_plans.py --users 500 --days 90   # SQLite en archivo temporal
+
+Las consultas no se copian a mano: cada caso hace la petición real con el
+cliente de pruebas (o llama al servicio) y se explica cada SELECT que toca
+una tabla caliente, con sus parámetros. Lo que no pasa por una ruta se arma
+con el mismo helper que usa el servicio.
+
+Sale con código 1 si algún plan recorre la tabla completa, así que sirve
+como prueba de regresión en CI. Igual que bench_access_reports.py, usa su
+propia base (BENCH_DATABASE_URL se vacía con drop_all) y crea el esquema
+desde los modelos, que declaran los mismos índices que las migraciones.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--users', type=int, default=500)
+parser.add_argument('--days', type=int, default=90)
+parser.add_argument('--verbose', action='store_true')
+args = parser.parse_args()
+
+bench_url = os.environ.get('BENCH_DATABASE_URL')
+if not bench_url:
+    bench_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plans.db')}"
+os.environ['DATABASE_URL'] = bench_url
+os.environ.setdefault('ACCESS_LOG_MODE', 'sync')
+os.environ.setdefault('THROTTLE_ENABLED', 'False')
+
+from config import Config  # noqa: E402
+if not bench_url.startswith('postgresql'):
+    Config.SQLALCHEMY_ENGINE_OPTIONS = {}
+
+import pytz  # noqa: E402
+from flask_jwt_extended import create_access_token  # noqa: E402
+from sqlalchemy import event, select, text  # noqa: E402
+from sqlalchemy.ext.compiler import compiles  # noqa: E402
+from sqlalchemy.sql.expression import ClauseElement, Executable  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+from app.models import (  # noqa: E402
+    AccessLog, Attendance, FailedAttempt, FailedAttemptHit, Role, Schedule, User_iot, UserSchedule
+)
+from app.services import attendance_rollup  # noqa: E402
+from app.services.failed_attempts import failed_attempts, window_counts  # noqa: E402
+
+app = create_app()
+
+# Tablas que no deben recorrerse completas (en Postgres también sus particiones)
+HOT_TABLES = ('access_log', 'attendance', 'attendance_daily', 'failed_attempt',
+              'failed_attempt_hit', 'user_schedule')
+_HOT_SQL = re.compile(r'\b(?:%s)\b' % '|'.join(HOT_TABLES))
+LIMA_TZ = pytz.timezone('America/Lima')
+
+
+class explain(Executable, ClauseElement):
+    """EXPLAIN de una sentencia con sus parámetros ya procesados"""
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(explain)
+def _compile_explain(element, compiler, **kw):
+    return _explain_prefix(compiler.dialect) + compiler.process(element.statement, **kw)
+
+
+def _explain_prefix(dialect):
+    return 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN (FORMAT JSON) '
+
+
+def seed():
+    db.drop_all()
+    db.create_all()
+    rnd = random.Random(42)
+
+    role = Role(name='user')
+    admin_role = Role(name='admin')
+    db.session.add_all([role, admin_role])
+    schedule = Schedule(nombre='Oficina', hora_entrada=time(8), hora_salida=time(17),
+                        dias='Lun,Mar,Mie,Jue,Vie', tipo='fijo')
+    weekend = Schedule(nombre='Fin de semana', hora_entrada=time(9), hora_salida=time(13),
+                       dias='Sab,Dom', tipo='fijo')
+    db.session.add_all([schedule, weekend])
+    db.session.flush()
+    admin = User_iot(username='plans_admin', nombre='Plans', apellido='Admin', role_id=admin_role.id)
+    admin.set_password('plans')
+    db.session.add(admin)
+    db.session.execute(User_iot.__table__.insert(), [
+        {'username': f'user{i}', 'password_hash': '-', 'nombre': f'N{i}', 'apellido': f'A{i}',
+         'role_id': role.id, 'is_active': True, 'rfid': f'CARD{i}'}
+        for i in range(args.users)
+    ])
+    user_ids = list(db.session.execute(select(User_iot.id).where(User_iot.role_id == role.id)).scalars())
+
+    first_day = date.today() - timedelta(days=args.days)
+    assignments = []
+    for user_id in user_ids:
+        start = first_day
+        for _ in range(3):
+            end = start + timedelta(days=rnd.randint(20, 40))
+            assignments.append({'user_id': user_id, 'schedule_id': schedule.id,
+                                'start_date': start, 'end_date': end})
+            start = end + timedelta(days=1)
+        assignments.append({'user_id': user_id, 'schedule_id': schedule.id,
+                            'start_date': start, 'end_date': None})
+    db.session.execute(UserSchedule.__table__.insert(), assignments)
+
+    for offset in range(args.days):
+        work_date = first_day + timedelta(days=offset)
+        day = datetime.combine(work_date, time(8))
+        attendance, logs = [], []
+        for user_id in user_ids:
+            entry = day + timedelta(minutes=rnd.randint(-20, 40))
+            closed = offset < args.days - 1 or rnd.random() < 0.5
+            attendance.append({'user_id': user_id, 'work_date': work_date, 'entry_time': entry,
+                               'exit_time': entry + timedelta(hours=9) if closed else None,
+                               'estado_entrada': 'presente'})
+            # AccessLog guarda UTC (Lima + 5 h)
+            for action, ts in (('ENTRADA_ACCESO_Y_ASISTENCIA', entry), ('SALIDA_ACCESO', entry + timedelta(hours=4))):
+                sensor = rnd.choice(('Huella', 'RFID', 'ZonaSegura'))
+                logs.append({'user_id': user_id, 'timestamp': ts + timedelta(hours=5),
+                             'local_date': work_date, 'sensor_type': sensor,
+                             'status': 'Permitido' if rnd.random() < 0.9 else 'Denegado',
+                             'action_type': action})
+        db.session.execute(Attendance.__table__.insert(), attendance)
+        db.session.execute(AccessLog.__table__.insert(), logs)
+
+    db.session.execute(FailedAttempt.__table__.insert(), [
+        {'identifier': f'RF{i}', 'identifier_type': rnd.choice(('rfid', 'huella')),
+         'count': rnd.randint(1, 5), 'timestamp': datetime.utcnow(), 'reason': 'no registrado'}
+        for i in range(args.users * 20)
+    ])
+    now = datetime.utcnow()
+    db.session.execute(FailedAttemptHit.__table__.insert(), [
+        {'key': f"id:rfid:RF{rnd.randint(0, args.users * 20)}",
+         'hit_at': now - timedelta(seconds=rnd.randint(0, 600))}
+        for _ in range(args.users * 20)
+    ])
+    db.session.commit()
+    attendance_rollup.rebuild()
+    db.session.execute(text('ANALYZE'))
+    db.session.commit()
+    return admin.id, user_ids, weekend.id
+
+
+@contextmanager
+def captured():
+    """SELECT sobre tablas calientes ejecutados dentro del bloque, con sus parámetros"""
+    statements = []
+
+    def listener(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and _HOT_SQL.search(statement):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+
+def cases(client, headers, user_ids, weekend_id):
+    """
+    (nombre, función) para cada consulta caliente; la función hace la
+    petición real o llama al servicio. Los que no pasan por el motor (el
+    store de ventanas arma la sentencia con window_counts) devuelven la
+    sentencia a explicar.
+    """
+    user_id = user_ids[len(user_ids) // 2]
+    card = f'CARD{len(user_ids) // 2}'
+    today = date.today()
+    since = (today - timedelta(days=2)).isoformat()
+    until = today.isoformat()
+    reports = '/access/admin/reports'
+    yesterday_10 = LIMA_TZ.localize(datetime.combine(today - timedelta(days=1), time(10)))
+
+    def get(url):
+        return lambda: client.get(url, headers=headers)
+
+    def post(url, body):
+        return lambda: client.post(url, json=body, headers=headers)
+
+    # La primera página por cursor se pide aquí, fuera de la captura
+    first_page = client.get(f'{reports}?cursor=&per_page=10', headers=headers).get_json()
+    next_cursor = first_page['pagination']['next_cursor']
+
+    def failed_attempt_flush():
+        client.post('/access/rfid-access', json={'rfid': 'RF1', 'device_id': 'plans'})
+        failed_attempts.flush()
+
+    return [
+        ('reporte de accesos: usuario, página 2',
+         get(f'{reports}?user_id={user_id}&page=2&per_page=5')),
+        ('reporte de accesos: usuario y rango de fechas',
+         get(f'{reports}?user_id={user_id}&start_date={since}T00:00:00&end_date={until}T23:59:59')),
+        ('reporte de accesos: rango de fechas, página 3',
+         get(f'{reports}?start_date={since}T00:00:00&end_date={until}T23:59:59&page=3&per_page=10')),
+        ('reporte de accesos: usuario, sensor y estado',
+         get(f'{reports}?user_id={user_id}&sensor_type=RFID&status=Permitido')),
+        ('reporte de accesos: cursor, página siguiente',
+         get(f'{reports}?cursor={next_cursor}&per_page=10')),
+        ('historial por usuario y día (access_history)',
+         get(f'/access/history?user_id={user_id}&date={until}')),
+        ('reporte de asistencia por usuario (admin/report)',
+         get(f'/attendance/admin/report?user_id={user_id}&start_date={since}&end_date={until}')),
+        ('reporte diario por usuario (admin/daily-report)',
+         get(f'/attendance/admin/daily-report?user_id={user_id}&start_date={since}&end_date={until}')),
+        ('decisión y asistencia (auto-access)',
+         post('/access/auto-access', {'rfid': card})),
+        ('evento atrasado (batch-events)',
+         post('/access/batch-events', {'device_id': 'plans', 'events': [{
+             'event_id': 'plans-1', 'rfid': card,
+             'timestamp': yesterday_10.astimezone(pytz.utc).replace(tzinfo=None).isoformat()
+         }]})),
+        ('intentos fallidos: registro y flush', failed_attempt_flush),
+        ('ventana compartida de intentos fallidos (DatabaseWindowStore)',
+         lambda: window_counts(['id:rfid:RF1', 'device:plans'], datetime.utcnow() - timedelta(minutes=5))),
+        ('choque de horarios (assign_schedule)',
+         post('/schedules/assign', {'user_id': user_id, 'schedule_id': weekend_id,
+                                    'start_date': (today + timedelta(days=30)).isoformat()})),
+    ]
+
+
+_PARTITION = re.compile(r'^access_log_(?:\d{4}_\d{2}|default)$')
+
+
+def _table_of(relation):
+    if relation in HOT_TABLES:
+        return relation
+    if _PARTITION.match(relation):
+        return 'access_log'
+    return None
+
+
+def _pg_seq_scans(node, found):
+    if node.get('Node Type') == 'Seq Scan':
+        table = _table_of(node.get('Relation Name', ''))
+        if table:
+            found.append(f"Seq Scan on {node['Relation Name']}")
+    for child in node.get('Plans', []):
+        _pg_seq_scans(child, found)
+    return found
+
+
+_SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+
+
+def full_scans(statement, parameters=None):
+    """
+    Recorridos completos de tablas calientes en el plan; [] si todo busca
+    por índice. `statement` es una sentencia de SQLAlchemy o el SQL tal
+    como llegó al driver (con `parameters`).
+    """
+    if isinstance(statement, str):
+        connection = db.session.connection()
+        rows = connection.exec_driver_sql(_explain_prefix(db.engine.dialect) + statement, parameters).all()
+    else:
+        rows = db.session.execute(explain(statement)).all()
+    if db.engine.dialect.name == 'sqlite':
+        plan = [row[-1] for row in rows]
+        found = []
+        for detail in plan:
+            match = _SQLITE_SCAN.match(detail)
+            # SEARCH = búsqueda por índice; SCAN (aunque sea de un índice) recorre todo
+            if match and _table_of(match.group(1)):
+                found.append(detail)
+        return found, plan
+    plan = rows[0][0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return _pg_seq_scans(plan[0]['Plan'], []), plan
+
+
+def main():
+    with app.app_context():
+        print(f"Sembrando {args.users} usuarios x {args.days} días en "
+              f"{db.engine.url.render_as_string(hide_password=True)} ...")
+        admin_id, user_ids, weekend_id = seed()
+        token = create_access_token(identity=str(admin_id), additional_claims={'role': 'admin'})
+
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+    failures = 0
+    with app.app_context():
+        for name, run in cases(client, headers, user_ids, weekend_id):
+            with captured() as statements:
+                statement = run()
+            if isinstance(statement, ClauseElement):
+                statements = [(statement, None)]
+            if not statements:
+                print(f"{'FALLA':<7}{name}")
+                print("         no ejecutó ninguna consulta sobre tablas calientes")
+                failures += 1
+                continue
+
+            case_scans = []
+            for sql, parameters in statements:
+                scans, plan = full_scans(sql, parameters)
+                case_scans.extend(scans)
+                if args.verbose or scans:
+                    print(f"         {sql if isinstance(sql, str) else statement}")
+                    print(f"         {json.dumps(plan, ensure_ascii=False, default=str)}")
+            print(f"{'FALLA' if case_scans else 'ok':<7}{name} ({len(statements)} consultas)")
+            for scan in case_scans:
+                print(f"         {scan}")
+            failures += bool(case_scans)
+            db.session.rollback()
+
+    if failures:
+        print(f"{failures} caso(s) con consultas sin índice")
+        sys.exit(1)
+    print("Todas las consultas calientes usan índice")
+
+
+if __name__ == '__main__':
+    main()
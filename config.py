@@ -1,6 +1,51 @@
 import os
 from datetime import timedelta
 
+def _pool_options(database_url):
+    """
+    Opciones del engine a partir del entorno. Sin DB_POOL_SIZE explícito el
+    pool se dimensiona por worker: hilos de gunicorn + hilos de fondo
+    (escritura diferida, prober, intentos fallidos). Con DB_MAX_CONNECTIONS
+    (límite del plan de Postgres) se reparte entre WEB_CONCURRENCY workers.
+    """
+    options = {}
+    if not database_url.startswith("postgresql"):
+        # SQLite (desarrollo): sus pools no aceptan estas opciones
+        return options
+
+    workers = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+    threads = max(1, int(os.environ.get('GUNICORN_THREADS', 1)))
+    pool_size = int(os.environ.get('DB_POOL_SIZE', max(5, threads + 3)))
+    max_overflow = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+
+    max_connections = os.environ.get('DB_MAX_CONNECTIONS')
+    if max_connections:
+        per_worker = max(1, int(max_connections) // workers)
+        pool_size = min(pool_size, per_worker)
+        max_overflow = min(max_overflow, per_worker - pool_size)
+
+    # Corta consultas de peticiones colgadas; 0 (por defecto) sin límite. Las
+    # migraciones y los scripts de mantenimiento lo desactivan siempre
+    statement_timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+    pg_options = "-c timezone=America/Lima"
+    if statement_timeout:
+        pg_options += f" -c statement_timeout={statement_timeout}"
+
+    options.update({
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        # Segundos esperando una conexión libre antes de fallar (en vez de colgarse)
+        "pool_timeout": int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        # Postgres gestionado corta conexiones inactivas: reciclar antes
+        "pool_recycle": int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        "pool_pre_ping": os.environ.get('DB_POOL_PRE_PING', 'True') == 'True',
+        "connect_args": {
+            "options": pg_options
+        }
+    })
+    return options
+
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'jwt_secret'
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'jwt_secret_key'
@@ -17,14 +62,97 @@ class Config:
 
     SQLALCHEMY_DATABASE_URI = database_url
     
-    SQLALCHEMY_ENGINE_OPTIONS = {
-        "connect_args": {
-            "options": "-c timezone=America/Lima"
-        }
-    }
+    # Réplica de lectura opcional para reportes/exportaciones (@read_replica);
+    # sin REPLICA_DATABASE_URL todo va a la base principal
+    replica_url = os.environ.get('REPLICA_DATABASE_URL')
+    if replica_url and replica_url.startswith("postgres://"):
+        replica_url = replica_url.replace("postgres://", "postgresql://", 1)
+    SQLALCHEMY_BINDS = {'replica': {'url': replica_url, **_pool_options(replica_url)}} if replica_url else {}
+
+    # Pool de conexiones: DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+    # DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT_MS y el reparto
+    # por worker (WEB_CONCURRENCY, GUNICORN_THREADS, DB_MAX_CONNECTIONS)
+    SQLALCHEMY_ENGINE_OPTIONS = _pool_options(database_url)
+
+    # Esperas por una conexión del pool por encima de esto (ms) cuentan como lentas
+    DB_POOL_SLOW_CHECKOUT_MS = float(os.environ.get('DB_POOL_SLOW_CHECKOUT_MS', 100))
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Proxies de confianza delante de la app (Render: 1). Con 0 remote_addr es
+    # la IP del proxy y el throttle por IP la comparte entre todos los clientes
+    PROXY_FIX_HOPS = int(os.environ.get('PROXY_FIX_HOPS', 0))
+
     DEBUG = os.environ.get('DEBUG', 'False') == 'True'
     PROPAGATE_EXCEPTIONS = True
     JWT_ALGORITHM = 'HS256'  
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=1)
+
+    # Segundos que vive el índice de credenciales en memoria de cada worker
+    CREDENTIAL_CACHE_TTL = int(os.environ.get('CREDENTIAL_CACHE_TTL', 30))
+
+    # Líneas de tiempo de horarios por usuario (segundos); las rutas de horarios invalidan al instante
+    SCHEDULE_CACHE_TTL = int(os.environ.get('SCHEDULE_CACHE_TTL', 60))
+
+    # Intentos fallidos: ventana deslizante (s) para el buzzer, cada cuánto se
+    # persisten en FailedAttempt (s, 0 = en la misma petición) y tope de claves
+    FAILED_ATTEMPT_WINDOW = int(os.environ.get('FAILED_ATTEMPT_WINDOW', 300))
+    FAILED_ATTEMPT_FLUSH_INTERVAL = float(os.environ.get('FAILED_ATTEMPT_FLUSH_INTERVAL', 10))
+    FAILED_ATTEMPT_MAX_KEYS = int(os.environ.get('FAILED_ATTEMPT_MAX_KEYS', 50000))
+    # Dónde viven las ventanas: 'memory' (por worker; con N workers el buzzer
+    # necesita ~N veces más intentos), 'database' (compartidas a través del
+    # flush periódico, sin escrituras en la petición) o 'modulo:Clase'
+    FAILED_ATTEMPT_STORE = os.environ.get('FAILED_ATTEMPT_STORE', 'memory')
+
+    # Token buckets de los endpoints públicos de sensores (peticiones/s y ráfaga)
+    # por device_id, IP y credencial; THROTTLE_STORE = 'memory' o 'modulo:Clase'
+    THROTTLE_ENABLED = os.environ.get('THROTTLE_ENABLED', 'True') == 'True'
+    THROTTLE_STORE = os.environ.get('THROTTLE_STORE', 'memory')
+    THROTTLE_DEVICE_RATE = float(os.environ.get('THROTTLE_DEVICE_RATE', 5))
+    THROTTLE_DEVICE_BURST = int(os.environ.get('THROTTLE_DEVICE_BURST', 20))
+    THROTTLE_IP_RATE = float(os.environ.get('THROTTLE_IP_RATE', 20))
+    THROTTLE_IP_BURST = int(os.environ.get('THROTTLE_IP_BURST', 60))
+    THROTTLE_CREDENTIAL_RATE = float(os.environ.get('THROTTLE_CREDENTIAL_RATE', 1))
+    THROTTLE_CREDENTIAL_BURST = int(os.environ.get('THROTTLE_CREDENTIAL_BURST', 5))
+
+    # Comandos a los ESP32: hilos del dispatcher, timeouts (s), vida de los jobs (s)
+    # e hilos del pool propio de los broadcasts (tope de peticiones en vuelo)
+    ESP32_DISPATCH_WORKERS = int(os.environ.get('ESP32_DISPATCH_WORKERS', 8))
+    ESP32_COMMAND_TIMEOUT = float(os.environ.get('ESP32_COMMAND_TIMEOUT', 15))
+    ESP32_STATUS_TIMEOUT = float(os.environ.get('ESP32_STATUS_TIMEOUT', 8))
+    # Espera máxima de una petición síncrona (s); si el ESP32 tarda más se responde 202 con job_id
+    ESP32_SYNC_WAIT = float(os.environ.get('ESP32_SYNC_WAIT', 3))
+    ESP32_JOB_TTL = int(os.environ.get('ESP32_JOB_TTL', 300))
+    ESP32_BROADCAST_PARALLELISM = int(os.environ.get('ESP32_BROADCAST_PARALLELISM', 8))
+
+    # Registro de dispositivos: cada cuánto se sondean (s, 0 desactiva), hilos
+    # del sondeo (un solo worker sondea) y antigüedad máxima del estado en
+    # caché para responder sin ir a la red
+    DEVICE_PROBE_INTERVAL = int(os.environ.get('DEVICE_PROBE_INTERVAL', 30))
+    DEVICE_PROBE_WORKERS = int(os.environ.get('DEVICE_PROBE_WORKERS', 4))
+    DEVICE_STATUS_MAX_AGE = int(os.environ.get('DEVICE_STATUS_MAX_AGE', 90))
+
+    # Instrumentación SQL por petición: aviso de N+1 cuando una misma sentencia
+    # se repite más de SQL_NPLUSONE_THRESHOLD veces; cabeceras Server-Timing opcionales
+    SQL_METRICS_ENABLED = os.environ.get('SQL_METRICS_ENABLED', 'True') == 'True'
+    SQL_NPLUSONE_THRESHOLD = int(os.environ.get('SQL_NPLUSONE_THRESHOLD', 10))
+    SQL_METRICS_HEADERS = os.environ.get('SQL_METRICS_HEADERS', 'False') == 'True'
+
+    # Subida en lote de eventos guardados offline por los lectores: máximo de
+    # eventos por petición y adelanto tolerado del reloj del lector (s)
+    BATCH_EVENTS_MAX = int(os.environ.get('BATCH_EVENTS_MAX', 500))
+    BATCH_EVENTS_MAX_SKEW = int(os.environ.get('BATCH_EVENTS_MAX_SKEW', 300))
+
+    # Escritura de AccessLog: 'sync' (commit por acceso) o 'batched' (cola + lotes)
+    ACCESS_LOG_MODE = os.environ.get('ACCESS_LOG_MODE', 'sync')
+    ACCESS_LOG_DURABILITY = os.environ.get('ACCESS_LOG_DURABILITY', 'safe')  # 'safe' o 'fast'
+    ACCESS_LOG_QUEUE_SIZE = int(os.environ.get('ACCESS_LOG_QUEUE_SIZE', 5000))
+    ACCESS_LOG_BATCH_SIZE = int(os.environ.get('ACCESS_LOG_BATCH_SIZE', 200))
+    ACCESS_LOG_FLUSH_INTERVAL = float(os.environ.get('ACCESS_LOG_FLUSH_INTERVAL', 0.5))
+
+    # Particiones mensuales de access_log (Postgres) y retención: los meses más
+    # antiguos que ACCESS_LOG_RETENTION_MONTHS se archivan en CSV comprimido
+    # (ver access_log_maintenance.py)
+    ACCESS_LOG_PARTITIONS_AHEAD = int(os.environ.get('ACCESS_LOG_PARTITIONS_AHEAD', 3))
+    ACCESS_LOG_RETENTION_MONTHS = int(os.environ.get('ACCESS_LOG_RETENTION_MONTHS', 24))
+    ACCESS_LOG_ARCHIVE_DIR = os.environ.get('ACCESS_LOG_ARCHIVE_DIR', 'archive/access_log')
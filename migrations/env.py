@@ -104,6 +104,9 @@ def run_migrations_online():
         )
 
         with context.begin_transaction():
+            # Copias y backfills de tablas grandes: sin DB_STATEMENT_TIMEOUT_MS
+            if connection.dialect.name == 'postgresql':
+                connection.exec_driver_sql('SET LOCAL statement_timeout = 0')
             context.run_migrations()
 
 
@@ -0,0 +1,29 @@
+"""Add fingerprint_change
+
+Revision ID: 4e2b7d91c0a3
+Revises: c6a09c98a4e1
+Create Date: 2026-10-17 10:41:07.215390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e2b7d91c0a3'
+down_revision = 'c6a09c98a4e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('fingerprint_change',
+    sa.Column('version', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('huella_id', sa.Integer(), nullable=False),
+    sa.Column('changed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('version')
+    )
+
+
+def downgrade():
+    op.drop_table('fingerprint_change')
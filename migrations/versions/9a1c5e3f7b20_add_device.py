@@ -0,0 +1,36 @@
+"""Add device
+
+Revision ID: 9a1c5e3f7b20
+Revises: 4e2b7d91c0a3
+Create Date: 2026-10-17 12:05:33.481207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a1c5e3f7b20'
+down_revision = '4e2b7d91c0a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('device',
+    sa.Column('id', sa.String(length=80), nullable=False),
+    sa.Column('base_url', sa.String(length=255), nullable=False),
+    sa.Column('nombre', sa.String(length=80), nullable=True),
+    sa.Column('firmware', sa.String(length=40), nullable=True),
+    sa.Column('health', sa.String(length=20), nullable=True),
+    sa.Column('last_seen', sa.DateTime(), nullable=True),
+    sa.Column('last_checked', sa.DateTime(), nullable=True),
+    sa.Column('last_latency_ms', sa.Float(), nullable=True),
+    sa.Column('last_error', sa.String(length=255), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('device')
@@ -0,0 +1,82 @@
+"""Add access_log.local_date and attendance.work_date
+
+Revision ID: a7d3e9c1f5b8
+Revises: f1c3a9e7b2d4
+Create Date: 2026-10-17 15:58:44.081937
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3e9c1f5b8'
+down_revision = 'f1c3a9e7b2d4'
+branch_labels = None
+depends_on = None
+
+
+# Filas por UPDATE al rellenar access_log (evita una transacción enorme)
+BACKFILL_BATCH = 50000
+
+OPEN_ATTENDANCE = sa.text("exit_time IS NULL")
+
+
+def _backfill_access_log(bind):
+    if bind.dialect.name == 'postgresql':
+        local_date = """("timestamp" AT TIME ZONE 'UTC' AT TIME ZONE 'America/Lima')::date"""
+    else:
+        # Lima es UTC-5 fijo (sin horario de verano desde 1994)
+        local_date = "date(\"timestamp\", '-5 hours')"
+    bounds = bind.execute(sa.text("SELECT min(id), max(id) FROM access_log")).first()
+    if bounds[0] is None:
+        return
+    for start in range(bounds[0], bounds[1] + 1, BACKFILL_BATCH):
+        bind.execute(
+            sa.text(f"UPDATE access_log SET local_date = {local_date} "
+                    "WHERE id >= :start AND id < :end AND local_date IS NULL"),
+            {'start': start, 'end': start + BACKFILL_BATCH}
+        )
+
+
+def _backfill_attendance(bind):
+    # Las entradas de auto-access guardan el timestamp UTC de su AccessLog: se
+    # toma el día de ese acceso; el resto guarda la hora local de Lima
+    entry_date = "CAST(entry_time AS DATE)" if bind.dialect.name == 'postgresql' else "date(entry_time)"
+    bind.execute(sa.text(f"""
+        UPDATE attendance SET work_date = COALESCE(
+            (SELECT a.local_date FROM access_log a
+             WHERE a.user_id = attendance.user_id AND a."timestamp" = attendance.entry_time
+             LIMIT 1),
+            {entry_date}
+        )
+        WHERE work_date IS NULL
+    """))
+
+
+def upgrade():
+    op.add_column('access_log', sa.Column('local_date', sa.Date(), nullable=True))
+    op.add_column('attendance', sa.Column('work_date', sa.Date(), nullable=True))
+
+    bind = op.get_bind()
+    _backfill_access_log(bind)
+    _backfill_attendance(bind)
+
+    op.create_index('ix_access_log_user_local_date', 'access_log', ['user_id', 'local_date'], unique=False)
+    op.create_index('ix_attendance_user_work_date', 'attendance', ['user_id', 'work_date'], unique=False)
+    # La asistencia abierta de hoy ahora se busca por work_date
+    op.drop_index('ix_attendance_open', table_name='attendance')
+    op.create_index('ix_attendance_open', 'attendance', ['user_id', 'work_date'], unique=False,
+                    postgresql_where=OPEN_ATTENDANCE, sqlite_where=OPEN_ATTENDANCE)
+
+
+def downgrade():
+    op.drop_index('ix_attendance_open', table_name='attendance')
+    op.create_index('ix_attendance_open', 'attendance', ['user_id', 'entry_time'], unique=False,
+                    postgresql_where=OPEN_ATTENDANCE, sqlite_where=OPEN_ATTENDANCE)
+    op.drop_index('ix_attendance_user_work_date', table_name='attendance')
+    op.drop_index('ix_access_log_user_local_date', table_name='access_log')
+    with op.batch_alter_table('attendance', schema=None) as batch_op:
+        batch_op.drop_column('work_date')
+    with op.batch_alter_table('access_log', schema=None) as batch_op:
+        batch_op.drop_column('local_date')
@@ -0,0 +1,98 @@
+"""Partition access_log by month
+
+Revision ID: b3f8d2a1c7e5
+Revises: 9a1c5e3f7b20
+Create Date: 2026-10-17 13:20:48.930114
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f8d2a1c7e5'
+down_revision = '9a1c5e3f7b20'
+branch_labels = None
+depends_on = None
+
+
+# Particiones creadas por adelantado (luego las mantiene access_log_maintenance.py)
+MONTHS_AHEAD = 3
+
+
+def _add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _create_indexes():
+    op.create_index(op.f('ix_access_log_device_id'), 'access_log', ['device_id'], unique=False)
+    op.create_index(op.f('ix_access_log_timestamp'), 'access_log', ['timestamp'], unique=False)
+    op.create_index(op.f('ix_access_log_user_id'), 'access_log', ['user_id'], unique=False)
+    op.create_index('ix_access_user_date', 'access_log', ['user_id', 'timestamp'], unique=False)
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        # SQLite: tabla única; la retención borra por rango (ver access_log_partitions)
+        return
+
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('access_log', 'id')")).scalar()
+
+    op.execute("ALTER TABLE access_log RENAME TO access_log_legacy")
+    op.execute("""
+        CREATE TABLE access_log (LIKE access_log_legacy INCLUDING DEFAULTS)
+        PARTITION BY RANGE ("timestamp")
+    """)
+    # La clave de partición no puede ser NULL
+    op.execute("""
+        UPDATE access_log_legacy SET "timestamp" = (now() AT TIME ZONE 'UTC')
+        WHERE "timestamp" IS NULL
+    """)
+    op.execute('ALTER TABLE access_log ALTER COLUMN "timestamp" SET NOT NULL')
+
+    # Una partición por mes con datos (y los próximos meses) + DEFAULT para el resto
+    oldest = bind.execute(sa.text('SELECT min("timestamp") FROM access_log_legacy')).scalar()
+    current = date.today().replace(day=1)
+    month = oldest.date().replace(day=1) if oldest else current
+    last = _add_months(current, MONTHS_AHEAD)
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE access_log_{month:%Y_%m} PARTITION OF access_log "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+        )
+        month = _add_months(month, 1)
+    op.execute("CREATE TABLE access_log_default PARTITION OF access_log DEFAULT")
+
+    op.execute("INSERT INTO access_log SELECT * FROM access_log_legacy")
+    if sequence:
+        op.execute(f"ALTER SEQUENCE {sequence} OWNED BY access_log.id")
+    op.execute("DROP TABLE access_log_legacy")
+
+    # En una tabla particionada la PK debe incluir la clave de partición
+    op.execute('ALTER TABLE access_log ADD CONSTRAINT access_log_pkey PRIMARY KEY (id, "timestamp")')
+    op.create_foreign_key('access_log_user_id_fkey', 'access_log', 'user_iot', ['user_id'], ['id'])
+    _create_indexes()
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    sequence = bind.execute(sa.text("SELECT pg_get_serial_sequence('access_log', 'id')")).scalar()
+
+    op.execute("ALTER TABLE access_log RENAME TO access_log_partitioned")
+    op.execute("CREATE TABLE access_log (LIKE access_log_partitioned INCLUDING DEFAULTS)")
+    op.execute("INSERT INTO access_log SELECT * FROM access_log_partitioned")
+    if sequence:
+        op.execute(f"ALTER SEQUENCE {sequence} OWNED BY access_log.id")
+    op.execute("DROP TABLE access_log_partitioned CASCADE")
+
+    op.execute('ALTER TABLE access_log ALTER COLUMN "timestamp" DROP NOT NULL')
+    op.execute("ALTER TABLE access_log ADD CONSTRAINT access_log_pkey PRIMARY KEY (id)")
+    op.create_foreign_key('access_log_user_id_fkey', 'access_log', 'user_iot', ['user_id'], ['id'])
+    _create_indexes()
@@ -0,0 +1,31 @@
+"""Add failed_attempt_hit
+
+Revision ID: b6e2d9f4a8c3
+Revises: d4b8f2a6c3e1
+Create Date: 2026-10-17 17:48:05.214377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e2d9f4a8c3'
+down_revision = 'd4b8f2a6c3e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('failed_attempt_hit',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('key', sa.String(length=200), nullable=False),
+    sa.Column('hit_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_failed_attempt_hit_key', 'failed_attempt_hit', ['key', 'hit_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_failed_attempt_hit_key', table_name='failed_attempt_hit')
+    op.drop_table('failed_attempt_hit')
@@ -0,0 +1,143 @@
+"""Backfill attendance_daily from attendance
+
+Revision ID: c2f7a4e9d1b5
+Revises: b6e2d9f4a8c3
+Create Date: 2026-10-17 19:05:41.372916
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2f7a4e9d1b5'
+down_revision = 'b6e2d9f4a8c3'
+branch_labels = None
+depends_on = None
+
+
+# Va después de d4b8f2a6c3e1 para leer las horas ya en hora local de Lima.
+# Repite la lógica de attendance_rollup.rebuild() sin importar la app (los
+# modelos cambian con las migraciones siguientes).
+
+attendance = sa.table(
+    'attendance',
+    sa.column('user_id', sa.Integer),
+    sa.column('work_date', sa.Date),
+    sa.column('entry_time', sa.DateTime),
+    sa.column('exit_time', sa.DateTime),
+    sa.column('estado_entrada', sa.String),
+)
+user_schedule = sa.table(
+    'user_schedule',
+    sa.column('user_id', sa.Integer),
+    sa.column('schedule_id', sa.Integer),
+    sa.column('start_date', sa.Date),
+    sa.column('end_date', sa.Date),
+)
+schedule = sa.table(
+    'schedule',
+    sa.column('id', sa.Integer),
+    sa.column('hora_entrada', sa.Time),
+)
+attendance_daily = sa.table(
+    'attendance_daily',
+    sa.column('user_id', sa.Integer),
+    sa.column('work_date', sa.Date),
+    sa.column('first_entry', sa.DateTime),
+    sa.column('last_exit', sa.DateTime),
+    sa.column('estado_entrada', sa.String),
+    sa.column('minutes_late', sa.Integer),
+    sa.column('worked_minutes', sa.Integer),
+    sa.column('punches', sa.Integer),
+    sa.column('late', sa.Boolean),
+    sa.column('open_entry', sa.Boolean),
+    sa.column('updated_at', sa.DateTime),
+)
+
+BATCH = 5000
+
+
+def _assignments(bind):
+    """{user_id: [(start_date, end_date, hora_entrada)]}, la más reciente primero"""
+    rows = bind.execute(
+        sa.select(user_schedule.c.user_id, user_schedule.c.start_date,
+                  user_schedule.c.end_date, schedule.c.hora_entrada)
+        .select_from(user_schedule.join(schedule, schedule.c.id == user_schedule.c.schedule_id))
+        .order_by(user_schedule.c.start_date.desc())
+    )
+    result = {}
+    for user_id, start, end, hora_entrada in rows:
+        result.setdefault(user_id, []).append((start, end, hora_entrada))
+    return result
+
+
+def _minutes_late(assignments, user_id, work_date, entry):
+    # Mismo cálculo que attendance_engine.classify: minutos enteros desde la
+    # hora de entrada del horario vigente ese día
+    for start, end, hora_entrada in assignments.get(user_id, ()):
+        if start <= work_date and (end is None or end >= work_date):
+            seconds = entry.hour * 3600 + entry.minute * 60 + entry.second
+            limit = hora_entrada.hour * 3600 + hora_entrada.minute * 60 + hora_entrada.second
+            return max(0, int((seconds - limit) / 60))
+    return 0
+
+
+def upgrade():
+    bind = op.get_bind()
+    assignments = _assignments(bind)
+    now = datetime.utcnow()
+
+    # Se recalcula todo: las filas escritas antes de d4b8f2a6c3e1 pueden
+    # tener horas UTC
+    bind.execute(attendance_daily.delete())
+
+    rows = bind.execute(
+        sa.select(attendance.c.user_id, attendance.c.work_date, attendance.c.entry_time,
+                  attendance.c.exit_time, attendance.c.estado_entrada)
+        .where(attendance.c.entry_time.isnot(None))
+        .order_by(attendance.c.user_id, attendance.c.work_date, attendance.c.entry_time)
+        .execution_options(yield_per=BATCH)
+    )
+    batch, day = [], None
+    for user_id, work_date, entry, exit_time, estado in rows:
+        key = (user_id, work_date or entry.date())
+        if day is None or (day['user_id'], day['work_date']) != key:
+            if day is not None:
+                batch.append(day)
+                if len(batch) >= BATCH:
+                    bind.execute(attendance_daily.insert(), batch)
+                    batch = []
+            late = estado == 'tarde'
+            day = {
+                'user_id': user_id,
+                'work_date': key[1],
+                'first_entry': entry,
+                'last_exit': None,
+                'estado_entrada': estado,
+                'minutes_late': _minutes_late(assignments, user_id, key[1], entry) if late else 0,
+                'worked_minutes': 0,
+                'punches': 0,
+                'late': late,
+                'open_entry': False,
+                'updated_at': now,
+            }
+        day['punches'] += 1
+        if exit_time is None:
+            day['open_entry'] = True
+            continue
+        day['open_entry'] = False
+        if day['last_exit'] is None or exit_time > day['last_exit']:
+            day['last_exit'] = exit_time
+        day['worked_minutes'] += max(0, int((exit_time - entry).total_seconds() // 60))
+    if day is not None:
+        batch.append(day)
+    if batch:
+        bind.execute(attendance_daily.insert(), batch)
+
+
+def downgrade():
+    # El resumen se deriva de attendance; e5b2c8d4f9a1 borra la tabla
+    pass
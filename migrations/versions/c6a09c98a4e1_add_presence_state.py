@@ -0,0 +1,76 @@
+"""Add presence_state
+
+Revision ID: c6a09c98a4e1
+Revises: 1b7bf6fcc731
+Create Date: 2026-10-17 09:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6a09c98a4e1'
+down_revision = '1b7bf6fcc731'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('presence_state',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('last_action', sa.String(length=10), nullable=True),
+    sa.Column('last_action_type', sa.String(length=255), nullable=True),
+    sa.Column('last_sensor', sa.String(length=20), nullable=True),
+    sa.Column('last_timestamp', sa.DateTime(), nullable=True),
+    sa.Column('open_attendance_id', sa.Integer(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user_iot.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['open_attendance_id'], ['attendance.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+    # Estado inicial: último acceso permitido por Huella/RFID de cada usuario
+    op.execute("""
+        INSERT INTO presence_state (user_id, last_action, last_action_type, last_sensor, last_timestamp, updated_at)
+        SELECT a.user_id,
+               CASE WHEN a.action_type LIKE '%ENTRADA%' THEN 'ENTRADA' ELSE 'SALIDA' END,
+               a.action_type,
+               a.sensor_type,
+               a.timestamp,
+               CURRENT_TIMESTAMP
+        FROM access_log a
+        WHERE a.id = (
+            SELECT a2.id FROM access_log a2
+            WHERE a2.user_id = a.user_id
+              AND a2.status = 'Permitido'
+              AND a2.sensor_type IN ('Huella', 'RFID')
+              AND (a2.action_type LIKE '%ENTRADA%' OR a2.action_type LIKE '%SALIDA%')
+            ORDER BY a2.timestamp DESC, a2.id DESC
+            LIMIT 1
+        )
+    """)
+
+    # Asistencia abierta más reciente
+    op.execute("""
+        UPDATE presence_state
+        SET open_attendance_id = (
+            SELECT at.id FROM attendance at
+            WHERE at.user_id = presence_state.user_id
+              AND at.exit_time IS NULL
+            ORDER BY at.entry_time DESC
+            LIMIT 1
+        )
+    """)
+    op.execute("""
+        INSERT INTO presence_state (user_id, open_attendance_id, updated_at)
+        SELECT at.user_id, MAX(at.id), CURRENT_TIMESTAMP
+        FROM attendance at
+        WHERE at.exit_time IS NULL
+          AND at.user_id NOT IN (SELECT user_id FROM presence_state)
+        GROUP BY at.user_id
+    """)
+
+
+def downgrade():
+    op.drop_table('presence_state')
@@ -0,0 +1,33 @@
+"""Add device_event
+
+Revision ID: c9e4a7f2d1b6
+Revises: b3f8d2a1c7e5
+Create Date: 2026-10-17 14:02:11.573820
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9e4a7f2d1b6'
+down_revision = 'b3f8d2a1c7e5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('device_event',
+    sa.Column('device_id', sa.String(length=80), nullable=False),
+    sa.Column('event_id', sa.String(length=64), nullable=False),
+    sa.Column('event_time', sa.DateTime(), nullable=False),
+    sa.Column('access_log_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('reason', sa.String(length=255), nullable=True),
+    sa.Column('received_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('device_id', 'event_id')
+    )
+
+
+def downgrade():
+    op.drop_table('device_event')
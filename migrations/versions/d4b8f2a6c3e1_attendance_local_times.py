@@ -0,0 +1,55 @@
+"""Store attendance entry/exit times in Lima local time
+
+Revision ID: d4b8f2a6c3e1
+Revises: a7d3e9c1f5b8
+Create Date: 2026-10-17 17:12:30.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4b8f2a6c3e1'
+down_revision = 'a7d3e9c1f5b8'
+branch_labels = None
+depends_on = None
+
+
+# auto-access y batch-events guardaban el timestamp UTC de su AccessLog; el
+# resto de la asistencia guarda la hora local de Lima sin zona. Una hora se
+# reconoce como UTC porque coincide con un acceso del mismo usuario.
+# attendance_daily se recalcula después, en c2f7a4e9d1b5.
+
+
+def _shift(bind, column, hours):
+    if bind.dialect.name == 'postgresql':
+        zones = ("'UTC'", "'America/Lima'") if hours < 0 else ("'America/Lima'", "'UTC'")
+        return f"{column} AT TIME ZONE {zones[0]} AT TIME ZONE {zones[1]}"
+    # Lima es UTC-5 fijo (sin horario de verano desde 1994); se conservan
+    # los microsegundos con el mismo formato que escribe SQLAlchemy
+    return f"strftime('%Y-%m-%d %H:%M:%S', {column}, '{hours:+d} hours') || substr({column}, 20)"
+
+
+def _convert(bind, column, hours, access_time):
+    bind.execute(sa.text(f"""
+        UPDATE attendance SET {column} = {_shift(bind, column, hours)}
+        WHERE {column} IS NOT NULL AND EXISTS (
+            SELECT 1 FROM access_log a
+            WHERE a.user_id = attendance.user_id AND {access_time} = attendance.{column}
+        )
+    """))
+
+
+def upgrade():
+    bind = op.get_bind()
+    _convert(bind, 'entry_time', -5, 'a."timestamp"')
+    _convert(bind, 'exit_time', -5, 'a."timestamp"')
+
+
+def downgrade():
+    # Vuelve a UTC las horas que corresponden a un acceso (ahora en hora local)
+    bind = op.get_bind()
+    lima_access_time = _shift(bind, 'a."timestamp"', -5)
+    _convert(bind, 'entry_time', 5, lima_access_time)
+    _convert(bind, 'exit_time', 5, lima_access_time)
@@ -0,0 +1,41 @@
+"""Add attendance_daily rollup
+
+Revision ID: e5b2c8d4f9a1
+Revises: c9e4a7f2d1b6
+Create Date: 2026-10-17 14:48:37.204615
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b2c8d4f9a1'
+down_revision = 'c9e4a7f2d1b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # El llenado inicial va en c2f7a4e9d1b5, con las horas ya en hora local
+    op.create_table('attendance_daily',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('work_date', sa.Date(), nullable=False),
+    sa.Column('first_entry', sa.DateTime(), nullable=True),
+    sa.Column('last_exit', sa.DateTime(), nullable=True),
+    sa.Column('estado_entrada', sa.String(length=50), nullable=True),
+    sa.Column('minutes_late', sa.Integer(), nullable=True),
+    sa.Column('worked_minutes', sa.Integer(), nullable=False),
+    sa.Column('punches', sa.Integer(), nullable=False),
+    sa.Column('late', sa.Boolean(), nullable=False),
+    sa.Column('open_entry', sa.Boolean(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user_iot.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'work_date')
+    )
+    op.create_index(op.f('ix_attendance_daily_work_date'), 'attendance_daily', ['work_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_attendance_daily_work_date'), table_name='attendance_daily')
+    op.drop_table('attendance_daily')
@@ -0,0 +1,42 @@
+"""Add composite and partial indexes for hot-path queries
+
+Revision ID: f1c3a9e7b2d4
+Revises: e5b2c8d4f9a1
+Create Date: 2026-10-17 15:21:09.662471
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c3a9e7b2d4'
+down_revision = 'e5b2c8d4f9a1'
+branch_labels = None
+depends_on = None
+
+
+DOOR_PERMITTED = sa.text("status = 'Permitido' AND sensor_type IN ('Huella', 'RFID')")
+OPEN_ATTENDANCE = sa.text("exit_time IS NULL")
+
+
+def upgrade():
+    # Último acceso permitido de puerta por usuario (en Postgres se crea en cada partición)
+    op.create_index('ix_access_log_door_permitted', 'access_log', ['user_id', 'timestamp'], unique=False,
+                    postgresql_where=DOOR_PERMITTED, sqlite_where=DOOR_PERMITTED)
+    # Asistencia del día por usuario y la abierta (decisión de auto-access)
+    op.create_index('ix_attendance_user_entry', 'attendance', ['user_id', 'entry_time'], unique=False)
+    op.create_index('ix_attendance_open', 'attendance', ['user_id', 'entry_time'], unique=False,
+                    postgresql_where=OPEN_ATTENDANCE, sqlite_where=OPEN_ATTENDANCE)
+    # Flush de intentos fallidos por (identifier, identifier_type)
+    op.create_index('ix_failed_attempt_identifier', 'failed_attempt', ['identifier', 'identifier_type'], unique=False)
+    # Horarios vigentes y choques por usuario
+    op.create_index('ix_user_schedule_user_dates', 'user_schedule', ['user_id', 'start_date', 'end_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_schedule_user_dates', table_name='user_schedule')
+    op.drop_index('ix_failed_attempt_identifier', table_name='failed_attempt')
+    op.drop_index('ix_attendance_open', table_name='attendance')
+    op.drop_index('ix_attendance_user_entry', table_name='attendance')
+    op.drop_index('ix_access_log_door_permitted', table_name='access_log')